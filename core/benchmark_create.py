@@ -1,16 +1,21 @@
-import time
+import os
+import contextlib
 import argparse
 import logging
 import subprocess
 import statistics
-from .utils.database import DatabaseConnection, get_database_url
+from .utils.database import get_database_url
 from .utils.delete_index import delete_index
 from .utils.create_index import get_create_index_query, get_index_name
 from .utils.create_external_index import create_external_index
 from .utils.numbers import convert_string_to_number, convert_number_to_string, convert_number_to_bytes
-from .utils.constants import Metric, Extension, Dataset
+from .utils.constants import Metric, Extension, Dataset, PARALLEL_BUILD_EXTENSIONS, EXTERNAL_PHASE_METRICS, CREATE_FOOTPRINT_METRICS, get_suggested_client_counts, get_vector_dim
+from .utils.names import get_table_name
+from .utils.disk_usage import get_current_wal_lsn, get_wal_bytes, get_relation_sizes, save_footprint
 from .utils import cli
-from .utils.process import save_result, get_experiment_results
+from .utils.process import save_result, save_trials, get_experiment_results, ResultSink
+from .utils.stats import DEFAULT_WARMUP_RUNS
+from .utils.build_profile import BuildProfiler
 from .utils.print import print_labels, print_row, get_title
 
 SUPPRESS_COMMAND = "SET client_min_messages TO WARNING"
@@ -22,26 +27,38 @@ def validate_extension(extension):
     assert extension != Extension.NONE
 
 
-def generate_disk_usage_result(extension, dataset, N):
-    index = get_index_name(dataset, N)
-    sql = f"SELECT pg_total_relation_size('{index}')"
-    with DatabaseConnection(extension) as conn:
-        disk_usage = conn.select_one(sql)[0]
-    return disk_usage
+def generate_footprint_result(extension, dataset, N, start_lsn=None):
+    """
+    Returns the bytes of every disk footprint component of the built index
+    and its table ('index' being the disk usage of the index), and of the
+    WAL generated since start_lsn when it is given.
+    """
+    footprint = get_relation_sizes(
+        extension, get_table_name(dataset, N), get_index_name(dataset, N))
+    if start_lsn is not None:
+        footprint['wal'] = get_wal_bytes(extension, start_lsn)
+    return footprint
 
 
 def generate_external_performance_result(extension, dataset, N, index_params):
-    t1 = time.time()
-    create_external_index(extension, dataset, N, index_params)
-    t2 = time.time()
-    return (t2 - t1) * 1000
+    """Returns the phase latencies and file size of create_external_index."""
+    return create_external_index(extension, dataset, N, index_params)
 
 
-def generate_performance_result(extension, dataset, N, index_params):
+def generate_performance_result(extension, dataset, N, index_params, profiler=None, workers=None):
+    """
+    Returns the latency of the index build in ms. With a BuildProfiler, the
+    build is profiled while it runs. With workers, the build uses that many
+    processes (see get_parallel_workers_sql).
+    """
     create_index_query = get_create_index_query(
-        extension, dataset, N, index_params)
-    result = subprocess.run(["psql", get_database_url(extension), "-c", SUPPRESS_COMMAND, "-c",
-                             "\\timing", "-c", create_index_query], capture_output=True, text=True)
+        extension, dataset, N, index_params, workers)
+    env = None
+    if profiler is not None:
+        env = {**os.environ, 'PGAPPNAME': profiler.application_name}
+    with profiler or contextlib.nullcontext():
+        result = subprocess.run(["psql", get_database_url(extension), "-c", SUPPRESS_COMMAND, "-c",
+                                 "\\timing", "-c", create_index_query], capture_output=True, text=True, env=env)
     lines = result.stdout.splitlines()
     for line in lines:
         if line.startswith("Time:"):
@@ -49,26 +66,81 @@ def generate_performance_result(extension, dataset, N, index_params):
             return time
 
 
-def generate_result(extension, dataset, N, index_params={}, count=10):
+def format_bytes(value):
+    return "-" if value is None else convert_number_to_bytes(value)
+
+
+def save_profile_results(profilers, **kwargs):
+    """
+    Saves the peak memory, CPU time and disk writes of profiled builds, with
+    the phase timeline of the last build as output. Metrics that could not
+    be sampled are not saved.
+    """
+    timeline = profilers[-1].get_timeline() or None
+    save_trials(Metric.CREATE_PEAK_MEMORY, [
+                profiler.peak_memory for profiler in profilers], out=timeline, **kwargs)
+    save_trials(Metric.CREATE_CPU_TIME, [
+                profiler.cpu_time for profiler in profilers], out=timeline, **kwargs)
+    save_trials(Metric.CREATE_WRITE_BYTES, [
+                profiler.write_bytes for profiler in profilers], out=timeline, **kwargs)
+
+
+def print_footprint(footprint):
+    print('footprint of the last build:', ', '.join(
+        f"{component} {convert_number_to_bytes(value)}" for component, value in footprint.items()))
+
+
+def format_latency(value):
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+def generate_result(extension, dataset, N, index_params={}, count=10, warmup=DEFAULT_WARMUP_RUNS):
+    """
+    Builds the index `count` times and saves the mean latency, disk usage
+    and build profile. Returns the mean latency and disk usage. External
+    index params are benchmarked with generate_external_result.
+    """
     validate_extension(extension)
 
+    if index_params.get('external'):
+        return generate_external_result(extension, dataset, N, index_params, count, warmup)
+
     delete_index(extension, dataset, N)
 
+    # Warm up the cache with index builds that are thrown away
+    for _ in range(warmup):
+        generate_performance_result(extension, dataset, N, index_params)
+        delete_index(extension, dataset, N)
+
     print(get_title(extension, index_params, dataset, N))
-    print_labels(f"Iteration /{count}", 'Latency (ms)', 'Disk usage')
+    print_labels(f"Iteration /{count}", 'Latency (ms)', 'Disk usage',
+                 'Peak memory', 'CPU time (s)', 'Disk writes')
 
     times = []
     disk_usages = []
+    footprints = []
+    profilers = []
 
     for iteration in range(count):
-        time = generate_performance_result(extension, dataset, N, index_params)
-        disk_usage = generate_disk_usage_result(extension, dataset, N)
+        profiler = BuildProfiler(extension)
+        start_lsn = get_current_wal_lsn(extension)
+        time = generate_performance_result(
+            extension, dataset, N, index_params, profiler)
+        footprint = generate_footprint_result(
+            extension, dataset, N, start_lsn)
+        disk_usage = footprint['index']
 
         times.append(time)
         disk_usages.append(disk_usage)
+        footprints.append(footprint)
+        profilers.append(profiler)
 
         print_row(str(iteration), "{:.2f}".format(time),
-                  convert_number_to_bytes(disk_usage))
+                  convert_number_to_bytes(disk_usage),
+                  format_bytes(profiler.peak_memory),
+                  "-" if profiler.cpu_time is None else "{:.2f}".format(
+                      profiler.cpu_time),
+                  format_bytes(profiler.write_bytes))
 
         delete_index(extension, dataset, N)
 
@@ -78,21 +150,28 @@ def generate_result(extension, dataset, N, index_params={}, count=10):
         latency_stddev = statistics.stdev(times)
         disk_usage_stddev = statistics.stdev(disk_usages)
 
+    create_kwargs = {
+        'extension': extension,
+        'index_params': index_params,
+        'dataset': dataset,
+        'n': convert_string_to_number(N),
+    }
+
     def save_create_result(metric_type, metric_value):
         save_result(
             metric_type=metric_type,
             metric_value=metric_value,
-            extension=extension,
-            index_params=index_params,
-            dataset=dataset,
-            n=convert_string_to_number(N),
+            **create_kwargs,
         )
 
-    save_create_result(Metric.CREATE_LATENCY, latency_average)
-    save_create_result(Metric.DISK_USAGE, disk_usage_average)
-    if count > 1:        
-        save_create_result(Metric.CREATE_LATENCY_STDDEV, latency_stddev)
-        save_create_result(Metric.DISK_USAGE_STDDEV, disk_usage_stddev)
+    with ResultSink():
+        save_trials(Metric.CREATE_LATENCY, times, **create_kwargs)
+        save_footprint(CREATE_FOOTPRINT_METRICS, footprints, create_kwargs['n'],
+                       get_vector_dim(dataset), **create_kwargs)
+        save_profile_results(profilers, **create_kwargs)
+        if count > 1:
+            save_create_result(Metric.CREATE_LATENCY_STDDEV, latency_stddev)
+            save_create_result(Metric.DISK_USAGE_STDDEV, disk_usage_stddev)
 
     print('average latency:',  f"{latency_average:.2f} ms")
     if count > 1:
@@ -100,8 +179,199 @@ def generate_result(extension, dataset, N, index_params={}, count=10):
     print('average disk usage:', convert_number_to_bytes(disk_usage_average))
     if count > 1:
         print('stddev disk usage:', convert_number_to_bytes(disk_usage_stddev))
+    print_footprint(footprints[-1])
+    if profilers[-1].phases:
+        print('phases of the last build:')
+        print(profilers[-1].get_timeline())
     print()
 
+    return latency_average, disk_usage_average
+
+
+def generate_external_result(extension, dataset, N, index_params, count=10, warmup=DEFAULT_WARMUP_RUNS):
+    """
+    Builds the index with lantern-cli `count` times and saves the mean
+    latency of every phase, the .usearch file size and the throughput in
+    rows per second of the whole build. The same index is built in the
+    database first, so that both builds are compared in the same run. When
+    the import is skipped (see SKIP_IMPORT), the external disk usage is None.
+    """
+    internal_index_params = {param: value for param, value in index_params.items()
+                             if param not in ('external', 'cpu')}
+    internal_latency, internal_disk_usage = generate_result(
+        extension, dataset, N, internal_index_params, count, warmup)
+
+    delete_index(extension, dataset, N)
+
+    for _ in range(warmup):
+        generate_external_performance_result(
+            extension, dataset, N, index_params)
+        delete_index(extension, dataset, N)
+
+    print(get_title(extension, index_params, dataset, N))
+    print_labels(f"Iteration /{count}", 'Export (ms)', 'Build (ms)', 'Transfer (ms)',
+                 'Import (ms)', 'Latency (ms)', 'File size', 'Disk usage')
+
+    results = []
+    footprints = []
+
+    for iteration in range(count):
+        start_lsn = get_current_wal_lsn(extension)
+        result = generate_external_performance_result(
+            extension, dataset, N, index_params)
+        results.append(result)
+
+        # Without the import (see SKIP_IMPORT) there is no index to measure
+        if result['import'] is not None:
+            footprints.append(generate_footprint_result(
+                extension, dataset, N, start_lsn))
+            disk_usage = convert_number_to_bytes(footprints[-1]['index'])
+        else:
+            disk_usage = '-'
+
+        print_row(str(iteration), *[format_latency(result[phase]) for phase in EXTERNAL_PHASE_METRICS],
+                  format_latency(result['latency']), convert_number_to_bytes(result['file_size']),
+                  disk_usage)
+
+        delete_index(extension, dataset, N)
+
+    n = convert_string_to_number(N)
+    with ResultSink():
+        save_external_trials(results, footprints, extension=extension, index_params=index_params,
+                             dataset=dataset, n=n)
+
+    latency_average = statistics.mean(
+        [result['latency'] for result in results])
+    disk_usage_average = statistics.mean(
+        [footprint['index'] for footprint in footprints]) if footprints else None
+
+    print_labels('Build', 'Latency (ms)', 'Disk usage', 'Speedup')
+    print_row('in-database', format_latency(internal_latency),
+              convert_number_to_bytes(internal_disk_usage), '1.00')
+    print_row('external', format_latency(latency_average),
+              '-' if disk_usage_average is None else convert_number_to_bytes(
+                  disk_usage_average),
+              "{:.2f}".format(internal_latency / latency_average))
+    print()
+
+    return latency_average, disk_usage_average
+
+
+def save_external_trials(results, footprints, **create_kwargs):
+    """
+    Saves the latency and throughput of repeated external builds (see
+    create_external_index), the mean of every phase that was measured, the
+    .usearch file size and the disk footprints of the imported indexes.
+    """
+    n = create_kwargs['n']
+    latencies = [result['latency'] for result in results]
+    save_trials(Metric.CREATE_LATENCY, latencies, **create_kwargs)
+    save_footprint(CREATE_FOOTPRINT_METRICS, footprints,
+                   n, get_vector_dim(create_kwargs['dataset']), **create_kwargs)
+    for phase, metric_type in EXTERNAL_PHASE_METRICS.items():
+        save_trials(metric_type, [result[phase]
+                    for result in results], **create_kwargs)
+    save_trials(Metric.EXTERNAL_INDEX_FILE_SIZE, [
+                result['file_size'] for result in results], **create_kwargs)
+    save_trials(Metric.CREATE_EXTERNAL_THROUGHPUT, [
+                n / (latency / 1000) for latency in latencies], **create_kwargs)
+
+
+def generate_parallel_result(extension, dataset, N, index_params={}, worker_counts=None, maintenance_work_mem_values=None, count=3, warmup=DEFAULT_WARMUP_RUNS):
+    """
+    Builds the index with every number of workers in worker_counts (1, 2,
+    4, ... cores by default), `count` times each, for every
+    maintenance_work_mem in maintenance_work_mem_values (MB). Workers are
+    the processes of a pgvector build, or the threads of lantern-cli for
+    lantern external indexes.
+
+    Reports the build time speedup over the fewest workers, and the
+    efficiency per worker: the speedup divided by the ratio of workers.
+    """
+    validate_extension(extension)
+    if extension not in PARALLEL_BUILD_EXTENSIONS:
+        raise ValueError(
+            f"Extension {extension.value} does not support parallel index builds")
+    external = extension == Extension.LANTERN
+    if external and not index_params.get('external'):
+        raise ValueError(
+            "Parallel lantern index builds are only supported for external indexes")
+
+    # Threads of external builds are set per sweep step instead
+    index_params = {param: value for param,
+                    value in index_params.items() if param != 'cpu'}
+    worker_counts = sorted(
+        worker_counts or get_suggested_client_counts(os.cpu_count() or 1))
+    maintenance_work_mem_values = maintenance_work_mem_values or [None]
+
+    def build(build_index_params, workers, profiler=None):
+        if external:
+            return generate_external_performance_result(extension, dataset, N, build_index_params | {'cpu': workers})['latency']
+        return generate_performance_result(extension, dataset, N, build_index_params, profiler, workers)
+
+    delete_index(extension, dataset, N)
+
+    for maintenance_work_mem in maintenance_work_mem_values:
+        build_index_params = index_params if maintenance_work_mem is None else index_params | {
+            'maintenance_work_mem': maintenance_work_mem}
+
+        for _ in range(warmup):
+            build(build_index_params, worker_counts[-1])
+            delete_index(extension, dataset, N)
+
+        print(get_title(extension, build_index_params, dataset, N))
+        print_labels('Workers', 'Latency (ms)', 'Speedup', 'Efficiency',
+                     'CPU time (s)', 'Peak memory')
+
+        baseline = None
+        with ResultSink():
+            for workers in worker_counts:
+                times = []
+                profilers = []
+                for _ in range(count):
+                    profiler = None if external else BuildProfiler(extension)
+                    times.append(build(build_index_params, workers, profiler))
+                    if profiler is not None:
+                        profilers.append(profiler)
+                    delete_index(extension, dataset, N)
+
+                times = [time for time in times if time is not None]
+                if len(times) == 0:
+                    logging.error(f"Index build with {workers} workers failed")
+                    continue
+
+                parallel_kwargs = {
+                    'extension': extension,
+                    'index_params': build_index_params,
+                    'dataset': dataset,
+                    'n': convert_string_to_number(N),
+                    'workers': workers,
+                }
+                save_trials(Metric.CREATE_LATENCY, times, **parallel_kwargs)
+                if len(profilers) > 0:
+                    save_profile_results(profilers, **parallel_kwargs)
+
+                latency = statistics.mean(times)
+                if baseline is None:
+                    baseline = (workers, latency)
+                speedup = baseline[1] / latency
+                efficiency = speedup * baseline[0] / workers
+                save_result(Metric.CREATE_SPEEDUP, speedup, **parallel_kwargs)
+                save_result(Metric.CREATE_EFFICIENCY,
+                            efficiency, **parallel_kwargs)
+
+                cpu_times = [
+                    profiler.cpu_time for profiler in profilers if profiler.cpu_time is not None]
+                print_row(
+                    str(workers),
+                    "{:.2f}".format(latency),
+                    "{:.2f}".format(speedup),
+                    "{:.2f}".format(efficiency),
+                    "{:.2f}".format(statistics.mean(cpu_times)) if cpu_times else "-",
+                    format_bytes(profilers[-1].peak_memory if profilers else None),
+                )
+        print()
+
 
 def print_results(dataset):
     metrics = [Metric.CREATE_LATENCY, Metric.CREATE_LATENCY_STDDEV,
@@ -135,6 +405,14 @@ if __name__ == '__main__':
     cli.add_logging(parser)
     parser.add_argument(
         '--count', type=int, default=10, help='number of iterations')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP_RUNS,
+                        help='number of index builds to throw away first')
+    parser.add_argument('--parallel-sweep', action='store_true',
+                        help='measure build speedup with every number of workers instead')
+    parser.add_argument('--workers', nargs='+', type=int,
+                        help='numbers of build processes or threads to sweep (default: 1, 2, 4, ... cores)')
+    parser.add_argument('--mem-values', nargs='+', type=int,
+                        help='maintenance_work_mem values in MB to sweep')
 
     # Parse arguments
     parsed_args = parser.parse_args()
@@ -146,4 +424,9 @@ if __name__ == '__main__':
     logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
 
     # Generate result
-    generate_result(extension, dataset, N, index_params, count=count)
+    if parsed_args.parallel_sweep:
+        generate_parallel_result(extension, dataset, N, index_params, worker_counts=parsed_args.workers,
+                                 maintenance_work_mem_values=parsed_args.mem_values, count=count, warmup=parsed_args.warmup)
+    else:
+        generate_result(extension, dataset, N, index_params,
+                        count=count, warmup=parsed_args.warmup)
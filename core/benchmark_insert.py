@@ -1,15 +1,20 @@
 import os
 import sys
+import time
 import argparse
 import logging
 from .utils.create_index import create_custom_index
-from .utils.constants import Extension, Metric, Dataset
+from .utils.constants import Extension, Metric, Dataset, INSERT_LATENCY_PERCENTILE_METRICS, INSERT_BULK_LATENCY_PERCENTILE_METRICS, INSERT_FOOTPRINT_METRICS, INSERT_BULK_FOOTPRINT_METRICS, get_suggested_client_counts, get_vector_dim
 from .utils import cli
 from .utils.names import get_table_name
-from .utils.process import save_result, get_experiment_results
-from .utils.database import DatabaseConnection, run_pgbench
+from .utils.process import save_result, get_experiment_results, ResultSink
+from .utils.database import DatabaseConnection
+from .utils.loadgen import run_load
 from .utils.print import print_labels, print_row, get_title
-from .utils.numbers import convert_string_to_number
+from .utils.numbers import convert_string_to_number, convert_number_to_bytes
+from .utils.timeseries import save_progress, save_timeseries
+from .utils.search_profile import SearchProfile
+from .utils.disk_usage import get_current_wal_lsn, get_wal_bytes, get_relation_sizes, save_footprint
 from .setup import create_table
 from . import benchmark_select
 
@@ -49,10 +54,23 @@ def get_latency_stddev_metric(bulk):
     return Metric.INSERT_BULK_LATENCY_STDDEV if bulk else Metric.INSERT_LATENCY_STDDEV
 
 
+def get_latency_percentile_metrics(bulk):
+    return INSERT_BULK_LATENCY_PERCENTILE_METRICS if bulk else INSERT_LATENCY_PERCENTILE_METRICS
+
+
 def get_tps_metric(bulk):
     return Metric.INSERT_BULK_TPS if bulk else Metric.INSERT_TPS
 
 
+def get_footprint_metrics(bulk):
+    return INSERT_BULK_FOOTPRINT_METRICS if bulk else INSERT_FOOTPRINT_METRICS
+
+
+def get_row_count(extension, table):
+    with DatabaseConnection(extension) as conn:
+        return conn.select_one(f"SELECT COUNT(*) FROM {table}")[0]
+
+
 def print_insert_title_and_labels(extension, index_params, dataset):
     print(get_title(extension, index_params, dataset))
     print_labels('N', 'TPS', 'Avg Latency (ms)', 'Stddev Latency (ms)')
@@ -80,7 +98,12 @@ def create_sequence(extension, bulk, start_N):
     return sequence_name
 
 
-def generate_result(extension, dataset, N_string, index_params={}, bulk=False, K=None, max_N=sys.maxsize):
+def setup_dest_table(extension, dataset, N_string, index_params, bulk=False, max_N=sys.maxsize):
+    """
+    Creates the benchmark table with the first tenth of the dataset rows and
+    its index, and a sequence pointing at the next row to insert. Returns the
+    source and benchmark tables, the sequence and the number of rows N.
+    """
     # Create benchmark table
     source_table = get_table_name(dataset, N_string)
     delete_dest_table(extension, dataset)
@@ -105,61 +128,131 @@ def generate_result(extension, dataset, N_string, index_params={}, bulk=False, K
         conn.execute(query)
     create_dest_index(extension, dataset, index_params)
 
+    return source_table, dest_table, sequence_name, N
+
+
+def get_insert_query(source_table, dest_table, sequence_name, bulk=False):
+    """Inserts the next row (or the next 100 rows with bulk) of the sequence."""
+    if bulk:
+        id_query = f"id >= next_id AND id < next_id + 100"
+    else:
+        id_query = f"id = next_id"
+    return f"""
+        WITH next_id_table AS (
+            SELECT nextval('{sequence_name}') AS next_id
+        )
+        INSERT INTO
+            {dest_table} (v)
+        SELECT v
+        FROM
+            {source_table}, next_id_table
+        WHERE
+            {id_query}
+    """
+
+
+def generate_result(extension, dataset, N_string, index_params={}, bulk=False, K=None, max_N=sys.maxsize, native=False, clients=None):
+    """
+    Benchmarks inserts into a copy of the dataset table, 1000 rows at a time.
+    Inserts run with one client per core, or with `clients` clients whose
+    results are then keyed by the client count.
+    """
+    source_table, dest_table, sequence_name, N = setup_dest_table(
+        extension, dataset, N_string, index_params, bulk, max_N)
+    start_N = int(N / 10)
+    start_rows = get_row_count(extension, dest_table)
+    start_lsn = get_current_wal_lsn(extension)
+
     print_insert_title_and_labels(extension, index_params, dataset)
     bulk_interval = min(N, 1000)
-    for iter_N in range(start_N, N, bulk_interval):
-        if bulk:
-            id_query = f"id >= next_id AND id < next_id + 100"
-            transactions = int(bulk_interval / 100)
-        else:
-            id_query = f"id = next_id"
-            transactions = bulk_interval
-        query = f"""
-            WITH next_id_table AS (
-                SELECT nextval('{sequence_name}') AS next_id
-            )
-            INSERT INTO
-                {dest_table} (v)
-            SELECT v
-            FROM
-                {source_table}, next_id_table
-            WHERE
-                {id_query}
-        """
-
-        cpu_count = os.cpu_count() or 1
-        stdout, stderr, tps, latency_average, latency_stddev = run_pgbench(
-            extension, query, clients=cpu_count, threads=cpu_count, transactions=transactions)
-
-        def save_insert_result(metric_type, metric_value):
-            save_result(
-                metric_type,
-                metric_value,
-                extension=extension,
-                index_params=index_params,
-                dataset=dataset,
-                n=convert_string_to_number(N_string),
-                out=stdout,
-                err=stderr,
-            )
-
-        save_insert_result(get_latency_metric(bulk), latency_average)
-        save_insert_result(get_latency_stddev_metric(bulk), latency_stddev)
-        save_insert_result(get_tps_metric(bulk), tps)
-
-        print_insert_row(iter_N, tps, latency_average, latency_stddev)
+    query = get_insert_query(source_table, dest_table, sequence_name, bulk)
+    series = 'insert bulk' if bulk else 'insert'
+    if clients is not None:
+        series += f" clients={clients}"
+    start_time = time.time()
+    with ResultSink():
+        for iter_N in range(start_N, N, bulk_interval):
+            if bulk:
+                transactions = int(bulk_interval / 100)
+            else:
+                transactions = bulk_interval
+            load_clients = clients or os.cpu_count() or 1
+            offset = time.time() - start_time
+            stdout, stderr, tps, latency_average, latency_stddev, latency_percentiles = run_load(
+                extension, query, clients=load_clients, threads=load_clients, transactions=transactions, native=native)
+
+            def save_insert_result(metric_type, metric_value):
+                save_result(
+                    metric_type,
+                    metric_value,
+                    extension=extension,
+                    index_params=index_params,
+                    dataset=dataset,
+                    n=convert_string_to_number(N_string),
+                    clients=clients or 0,
+                    out=stdout,
+                    err=stderr,
+                )
+
+            save_insert_result(get_latency_metric(bulk), latency_average)
+            save_insert_result(get_latency_stddev_metric(bulk), latency_stddev)
+            save_insert_result(get_tps_metric(bulk), tps)
+            for percentile, value in latency_percentiles.items():
+                save_insert_result(
+                    get_latency_percentile_metrics(bulk)[percentile], value)
+
+            # Progress samples within the interval and one sample per
+            # interval, so slowdowns as the index grows show up over time
+            n = convert_string_to_number(N_string)
+            save_progress(series, stderr + stdout, extension,
+                          index_params, dataset, n, offset=offset)
+            save_timeseries(f"{series} (per {bulk_interval} rows)", [(time.time() - start_time, tps, latency_average, latency_stddev, None)],
+                            extension, index_params, dataset, n)
+
+            print_insert_row(iter_N, tps, latency_average, latency_stddev)
+
+        # WAL per inserted row and index size per row of the grown table
+        footprint = get_relation_sizes(
+            extension, dest_table, get_dest_index_name(dataset)) if extension != Extension.NONE else {}
+        footprint['wal'] = get_wal_bytes(extension, start_lsn)
+        rows = get_row_count(extension, dest_table)
+        footprint_metrics = get_footprint_metrics(bulk)
+        footprint_kwargs = {
+            'extension': extension,
+            'index_params': index_params,
+            'dataset': dataset,
+            'n': convert_string_to_number(N_string),
+            'clients': clients or 0,
+        }
+        save_footprint({'wal': footprint_metrics['wal']}, [footprint], rows - start_rows,
+                       get_vector_dim(dataset), **footprint_kwargs)
+        save_footprint({'index': footprint_metrics['index']}, [footprint], rows,
+                       get_vector_dim(dataset), **footprint_kwargs)
 
     print()
+    print('WAL generated:', convert_number_to_bytes(footprint['wal']))
 
     if K is not None:
-        recall_after_insert = benchmark_select.generate_recall(
-            extension, dataset, N_string, K, base_table_name_input=dest_table)
+        with SearchProfile(extension, index_params):
+            recall_after_insert = benchmark_select.generate_recall(
+                extension, dataset, N_string, K, base_table_name_input=dest_table)
         save_result(Metric.RECALL_AFTER_INSERT, recall_after_insert,
-                    extension=extension, index_params=index_params, dataset=dataset, n=N, k=K)
+                    extension=extension, index_params=index_params, dataset=dataset, n=N, k=K, clients=clients or 0)
 
     delete_dest_table(extension, dataset)
 
 
+def generate_clients_sweep(extension, dataset, N_string, index_params={}, bulk=False, K=None, max_N=sys.maxsize, client_counts=None, native=False):
+    """
+    Runs the insert benchmark on a fresh table for every number of concurrent
+    clients in client_counts (1, 2, 4, ... 2x cores by default).
+    """
+    for clients in client_counts or get_suggested_client_counts():
+        print(f"clients: {clients}")
+        generate_result(extension, dataset, N_string, index_params, bulk=bulk,
+                        K=K, max_N=max_N, native=native, clients=clients)
+
+
 def print_results(dataset, bulk=False):
     metric_types = [get_tps_metric(bulk), get_latency_metric(
         bulk), get_latency_stddev_metric(bulk)]
@@ -181,6 +274,8 @@ if __name__ == '__main__':
     cli.add_dataset(parser)
     cli.add_N(parser)
     cli.add_logging(parser)
+    cli.add_native(parser)
+    cli.add_clients_sweep(parser)
 
     # Parse arguments
     parsed_args = parser.parse_args()
@@ -191,4 +286,9 @@ if __name__ == '__main__':
     logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
 
     # Generate result
-    generate_result(extension, dataset, N, index_params)
+    if parsed_args.clients_sweep:
+        generate_clients_sweep(extension, dataset, N, index_params,
+                               client_counts=parsed_args.clients, native=parsed_args.native)
+    else:
+        generate_result(extension, dataset, N, index_params,
+                        native=parsed_args.native)
@@ -0,0 +1,250 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from .utils.constants import Extension, Metric, Dataset, MIXED_SELECT_LATENCY_PERCENTILE_METRICS
+from .utils import cli
+from .utils.names import get_table_name
+from .utils.process import save_result, ResultSink
+from .utils.database import DatabaseConnection
+from .utils.loadgen import run_load
+from .utils.print import print_labels, print_row, get_title
+from .utils.numbers import convert_string_to_number
+from .utils.recall import get_recall_stats, to_padded_array, RECALL_QUERY_COUNT
+from .utils.timeseries import save_progress
+from .utils.search_profile import SearchProfile, apply_search_profile
+from .truth import fetch_vectors, get_exact_neighbors
+from .benchmark_select import get_performance_query
+from .benchmark_insert import setup_dest_table, get_insert_query, delete_dest_table, get_row_count
+
+MIXED_PHASE_DURATION = 10
+MIXED_MAX_PHASES = 30
+DEFAULT_WRITE_PCT = 5
+
+
+def get_client_split(clients, write_pct):
+    """Splits clients into (select clients, insert clients), keeping at least one of each."""
+    insert_clients = min(max(round(clients * write_pct / 100), 1), clients - 1)
+    return clients - insert_clients, insert_clients
+
+
+def get_insert_rate(select_tps, write_pct):
+    """Returns the insert TPS that makes write_pct% of all transactions inserts."""
+    return select_tps * write_pct / (100 - write_pct)
+
+
+def get_write_pct(select_tps, insert_tps):
+    """Returns the measured share of inserts in all transactions, in percent."""
+    return 100 * insert_tps / (select_tps + insert_tps)
+
+
+def generate_table_recall(extension, dataset, N, table, K, queries):
+    """
+    Returns the mean recall of the first RECALL_QUERY_COUNT queries against
+    the rows currently in table, whose exact neighbors are recomputed since
+    the table grows during the benchmark.
+    """
+    query_table_name = get_table_name(dataset, N, type='query')
+    truth_ids = get_exact_neighbors(extension, table, queries, K=K)
+
+    sql = f"""
+        SELECT
+            b.base_ids
+        FROM (
+            SELECT
+                id,
+                v
+            FROM
+                {query_table_name}
+            ORDER BY
+                id
+            LIMIT
+                {len(queries)}
+        ) q
+        JOIN LATERAL (
+            SELECT
+                array_agg(id ORDER BY distance) AS base_ids
+            FROM (
+                SELECT
+                    id,
+                    {table}.v <=> q.v AS distance
+                FROM
+                    {table}
+                ORDER BY
+                    {table}.v <=> q.v
+                LIMIT
+                    {K}
+            ) nearest
+        ) b ON TRUE
+        ORDER BY
+            q.id
+    """
+    with DatabaseConnection(extension) as conn:
+        apply_search_profile(conn)
+        base_ids = [row[0] for row in conn.select(sql)]
+
+    stats = get_recall_stats(to_padded_array(base_ids, K, -1), truth_ids, [K])
+    return stats[K]['mean']
+
+
+def generate_result(extension, dataset, N_string, index_params={}, K=10, write_pct=DEFAULT_WRITE_PCT, clients=None, bulk=False, duration=MIXED_PHASE_DURATION, max_phases=MIXED_MAX_PHASES, max_N=sys.maxsize, native=False):
+    """
+    Runs select clients and insert clients at the same time against the
+    benchmark table of benchmark_insert, in phases of `duration` seconds,
+    until every dataset row is inserted or max_phases phases ran. write_pct
+    is the share of transactions that insert: the selects run closed-loop
+    and the inserts are rate limited to get_insert_rate of the select TPS of
+    the previous phase, or of a select-only run before the first phase.
+    Clients are split in the same ratio (see get_client_split).
+
+    Select latency percentiles, TPS, the measured write share and recall are
+    reported for every phase as the index grows. The saved results are the
+    mean TPS and write share, the select latency percentiles of the worst
+    phase, the recall after the last phase and its drift from the recall
+    before the first one.
+    """
+    clients = max(clients or os.cpu_count() or 1, 2)
+    select_clients, insert_clients = get_client_split(clients, write_pct)
+
+    source_table, dest_table, sequence_name, N = setup_dest_table(
+        extension, dataset, N_string, index_params, bulk, max_N)
+    select_query = get_performance_query(
+        dataset, N_string, K, False, base_table_name_input=dest_table)
+    insert_query = get_insert_query(
+        source_table, dest_table, sequence_name, bulk)
+
+    _, queries = fetch_vectors(
+        extension, get_table_name(dataset, N_string, type='query'))
+    queries = queries[:RECALL_QUERY_COUNT]
+    with SearchProfile(extension, index_params):
+        initial_recall = generate_table_recall(
+            extension, dataset, N_string, dest_table, K, queries)
+
+    with SearchProfile(extension, index_params):
+        _, select_stderr, select_tps, _, _, _ = run_load(
+            extension, select_query, clients=select_clients, threads=select_clients, native=native, duration=duration)
+    if select_tps is None:
+        logging.error(f"Select-only run before the mixed workload failed: {select_stderr}")
+        delete_dest_table(extension, dataset)
+        return
+
+    print(get_title(extension, index_params, dataset, N_string))
+    print(f"K: {K}, write: {write_pct}%, select clients: {select_clients}, insert clients: {insert_clients}")
+    print_labels('Phase', 'Rows', 'Select TPS', 'Select p50 (ms)',
+                 'Select p99 (ms)', 'Insert TPS', 'Write %', 'Recall')
+    print_row('0', str(get_row_count(extension, dest_table)),
+              "{:.2f}".format(select_tps), '-', '-', '-', '-', "{:.2f}".format(initial_recall))
+
+    n = convert_string_to_number(N_string)
+    series = f"mixed write_pct={write_pct}"
+
+    phases = []
+    start_time = time.time()
+    with SearchProfile(extension, index_params), ThreadPoolExecutor(max_workers=2) as executor:
+        for phase in range(1, max_phases + 1):
+            offset = time.time() - start_time
+            select_future = executor.submit(
+                run_load, extension, select_query, clients=select_clients, threads=select_clients, native=native, duration=duration)
+            insert_future = executor.submit(
+                run_load, extension, insert_query, clients=insert_clients, threads=insert_clients, native=native,
+                rate=get_insert_rate(select_tps, write_pct), duration=duration)
+            select_stdout, select_stderr, select_tps, _, _, select_percentiles = select_future.result()
+            insert_stdout, insert_stderr, insert_tps, _, _, _ = insert_future.result()
+            save_progress(f"{series} select", select_stderr + select_stdout, extension,
+                          index_params, dataset, n, K, offset)
+            save_progress(f"{series} insert", insert_stderr + insert_stdout, extension,
+                          index_params, dataset, n, K, offset)
+            if select_tps is None or insert_tps is None:
+                logging.error(
+                    f"Mixed workload phase {phase} failed: {select_stderr}{insert_stderr}")
+                break
+
+            rows = get_row_count(extension, dest_table)
+            recall = generate_table_recall(
+                extension, dataset, N_string, dest_table, K, queries)
+            measured_write_pct = get_write_pct(select_tps, insert_tps)
+            phases.append((select_tps, insert_tps, measured_write_pct,
+                          select_percentiles, recall))
+            print_row(
+                str(phase),
+                str(rows),
+                "{:.2f}".format(select_tps),
+                "{:.2f}".format(select_percentiles[50]),
+                "{:.2f}".format(select_percentiles[99]),
+                "{:.2f}".format(insert_tps),
+                "{:.2f}".format(measured_write_pct),
+                "{:.2f}".format(recall),
+            )
+            if rows >= N:
+                break
+    print()
+
+    if len(phases) > 0:
+        with ResultSink():
+            def save_mixed_result(metric_type, metric_value):
+                save_result(
+                    metric_type,
+                    metric_value,
+                    extension=extension,
+                    index_params=index_params,
+                    dataset=dataset,
+                    n=convert_string_to_number(N_string),
+                    k=K,
+                    write_pct=write_pct,
+                )
+
+            select_tps_values, insert_tps_values, write_pct_values, percentile_values, recalls = zip(
+                *phases)
+            save_mixed_result(Metric.MIXED_SELECT_TPS,
+                              statistics.mean(select_tps_values))
+            save_mixed_result(Metric.MIXED_INSERT_TPS,
+                              statistics.mean(insert_tps_values))
+            save_mixed_result(Metric.MIXED_WRITE_PCT,
+                              statistics.mean(write_pct_values))
+            for percentile, metric in MIXED_SELECT_LATENCY_PERCENTILE_METRICS.items():
+                save_mixed_result(metric, max(
+                    percentiles[percentile] for percentiles in percentile_values))
+            save_mixed_result(Metric.RECALL_DURING_INSERT, recalls[-1])
+            save_mixed_result(Metric.RECALL_DRIFT_DURING_INSERT,
+                              recalls[-1] - initial_recall)
+
+    delete_dest_table(extension, dataset)
+
+
+if __name__ == '__main__':
+    # Set up parser
+    parser = argparse.ArgumentParser(description="benchmark mixed select and insert workload")
+    cli.add_extension(parser)
+    cli.add_index_params(parser)
+    cli.add_dataset(parser)
+    cli.add_N(parser)
+    cli.add_K(parser)
+    cli.add_logging(parser)
+    cli.add_native(parser)
+    parser.add_argument("--write-pct", type=int, default=DEFAULT_WRITE_PCT, choices=range(1, 100), metavar="[1-99]",
+                        help="Percentage of transactions that insert (e.g., 5 for a 95/5 workload)")
+    parser.add_argument("--clients", type=int,
+                        help="Total number of clients (default: one per core)")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Insert 100 rows per transaction")
+    parser.add_argument("--duration", type=int, default=MIXED_PHASE_DURATION,
+                        help="Seconds per phase")
+    parser.add_argument("--phases", type=int, default=MIXED_MAX_PHASES,
+                        help="Maximum number of phases")
+
+    # Parse arguments
+    parsed_args = parser.parse_args()
+    dataset = Dataset(parsed_args.dataset)
+    extension = Extension(parsed_args.extension)
+    index_params = cli.parse_index_params(extension, parsed_args)
+    N = parsed_args.N or '10k'
+    K = parsed_args.K or 10
+    logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
+
+    # Generate result
+    generate_result(extension, dataset, N, index_params, K=K, write_pct=parsed_args.write_pct,
+                    clients=parsed_args.clients, bulk=parsed_args.bulk, duration=parsed_args.duration,
+                    max_phases=parsed_args.phases, native=parsed_args.native)
@@ -1,20 +1,35 @@
 import re
+import math
 import logging
 import argparse
 import statistics
 from .utils.delete_index import delete_index
 from .utils.create_index import create_index
-from .utils.constants import Metric, Dataset, Extension, SUGGESTED_K_VALUES
-from .utils.database import DatabaseConnection, run_pgbench
-from .utils.process import save_result
+from .utils.constants import Metric, Dataset, Extension, SUGGESTED_K_VALUES, SUGGESTED_QPS_VALUES, get_suggested_client_counts, SELECT_LATENCY_PERCENTILE_METRICS, SELECT_BULK_LATENCY_PERCENTILE_METRICS
+from .utils.database import DatabaseConnection
+from .utils.loadgen import run_load
+from .utils.process import save_result, ResultSink
 from .utils import cli
-from .utils.names import get_table_name
+from .utils.names import get_table_name, get_index_name
 from .utils.numbers import convert_string_to_number
 from .utils.print import get_title, print_labels, print_row
+from .utils.recall import get_recall_stats, to_padded_array, RECALL_QUERY_COUNT
+from .utils.timeseries import save_progress
+from .utils.stats import get_trial_stats, DEFAULT_WARMUP_RUNS, DEFAULT_TRIALS
+from .utils.search_profile import SearchProfile, apply_search_profile, assert_index_scan
 
+QPS_SWEEP_CLIENTS = 32
+QPS_SWEEP_DURATION = 10
+SATURATION_MIN_ACHIEVED_RATIO = 0.95
+# p99 over the first step's p99 that marks the knee. Latency includes the
+# schedule lag once, so queueing past the knee shows up as it happens.
+SATURATION_P99_FACTOR = 5
+CLIENTS_SWEEP_TRANSACTIONS = 1000
 
-def get_performance_query(dataset, N, K, bulk, id=None):
-    base_table_name = get_table_name(dataset, N, type='base')
+
+def get_performance_query(dataset, N, K, bulk, id=None, base_table_name_input=None):
+    base_table_name = (base_table_name_input if base_table_name_input is not None else
+                       get_table_name(dataset, N, type='base'))
     query_table_name = get_table_name(dataset, N, type='query')
     N_number = convert_string_to_number(N)
     if bulk:
@@ -67,10 +82,31 @@ def get_performance_query(dataset, N, K, bulk, id=None):
     return query
 
 
-def generate_performance_result(extension, dataset, N, K, bulk):
+def get_clients_sweep_transactions(clients):
+    """Transactions per client, so every client count runs about as many transactions in total."""
+    return max(math.ceil(CLIENTS_SWEEP_TRANSACTIONS / clients), 15)
+
+
+def generate_performance_result(extension, dataset, N, K, bulk, native=False, clients=None, warmup=DEFAULT_WARMUP_RUNS, trials=DEFAULT_TRIALS):
+    """
+    Runs `warmup` load runs that are thrown away, then `trials` measured
+    ones. Every response holds the mean over the trials with its stddev and
+    95% CI (see get_trial_stats) and the output of the last trial.
+    """
     query = get_performance_query(dataset, N, K, bulk)
-    stdout, stderr, tps, latency_average, latency_stddev = run_pgbench(
-        extension, query)
+
+    def run():
+        if clients is None:
+            return run_load(extension, query, native=native)
+        return run_load(extension, query, clients=clients, threads=clients,
+                        transactions=get_clients_sweep_transactions(clients), native=native)
+
+    for _ in range(warmup):
+        run()
+    load_results = [run() for _ in range(max(trials, 1))]
+    stdout, stderr = load_results[-1][:2]
+    _, _, tps_values, latency_average_values, latency_stddev_values, latency_percentiles_values = zip(
+        *load_results)
 
     shared_response = {
         'out': stdout,
@@ -79,23 +115,57 @@ def generate_performance_result(extension, dataset, N, K, bulk):
 
     tps_response = {
         **shared_response,
-        'metric_value': tps,
+        **get_trial_stats(tps_values),
         'metric_type': Metric.SELECT_BULK_TPS if bulk else Metric.SELECT_TPS,
     }
 
     latency_average_response = {
         **shared_response,
-        'metric_value': latency_average,
+        **get_trial_stats(latency_average_values),
         'metric_type': Metric.SELECT_BULK_LATENCY if bulk else Metric.SELECT_LATENCY,
     }
 
     latency_stddev_response = {
         **shared_response,
-        'metric_value': latency_stddev,
+        **get_trial_stats(latency_stddev_values),
         'metric_type': Metric.SELECT_BULK_LATENCY_STDDEV if bulk else Metric.SELECT_LATENCY_STDDEV,
     }
 
-    return tps_response, latency_average_response, latency_stddev_response
+    percentile_metrics = SELECT_BULK_LATENCY_PERCENTILE_METRICS if bulk else SELECT_LATENCY_PERCENTILE_METRICS
+    latency_percentile_responses = {
+        percentile: {
+            **shared_response,
+            **get_trial_stats([latency_percentiles.get(percentile) for latency_percentiles in latency_percentiles_values]),
+            'metric_type': percentile_metrics[percentile],
+        }
+        for percentile in percentile_metrics
+        if any(percentile in latency_percentiles for latency_percentiles in latency_percentiles_values)
+    }
+
+    return tps_response, latency_average_response, latency_stddev_response, latency_percentile_responses
+
+
+def get_series_name(bulk):
+    return 'select bulk' if bulk else 'select'
+
+
+def save_performance_progress(series, tps_response, extension, index_params, dataset, N, K):
+    """Saves the progress samples of a load run as a time series."""
+    if tps_response is None:
+        return
+    save_progress(series, tps_response['err'] + tps_response['out'], extension,
+                  index_params, dataset, convert_string_to_number(N), K)
+
+
+def assert_search_index(extension, dataset, N):
+    """
+    Raises a RuntimeError unless the benchmarked queries scan the dataset's
+    index under the active search settings.
+    """
+    if extension == Extension.NONE:
+        return
+    assert_index_scan(extension, get_performance_query(
+        dataset, N, 1, False, id=1), get_index_name(dataset, N))
 
 
 def generate_utilization_result_one(extension, dataset, N, K, bulk, id):
@@ -104,6 +174,7 @@ def generate_utilization_result_one(extension, dataset, N, K, bulk, id):
         {get_performance_query(dataset, N, K, bulk, id)}
     """
     with DatabaseConnection(extension) as conn:
+        apply_search_profile(conn)
         response = conn.select(query)
 
     start_search = False
@@ -154,109 +225,329 @@ def generate_utilization_result(extension, dataset, N, K, bulk):
     return shared_hit_response, shared_hit_stddev_response, read_response, read_stddev_response
 
 
-def generate_recall(extension, dataset, N, K, base_table_name_input=None):
+def generate_recalls(extension, dataset, N, K_values, base_table_name_input=None, query_count=RECALL_QUERY_COUNT):
+    """
+    Computes recall statistics for every K in K_values from a single top
+    max(K) search per query (see get_recall_stats).
+    """
     base_table_name = (base_table_name_input if base_table_name_input is not None else
                        get_table_name(dataset, N, type='base'))
     truth_table_name = get_table_name(dataset, N, type='truth')
     query_table_name = get_table_name(dataset, N, type='query')
+    max_K = max(K_values)
 
-    with DatabaseConnection(extension) as conn:
-        query_ids_sql = f"SELECT id FROM {query_table_name} LIMIT 100"
-        query_ids = conn.select(query_ids_sql)
-        # conn.execute(f"SET hnsw.init_k={K}")
-
-        recall_at_k_sum = 0
-        sql = f"""
-            WITH q AS (
-                SELECT
-                    id,
-                    v
-                FROM
-                    {query_table_name}
-                LIMIT
-                    100
-            )
+    sql = f"""
+        WITH q AS (
             SELECT
-                array_agg(b.id) as base_ids,
-                t.indices[1:{K}] as truth_ids
-            FROM q
-            JOIN LATERAL (
+                id,
+                v
+            FROM
+                {query_table_name}
+            ORDER BY
+                id
+            LIMIT
+                {query_count}
+        )
+        SELECT
+            b.base_ids,
+            t.indices[1:{max_K}] as truth_ids
+        FROM q
+        JOIN LATERAL (
+            SELECT
+                array_agg(id ORDER BY distance) AS base_ids
+            FROM (
                 SELECT
-                    id
+                    id,
+                    {base_table_name}.v <=> q.v AS distance
                 FROM
                     {base_table_name}
                 ORDER BY
                     {base_table_name}.v <=> q.v
                 LIMIT
-                    {K}
-            ) b ON TRUE
-            LEFT JOIN
-                {truth_table_name} AS t
-            ON
-                t.id = q.id
-            GROUP BY
-                q.id,
-                t.indices
-        """
+                    {max_K}
+            ) nearest
+        ) b ON TRUE
+        LEFT JOIN
+            {truth_table_name} AS t
+        ON
+            t.id = q.id
+        ORDER BY
+            q.id
+    """
+    with DatabaseConnection(extension) as conn:
+        apply_search_profile(conn)
         results = conn.select(sql)
-        for base_ids, truth_ids in results:
-            truth_id_set = set(truth_ids)
-            # TODO: Fix dataset off by 1 error
-            recall_at_k_result = max(
-                len(truth_id_set.intersection(base_ids)),
-                len(truth_id_set.intersection(map(lambda id: id - 1, base_ids))))
-            recall_at_k_sum += recall_at_k_result
 
-    # Calculate the average recall for this K
-    recall_at_k = recall_at_k_sum / len(query_ids) / K
-    return recall_at_k
+    base_ids, truth_ids = zip(*results)
+    return get_recall_stats(
+        to_padded_array(base_ids, max_K, -1),
+        to_padded_array(truth_ids, max_K, -2),
+        K_values)
 
 
-def generate_result(extension, dataset, N, K_values, index_params={}, bulk=False, skip_index=False):
+def generate_recall(extension, dataset, N, K, base_table_name_input=None):
+    recalls = generate_recalls(
+        extension, dataset, N, [K], base_table_name_input=base_table_name_input)
+    return recalls[K]['mean']
+
+
+def format_response(response):
+    return "-" if response is None else "{:.2f}".format(response['metric_value'])
+
+
+def generate_result(extension, dataset, N, K_values, index_params={}, bulk=False, skip_index=False, multi_K=False, latency_per_K=False, native=False, warmup=DEFAULT_WARMUP_RUNS, trials=DEFAULT_TRIALS):
+    """
+    Benchmarks select performance, recall and buffer usage for every K.
+
+    With multi_K, buffer usage is measured once with LIMIT max(K) and used
+    for every K, since ANN indexes return results in distance order. Latency
+    and TPS are then only measured for max(K), unless latency_per_K is set.
+
+    With native, latency is measured with the asyncio load generator
+    instead of pgbench. Latency and TPS are the mean of `trials` load runs
+    after `warmup` runs that are thrown away.
+    """
     if not skip_index:
         delete_index(extension, dataset, N)
         create_index(extension, dataset, N, index_params=index_params)
 
-    print(get_title(extension, index_params, dataset, N, bulk))
-    print_labels('K', 'Recall', 'TPS', 'Avg Latency (ms)',
-                 'Stddev Latency (ms)', 'Buffer Shared Hit', 'Buffer Read')
-
-    for K in K_values:
-        def save_select_result(response):
-            save_result(
-                **response,
-                extension=extension,
-                index_params=index_params,
-                dataset=dataset,
-                n=convert_string_to_number(N),
-                k=K,
-            )
+    with SearchProfile(extension, index_params):
+        assert_search_index(extension, dataset, N)
+
+        print(get_title(extension, index_params, dataset, N, bulk))
+        print_labels('K', 'Recall', 'Recall (p5)', 'TPS', 'Avg Latency (ms)',
+                     'Stddev Latency (ms)', 'p99 Latency (ms)', 'Buffer Shared Hit', 'Buffer Read')
+
+        recalls = generate_recalls(extension, dataset, N, K_values)
+
+        max_K = max(K_values)
+        if multi_K:
+            max_K_utilization_responses = generate_utilization_result(
+                extension, dataset, N, max_K, bulk)
+            if not latency_per_K:
+                max_K_performance_responses = generate_performance_result(
+                    extension, dataset, N, max_K, bulk, native, warmup=warmup, trials=trials)
+                save_performance_progress(get_series_name(
+                    bulk), max_K_performance_responses[0], extension, index_params, dataset, N, max_K)
+
+        with ResultSink():
+            for K in K_values:
+                def save_select_result(response):
+                    if response is None:
+                        return
+                    save_result(
+                        **response,
+                        extension=extension,
+                        index_params=index_params,
+                        dataset=dataset,
+                        n=convert_string_to_number(N),
+                        k=K,
+                    )
+
+                if not multi_K or latency_per_K:
+                    performance_responses = generate_performance_result(
+                        extension, dataset, N, K, bulk, native, warmup=warmup, trials=trials)
+                    save_performance_progress(get_series_name(
+                        bulk), performance_responses[0], extension, index_params, dataset, N, K)
+                elif K == max_K:
+                    performance_responses = max_K_performance_responses
+                else:
+                    performance_responses = (None, None, None, {})
+                tps_response, latency_average_response, latency_stddev_response, latency_percentile_responses = performance_responses
+                recall = recalls[K]['mean']
+                if multi_K:
+                    utilization_responses = max_K_utilization_responses
+                else:
+                    utilization_responses = generate_utilization_result(
+                        extension, dataset, N, K, bulk)
+                shared_hit_response, shared_hit_stddev_response, read_response, read_stddev_response = utilization_responses
+                save_select_result(tps_response)
+                save_select_result(latency_average_response)
+                save_select_result(latency_stddev_response)
+                for latency_percentile_response in latency_percentile_responses.values():
+                    save_select_result(latency_percentile_response)
+                save_select_result(
+                    {'metric_type': Metric.RECALL_AFTER_CREATE, 'metric_value': recall})
+                save_select_result(
+                    {'metric_type': Metric.RECALL_AFTER_CREATE_P5, 'metric_value': recalls[K]['p5']})
+                save_select_result(
+                    {'metric_type': Metric.RECALL_AFTER_CREATE_P50, 'metric_value': recalls[K]['p50']})
+                save_select_result(
+                    {'metric_type': Metric.RECALL_AFTER_CREATE_MIN, 'metric_value': recalls[K]['min']})
+                save_select_result(shared_hit_response)
+                save_select_result(shared_hit_stddev_response)
+                save_select_result(read_response)
+                save_select_result(read_stddev_response)
+
+                print_row(
+                    str(K),
+                    "{:.2f}".format(recall),
+                    "{:.2f}".format(recalls[K]['p5']),
+                    format_response(tps_response),
+                    format_response(latency_average_response),
+                    format_response(latency_stddev_response),
+                    format_response(latency_percentile_responses.get(99)),
+                    format_response(shared_hit_response),
+                    format_response(read_response),
+                )
+        print()
+
+    if not skip_index:
+        delete_index(extension, dataset, N)
+
+
+def is_saturated(step, first_step, max_p99=None):
+    """
+    Returns whether a (target_qps, achieved_qps, p99) step of a sweep falls
+    short of its target rate or its p99 latency exceeds max_p99 (by default
+    SATURATION_P99_FACTOR times the p99 of the first step).
+    """
+    target_qps, achieved_qps, p99 = step
+    max_p99 = max_p99 or SATURATION_P99_FACTOR * first_step[2]
+    return achieved_qps < SATURATION_MIN_ACHIEVED_RATIO * target_qps or p99 > max_p99
+
+
+def get_saturation_qps(steps, max_p99=None):
+    """
+    Returns the achieved QPS of the last step of an open-loop sweep before
+    the latency/throughput knee, or None if even the first step saturated.
+
+    steps are (target_qps, achieved_qps, p99) tuples in order of increasing
+    target rate (see is_saturated).
+    """
+    saturation_qps = None
+    for step in steps:
+        if is_saturated(step, steps[0], max_p99):
+            break
+        saturation_qps = step[1]
+    return saturation_qps
 
-        tps_response, latency_average_response, latency_stddev_response = generate_performance_result(
-            extension, dataset, N, K, bulk)
-        recall = generate_recall(extension, dataset, N, K)
-        shared_hit_response, shared_hit_stddev_response, read_response, read_stddev_response = generate_utilization_result(
-            extension, dataset, N, K, bulk)
-        save_select_result(tps_response)
-        save_select_result(latency_average_response)
-        save_select_result(latency_stddev_response)
-        save_select_result(
-            {'metric_type': Metric.RECALL_AFTER_CREATE, 'metric_value': recall})
-        save_select_result(shared_hit_response)
-        save_select_result(shared_hit_stddev_response)
-        save_select_result(read_response)
-        save_select_result(read_stddev_response)
-
-        print_row(
-            str(K),
-            "{:.2f}".format(recall),
-            "{:.2f}".format(tps_response['metric_value']),
-            "{:.2f}".format(latency_average_response['metric_value']),
-            "{:.2f}".format(latency_stddev_response['metric_value']),
-            "{:.2f}".format(shared_hit_response['metric_value']),
-            "{:.2f}".format(read_response['metric_value']),
-        )
-    print()
+
+def generate_qps_sweep(extension, dataset, N, K_values, index_params={}, bulk=False, skip_index=False, qps_values=SUGGESTED_QPS_VALUES, max_p99=None, clients=QPS_SWEEP_CLIENTS, duration=QPS_SWEEP_DURATION, native=False):
+    """
+    Steps the target arrival rate through qps_values (open loop, as with
+    pgbench --rate) and records the achieved QPS and latency percentiles of
+    every step, keyed by the target rate. Latency is measured from the
+    scheduled start of every transaction, so queueing delay past the knee
+    shows up in the tail. The sweep stops at the first saturated step (see
+    get_saturation_qps) and the saturation QPS is saved for every K.
+    """
+    if not skip_index:
+        delete_index(extension, dataset, N)
+        create_index(extension, dataset, N, index_params=index_params)
+
+    with SearchProfile(extension, index_params):
+        assert_search_index(extension, dataset, N)
+
+        percentile_metrics = SELECT_BULK_LATENCY_PERCENTILE_METRICS if bulk else SELECT_LATENCY_PERCENTILE_METRICS
+
+        for K in K_values:
+            print(get_title(extension, index_params, dataset, N, bulk))
+            print(f"K: {K}")
+            print_labels('Target QPS', 'Achieved QPS', 'Avg Latency (ms)',
+                         'p50 Latency (ms)', 'p99 Latency (ms)', 'Max Latency (ms)')
+
+            query = get_performance_query(dataset, N, K, bulk)
+            steps = []
+            with ResultSink():
+                def save_sweep_result(metric_type, metric_value, qps=0, out=None, err=None):
+                    save_result(
+                        metric_type,
+                        metric_value,
+                        extension=extension,
+                        index_params=index_params,
+                        dataset=dataset,
+                        n=convert_string_to_number(N),
+                        k=K,
+                        qps=qps,
+                        out=out,
+                        err=err,
+                    )
+
+                for qps in sorted(qps_values):
+                    transactions = max(math.ceil(qps * duration / clients), 1)
+                    stdout, stderr, achieved_qps, latency_average, _, latency_percentiles = run_load(
+                        extension, query, clients=clients, threads=clients, transactions=transactions, native=native, rate=qps)
+                    if achieved_qps is None or 99 not in latency_percentiles:
+                        logging.error(
+                            f"Load run at {qps} QPS failed: {stderr}")
+                        break
+
+                    save_sweep_result(Metric.SELECT_ACHIEVED_QPS, achieved_qps,
+                                      qps=qps, out=stdout, err=stderr)
+                    save_progress(f"{get_series_name(bulk)} qps={qps}", stderr + stdout, extension,
+                                  index_params, dataset, convert_string_to_number(N), K)
+                    for percentile, value in latency_percentiles.items():
+                        save_sweep_result(
+                            percentile_metrics[percentile], value, qps=qps)
+                    print_row(
+                        str(qps),
+                        "{:.2f}".format(achieved_qps),
+                        "{:.2f}".format(latency_average),
+                        "{:.2f}".format(latency_percentiles[50]),
+                        "{:.2f}".format(latency_percentiles[99]),
+                        "{:.2f}".format(latency_percentiles[100]),
+                    )
+
+                    steps.append((qps, achieved_qps, latency_percentiles[99]))
+                    if is_saturated(steps[-1], steps[0], max_p99):
+                        break
+
+                saturation_qps = get_saturation_qps(steps, max_p99)
+                if saturation_qps is not None:
+                    save_sweep_result(Metric.SELECT_SATURATION_QPS, saturation_qps)
+            print(f"Saturation QPS: {'-' if saturation_qps is None else '{:.2f}'.format(saturation_qps)}")
+            print()
+
+    if not skip_index:
+        delete_index(extension, dataset, N)
+
+
+def generate_clients_sweep(extension, dataset, N, K_values, index_params={}, bulk=False, skip_index=False, client_counts=None, native=False, warmup=DEFAULT_WARMUP_RUNS, trials=DEFAULT_TRIALS):
+    """
+    Measures select TPS and latency with every number of concurrent clients
+    in client_counts (1, 2, 4, ... 2x cores by default), one client per
+    thread. Results are keyed by the client count.
+    """
+    client_counts = client_counts or get_suggested_client_counts()
+    if not skip_index:
+        delete_index(extension, dataset, N)
+        create_index(extension, dataset, N, index_params=index_params)
+
+    with SearchProfile(extension, index_params):
+        assert_search_index(extension, dataset, N)
+
+        for K in K_values:
+            print(get_title(extension, index_params, dataset, N, bulk))
+            print(f"K: {K}")
+            print_labels('Clients', 'TPS', 'Avg Latency (ms)',
+                         'Stddev Latency (ms)', 'p99 Latency (ms)')
+            with ResultSink():
+                for clients in client_counts:
+                    tps_response, latency_average_response, latency_stddev_response, latency_percentile_responses = generate_performance_result(
+                        extension, dataset, N, K, bulk, native, clients, warmup, trials)
+                    save_performance_progress(f"{get_series_name(bulk)} clients={clients}",
+                                              tps_response, extension, index_params, dataset, N, K)
+                    for response in [tps_response, latency_average_response, latency_stddev_response, *latency_percentile_responses.values()]:
+                        if response['metric_value'] is None:
+                            continue
+                        save_result(
+                            **response,
+                            extension=extension,
+                            index_params=index_params,
+                            dataset=dataset,
+                            n=convert_string_to_number(N),
+                            k=K,
+                            clients=clients,
+                        )
+                    print_row(
+                        str(clients),
+                        format_response(tps_response),
+                        format_response(latency_average_response),
+                        format_response(latency_stddev_response),
+                        format_response(latency_percentile_responses.get(99)),
+                    )
+            print()
 
     if not skip_index:
         delete_index(extension, dataset, N)
@@ -271,6 +562,19 @@ if __name__ == '__main__':
     cli.add_N(parser)
     cli.add_K_values(parser)
     cli.add_logging(parser)
+    parser.add_argument('--multi-K', action='store_true',
+                        help='measure recall and buffer usage for all K values in one pass')
+    parser.add_argument('--latency-per-K', action='store_true',
+                        help='with --multi-K, still measure latency separately for every K')
+    cli.add_native(parser)
+    cli.add_trials(parser)
+    parser.add_argument('--qps-sweep', action='store_true',
+                        help='step the target arrival rate and find the saturation QPS instead')
+    parser.add_argument('--qps', nargs='+', type=int, default=SUGGESTED_QPS_VALUES,
+                        help='target arrival rates of the QPS sweep')
+    parser.add_argument('--max-p99', type=float,
+                        help='p99 latency (ms) above which the QPS sweep counts as saturated')
+    cli.add_clients_sweep(parser)
 
     # Parse arguments
     parsed_args = parser.parse_args()
@@ -282,4 +586,14 @@ if __name__ == '__main__':
     logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
 
     # Generate result
-    generate_result(extension, dataset, N, K_values, index_params)
+    if parsed_args.clients_sweep:
+        generate_clients_sweep(extension, dataset, N, K_values, index_params,
+                               client_counts=parsed_args.clients, native=parsed_args.native,
+                               warmup=parsed_args.warmup, trials=parsed_args.trials)
+    elif parsed_args.qps_sweep:
+        generate_qps_sweep(extension, dataset, N, K_values, index_params,
+                           qps_values=parsed_args.qps, max_p99=parsed_args.max_p99, native=parsed_args.native)
+    else:
+        generate_result(extension, dataset, N, K_values, index_params,
+                        multi_K=parsed_args.multi_K, latency_per_K=parsed_args.latency_per_K, native=parsed_args.native,
+                        warmup=parsed_args.warmup, trials=parsed_args.trials)
@@ -1,7 +1,15 @@
-from .utils.constants import Extension
+from .utils.constants import Extension, Metric, Dataset, VALID_DATASET_SIZES
 from .utils.numbers import convert_string_to_number
-from .benchmark_select import generate_result
+from .utils.delete_index import delete_index
+from .utils.process import save_result, get_experiment_result, ResultSink
+from .utils.search_profile import SEARCH_INDEX_PARAMS, SearchProfile
+from .utils import cli
+from .benchmark_select import generate_result, generate_recalls
+from .benchmark_select import generate_performance_result as generate_select_performance_result
+from .benchmark_create import generate_performance_result, generate_footprint_result
 import math
+import logging
+import argparse
 
 HYPERPARAMETER_SEARCH_K = 5
 
@@ -27,8 +35,333 @@ def get_extension_hyperparameters(extension, N):
     return hyperparameters
 
 
+def get_build_params(extension, hyperparameter):
+    """Returns the params of a hyperparameter that are used to build the index."""
+    return {param: value for param, value in hyperparameter.items()
+            if param not in SEARCH_INDEX_PARAMS[extension]}
+
+
+def group_by_build_params(extension, hyperparameters):
+    """
+    Groups hyperparameters that share their build params, in order of first
+    appearance, as (build params, hyperparameters) tuples. Search params
+    (see SEARCH_INDEX_PARAMS) are query-time settings, so every group needs
+    one index build. Lantern and Neon read ef from the index, so every one
+    of their hyperparameters is its own group.
+    """
+    groups = []
+    for hyperparameter in hyperparameters:
+        build_params = get_build_params(extension, hyperparameter)
+        for group_build_params, group in groups:
+            if group_build_params == build_params:
+                group.append(hyperparameter)
+                break
+        else:
+            groups.append((build_params, [hyperparameter]))
+    return groups
+
+
+def generate_build_result(extension, dataset, N, build_params):
+    """Builds the index, saves its build latency and disk usage and returns them."""
+    latency = generate_performance_result(extension, dataset, N, build_params)
+    disk_usage = generate_footprint_result(extension, dataset, N)['index']
+    build_kwargs = {
+        'extension': extension,
+        'index_params': build_params,
+        'dataset': dataset,
+        'n': convert_string_to_number(N),
+    }
+    with ResultSink():
+        if latency is not None:
+            save_result(Metric.CREATE_LATENCY, latency, **build_kwargs)
+        save_result(Metric.DISK_USAGE, disk_usage, **build_kwargs)
+    return latency, disk_usage
+
+
 def run_hyperparameter_search(extension, dataset, N, bulk=False):
+    """
+    Builds the index once per group of hyperparameters with the same build
+    params (see group_by_build_params) and benchmarks every search param
+    setting of the group on it.
+    """
     hyperparameters = get_extension_hyperparameters(extension, N)
-    for hyperparameter in hyperparameters:
-        generate_result(
-            extension, dataset, N, [HYPERPARAMETER_SEARCH_K], index_params=hyperparameter, bulk=bulk)
\ No newline at end of file
+    if extension == Extension.NONE:
+        for hyperparameter in hyperparameters:
+            generate_result(
+                extension, dataset, N, [HYPERPARAMETER_SEARCH_K], index_params=hyperparameter, bulk=bulk)
+        return
+
+    for build_params, group in group_by_build_params(extension, hyperparameters):
+        delete_index(extension, dataset, N)
+        generate_build_result(extension, dataset, N, build_params)
+        for hyperparameter in group:
+            generate_result(
+                extension, dataset, N, [HYPERPARAMETER_SEARCH_K], index_params=hyperparameter, bulk=bulk, skip_index=True)
+        delete_index(extension, dataset, N)
+
+
+"""
+Recall-targeted optimizer
+"""
+
+# Search param values the optimizer binary searches over, in increasing
+# order of recall and latency
+SEARCH_PARAM_VALUES = {
+    'probes': [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024],
+    'ef': [10, 16, 20, 32, 40, 64, 100, 128, 200, 256, 400, 512, 800, 1000],
+}
+
+# Costs the optimizer minimizes, by name on the command line
+OPTIMIZER_OBJECTIVES = {
+    'latency': Metric.SELECT_LATENCY,
+    'create': Metric.CREATE_LATENCY,
+    'disk': Metric.DISK_USAGE,
+}
+
+# Dataset sizes of successive halving, the last being the target N
+OPTIMIZER_RUNGS = 3
+
+# The smallest rung is at least N / OPTIMIZER_MAX_SCALE
+OPTIMIZER_MAX_SCALE = 100
+
+# Fraction of candidates that survive every rung is 1 / OPTIMIZER_ETA
+OPTIMIZER_ETA = 2
+
+
+def get_rung_sizes(dataset, N, rungs=OPTIMIZER_RUNGS):
+    """
+    Returns up to `rungs` dataset sizes, evenly spaced among the valid
+    sizes of the dataset between N / OPTIMIZER_MAX_SCALE and N, ending at N.
+    """
+    n = convert_string_to_number(N)
+    sizes = [size for size in VALID_DATASET_SIZES[dataset]
+             if n / OPTIMIZER_MAX_SCALE <= convert_string_to_number(size) < n]
+    if rungs < 2 or len(sizes) == 0:
+        return [N]
+    step = len(sizes) / (rungs - 1)
+    indices = sorted(set(int(i * step) for i in range(rungs - 1)))
+    return [sizes[i] for i in indices] + [N]
+
+
+def get_search_values(extension, build_params, K):
+    """
+    Returns the search param of the extension with the values to search
+    over on an index built with build_params, or (None, []) if the
+    extension has no search param.
+    """
+    if len(SEARCH_INDEX_PARAMS[extension]) == 0:
+        return None, []
+    param = next(iter(SEARCH_INDEX_PARAMS[extension]))
+    values = SEARCH_PARAM_VALUES[param]
+    if param == 'probes':
+        values = [value for value in values if value <= build_params['lists']]
+    if param == 'ef':
+        # An index scan returns at most ef_search rows
+        values = [value for value in values if value >= K]
+    return param, values
+
+
+def binary_search_min_value(values, get_recall, target_recall):
+    """
+    Returns the smallest value whose recall meets target_recall with its
+    recall, assuming recall does not decrease with the value, or the largest
+    value with its recall if none does. get_recall is called O(log n) times.
+    """
+    recalls = {}
+
+    def recall_at(i):
+        if i not in recalls:
+            recalls[i] = get_recall(values[i])
+        return recalls[i]
+
+    low, high = 0, len(values) - 1
+    if recall_at(high) < target_recall:
+        return values[high], recalls[high]
+    while low < high:
+        mid = (low + high) // 2
+        if recall_at(mid) >= target_recall:
+            high = mid
+        else:
+            low = mid + 1
+    return values[low], recall_at(low)
+
+
+def search_hyperparameter(extension, dataset, N, K, target_recall, build_params, group):
+    """
+    Finds the cheapest search param setting of the built index that meets
+    target_recall, saving the recall of every setting tried. Returns the
+    hyperparameter with its recall. Without a search param (e.g. Lantern),
+    the only hyperparameter of the group is measured.
+    """
+    def get_recall(hyperparameter):
+        with SearchProfile(extension, hyperparameter):
+            recall = generate_recalls(extension, dataset, N, [K])[K]['mean']
+        with ResultSink():
+            save_result(Metric.RECALL_AFTER_CREATE, recall, extension=extension, index_params=hyperparameter,
+                        dataset=dataset, n=convert_string_to_number(N), k=K)
+        logging.info(f"{hyperparameter}: recall {recall:.3f}")
+        return recall
+
+    param, values = get_search_values(extension, build_params, K)
+    if param is None:
+        return group[0], get_recall(group[0])
+    value, recall = binary_search_min_value(
+        values, lambda value: get_recall({**build_params, param: value}), target_recall)
+    return {**build_params, param: value}, recall
+
+
+def evaluate_candidate(extension, dataset, N, K, target_recall, build_params, group, final):
+    """
+    Builds the index and finds its cheapest setting that meets
+    target_recall. Latency is measured with a single load run, except on
+    the final rung, where the setting is benchmarked in full (see
+    benchmark_select.generate_result).
+    """
+    delete_index(extension, dataset, N)
+    create_latency, disk_usage = generate_build_result(
+        extension, dataset, N, build_params)
+    hyperparameter, recall = search_hyperparameter(
+        extension, dataset, N, K, target_recall, build_params, group)
+    if final:
+        generate_result(extension, dataset, N, [K],
+                        index_params=hyperparameter, skip_index=True)
+        latency = get_experiment_result(
+            Metric.SELECT_LATENCY, extension, hyperparameter, dataset, N, K)
+    else:
+        with SearchProfile(extension, hyperparameter):
+            latency = generate_select_performance_result(
+                extension, dataset, N, K, False, warmup=0, trials=1)[1]['metric_value']
+        if latency is not None:
+            with ResultSink():
+                save_result(Metric.SELECT_LATENCY, latency, extension=extension, index_params=hyperparameter,
+                            dataset=dataset, n=convert_string_to_number(N), k=K)
+    delete_index(extension, dataset, N)
+    return {
+        'hyperparameter': hyperparameter,
+        'recall': recall,
+        'latency': latency,
+        'create': create_latency,
+        'disk': disk_usage,
+    }
+
+
+def rank_candidates(results, target_recall, objective):
+    """
+    Orders candidate indices by their result: those meeting target_recall
+    by cost, then the rest by recall.
+    """
+    def key(i):
+        result = results[i]
+        if result['recall'] >= target_recall and result[objective] is not None:
+            return (0, result[objective])
+        return (1, -result['recall'])
+    return sorted(results, key=key)
+
+
+def get_pareto_front(results, objective):
+    """Returns the results that no other result beats in both recall and cost."""
+    def dominates(a, b):
+        return (a['recall'] >= b['recall'] and a[objective] <= b[objective]
+                and (a['recall'] > b['recall'] or a[objective] < b[objective]))
+    results = [result for result in results if result[objective] is not None]
+    return [result for result in results
+            if not any(dominates(other, result) for other in results)]
+
+
+def save_pareto_fronts(extension, dataset, K, evaluated, objective):
+    """
+    Saves whether every evaluated candidate, keyed by (rung N, candidate),
+    is on the recall / cost Pareto front of its rung as PARETO_OPTIMAL.
+    Costs are only comparable on the same N, so every rung has its own
+    front, over every candidate built on it.
+    """
+    with ResultSink():
+        for rung_N in dict.fromkeys(rung_N for rung_N, _ in evaluated):
+            results = [result for (N, _), result in evaluated.items()
+                       if N == rung_N]
+            front = get_pareto_front(results, objective)
+            for result in results:
+                save_result(Metric.PARETO_OPTIMAL, 1.0 if result in front else 0.0, extension=extension,
+                            index_params=result['hyperparameter'], dataset=dataset,
+                            n=convert_string_to_number(rung_N), k=K)
+
+
+def run_hyperparameter_optimizer(extension, dataset, N, K, target_recall, objective='latency', rungs=OPTIMIZER_RUNGS):
+    """
+    Returns the cheapest hyperparameter by objective (see
+    OPTIMIZER_OBJECTIVES) whose recall@K meets target_recall on N, or None.
+
+    Every build group of the grid (see group_by_build_params) is a
+    candidate. Candidates are built on the smallest rung (see
+    get_rung_sizes), and 1 / OPTIMIZER_ETA of them move on to the next rung,
+    ranked by the cost of their cheapest setting that meets the target. On
+    every index, the search param is binary searched for that setting.
+    Survivors of the last rung are benchmarked on N. Whether each
+    evaluated candidate is on the recall / cost Pareto front of its rung is
+    saved as PARETO_OPTIMAL (see save_pareto_fronts). Tables of every rung
+    size must be set up.
+    """
+    if extension == Extension.NONE:
+        raise ValueError('Hyperparameters cannot be optimized without an index')
+    if objective not in OPTIMIZER_OBJECTIVES:
+        raise ValueError(f"Invalid objective: {objective}")
+
+    rung_sizes = get_rung_sizes(dataset, N, rungs)
+    candidates = None
+    evaluated = {}
+    for rung, rung_N in enumerate(rung_sizes):
+        final = rung == len(rung_sizes) - 1
+        groups = group_by_build_params(
+            extension, get_extension_hyperparameters(extension, rung_N))
+        if candidates is None:
+            candidates = list(range(len(groups)))
+        results = {}
+        for i in candidates:
+            build_params, group = groups[i]
+            results[i] = evaluate_candidate(
+                extension, dataset, rung_N, K, target_recall, build_params, group, final)
+            evaluated[(rung_N, i)] = results[i]
+        ranked = rank_candidates(results, target_recall, objective)
+        logging.info(f"Rung {rung_N}: " + ', '.join(
+            f"{results[i]['hyperparameter']} (recall {results[i]['recall']:.3f})" for i in ranked))
+        if not final:
+            candidates = ranked[:max(
+                1, math.ceil(len(ranked) / OPTIMIZER_ETA))]
+
+    save_pareto_fronts(extension, dataset, K, evaluated, objective)
+
+    best = results[ranked[0]]
+    if best['recall'] < target_recall:
+        print(f"No hyperparameter of {extension.value} reaches recall {target_recall} at K={K} "
+              f"(best: {best['hyperparameter']} with recall {best['recall']:.3f})")
+        return None
+    print(f"Cheapest {objective} at recall {target_recall}, K={K}: {best['hyperparameter']} "
+          f"(recall {best['recall']:.3f}, {OPTIMIZER_OBJECTIVES[objective].value}: {best[objective]})")
+    return best['hyperparameter']
+
+
+if __name__ == '__main__':
+    # Set up parser
+    parser = argparse.ArgumentParser(
+        description="find the cheapest hyperparameters that meet a target recall")
+    cli.add_extension(parser)
+    cli.add_dataset(parser)
+    cli.add_N(parser)
+    cli.add_K(parser)
+    cli.add_logging(parser)
+    parser.add_argument('--target-recall', type=float, required=True,
+                        help='recall@K that the hyperparameters must meet')
+    parser.add_argument('--objective', choices=list(OPTIMIZER_OBJECTIVES), default='latency',
+                        help='cost to minimize: select latency, create latency or disk usage')
+    parser.add_argument('--rungs', type=int, default=OPTIMIZER_RUNGS,
+                        help='number of dataset sizes of successive halving, ending at N')
+
+    # Parse arguments
+    parsed_args = parser.parse_args()
+    dataset = Dataset(parsed_args.dataset)
+    extension = Extension(parsed_args.extension)
+    cli.validate_N(parser, dataset, parsed_args.N)
+    logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
+
+    run_hyperparameter_optimizer(extension, dataset, parsed_args.N, parsed_args.K or HYPERPARAMETER_SEARCH_K,
+                                 parsed_args.target_recall, parsed_args.objective, parsed_args.rungs)
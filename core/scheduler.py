@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import logging
+import argparse
+import tomllib
+from .utils.constants import Extension, Dataset, Metric, SUGGESTED_INDEX_PARAMS, VALID_DATASET_SIZES
+from .utils.database import DatabaseConnection
+from .utils.numbers import convert_string_to_number
+from .utils.process import dump_index_params
+from .utils.run import get_git_sha
+from .utils.create_index import create_index
+from .utils.delete_index import delete_index
+from .utils.stats import DEFAULT_WARMUP_RUNS
+from .utils import cli
+from .setup import setup_extension, setup_runs_table, setup_results_table, setup_timeseries_table
+from .hyperparameter_search import group_by_build_params
+from . import benchmark_create, benchmark_insert, benchmark_select
+
+PHASES = ['setup', 'create', 'select', 'insert']
+
+DEFAULT_DATAPATH = '/app/data'
+
+
+def load_plan(path):
+    """
+    Reads an experiment plan from a TOML file, e.g.
+
+        extensions = ["pgvector_hnsw", "lantern"]
+        datasets = ["sift"]
+        N = ["10k", "100k"]
+        K = [5, 10]
+        phases = ["setup", "create", "select", "insert"]
+
+        [index_params]
+        pgvector_hnsw = [{m = 16, ef_construction = 64, ef = 40}]
+
+    Extensions without index params use SUGGESTED_INDEX_PARAMS. Optional
+    keys are bulk (select and insert with bulk queries), create_count
+    (builds per create benchmark), warmup and datapath.
+    """
+    with open(path, 'rb') as f:
+        plan = tomllib.load(f)
+
+    phases = plan.get('phases', PHASES)
+    if any(phase not in PHASES for phase in phases):
+        raise ValueError(
+            f"Invalid phases: {', '.join(phases)}. Valid phases are: {', '.join(PHASES)}")
+
+    extensions = [Extension(extension) for extension in plan['extensions']]
+    datasets = [Dataset(dataset) for dataset in plan['datasets']]
+    for dataset in datasets:
+        invalid_N = [N for N in plan['N']
+                     if N not in VALID_DATASET_SIZES[dataset]]
+        if invalid_N:
+            raise ValueError(
+                f"Invalid N for {dataset.value}: {', '.join(invalid_N)}")
+
+    index_params = plan.get('index_params', {})
+    return {
+        'extensions': extensions,
+        'datasets': datasets,
+        'N': sorted(plan['N'], key=convert_string_to_number),
+        'K': plan.get('K', [5]),
+        'phases': phases,
+        'index_params': {
+            extension: index_params.get(extension.value, SUGGESTED_INDEX_PARAMS[extension])
+            for extension in extensions
+        },
+        'bulk': plan.get('bulk', False),
+        'create_count': plan.get('create_count', 10),
+        'warmup': plan.get('warmup', DEFAULT_WARMUP_RUNS),
+        'datapath': plan.get('datapath', DEFAULT_DATAPATH),
+    }
+
+
+def get_cell_id(phase, extension, dataset, N=None, index_params=None):
+    parts = [phase, extension.value, dataset.value]
+    if N is not None:
+        parts.append(N)
+    if index_params is not None:
+        parts.append(dump_index_params(index_params))
+    return '/'.join(parts)
+
+
+def make_cell(phase, extension, dataset, N=None, index_params=None, build=None, depends=None):
+    return {
+        'id': get_cell_id(phase, extension, dataset, N, index_params),
+        'phase': phase,
+        'extension': extension,
+        'dataset': dataset,
+        'N': N,
+        'index_params': index_params,
+        'build': build,
+        'depends': depends,
+    }
+
+
+def expand_plan(plan):
+    """
+    Expands the plan into cells in an order that respects their
+    dependencies: setup of an extension and dataset, then for every N the
+    create benchmarks, the select benchmarks grouped by build params (see
+    group_by_build_params), which share one index build, and the insert
+    benchmarks, which build their own index on a copy of the table.
+    Every cell depends on at most one other cell, named by 'depends'.
+    """
+    cells = []
+    phases = plan['phases']
+    for extension in plan['extensions']:
+        index_params_list = plan['index_params'][extension]
+        for dataset in plan['datasets']:
+            setup_id = None
+            if 'setup' in phases:
+                setup = make_cell('setup', extension, dataset)
+                setup['N_values'] = plan['N']
+                cells.append(setup)
+                setup_id = setup['id']
+            for N in plan['N']:
+                if 'create' in phases and extension != Extension.NONE:
+                    for index_params in index_params_list:
+                        cells.append(make_cell(
+                            'create', extension, dataset, N, index_params, depends=setup_id))
+                if 'select' in phases:
+                    for build_params, group in group_by_build_params(extension, index_params_list):
+                        build = None if extension == Extension.NONE else get_cell_id(
+                            'build', extension, dataset, N, build_params)
+                        for index_params in group:
+                            cell = make_cell('select', extension, dataset, N, index_params,
+                                             build=build, depends=setup_id)
+                            cell['build_params'] = build_params
+                            cells.append(cell)
+                if 'insert' in phases:
+                    for index_params in index_params_list:
+                        cells.append(make_cell(
+                            'insert', extension, dataset, N, index_params, depends=setup_id))
+    return cells
+
+
+def get_result_metric(cell, plan):
+    """Returns the metric whose results show that a cell is done."""
+    if cell['phase'] == 'create':
+        return Metric.CREATE_LATENCY
+    if cell['phase'] == 'select':
+        return Metric.SELECT_BULK_LATENCY if plan['bulk'] else Metric.SELECT_LATENCY
+    if cell['phase'] == 'insert':
+        return benchmark_insert.get_latency_metric(plan['bulk'])
+    return None
+
+
+def is_cell_saved(cell, plan, git_sha):
+    """
+    Returns whether experiment_results has the results of the cell from a
+    run of the same commit, for every K of the plan if the cell selects.
+    Results of sweeps (QPS, clients, mixed writes, parallel workers) of the
+    same configuration do not count.
+    """
+    metric = get_result_metric(cell, plan)
+    if metric is None or git_sha is None:
+        return False
+    K_values = plan['K'] if cell['phase'] == 'select' else [0]
+    sql = """
+        SELECT
+            COUNT(DISTINCT r.k)
+        FROM
+            experiment_results r
+        JOIN
+            experiment_runs USING (run_id)
+        WHERE
+            experiment_runs.git_sha = %s
+            AND r.metric_type = %s
+            AND r.extension = %s
+            AND r.index_params = %s
+            AND r.dataset = %s
+            AND r.n = %s
+            AND r.k = ANY(%s)
+            AND r.clients = 0
+            AND r.qps = 0
+            AND r.write_pct = 0
+            AND r.workers = 0
+    """
+    data = (git_sha, metric.value, cell['extension'].value, dump_index_params(cell['index_params']),
+            cell['dataset'].value, convert_string_to_number(cell['N']), K_values)
+    with DatabaseConnection() as conn:
+        return conn.select_one(sql, data=data)[0] == len(K_values)
+
+
+def load_state(path, git_sha):
+    """
+    Reads the scheduler state: the cells done by the current commit and the
+    seconds every cell took in any run. Cells done by another commit are
+    run again.
+    """
+    state = {'git_sha': git_sha, 'done': [], 'durations': {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved_state = json.load(f)
+        state['durations'] = saved_state.get('durations', {})
+        if saved_state.get('git_sha') == git_sha:
+            state['done'] = saved_state.get('done', [])
+    return state
+
+
+def save_state(path, state):
+    # Written to a temporary file first, so an interruption never corrupts the state
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def estimate_seconds(cell, durations):
+    """
+    Returns the seconds the cell took last time or, if it never ran, the
+    mean of the cells of the same phase that did, or None.
+    """
+    if cell['id'] in durations:
+        return durations[cell['id']]
+    phase_durations = [duration for cell_id, duration in durations.items()
+                       if cell_id.startswith(f"{cell['phase']}/")]
+    if len(phase_durations) == 0:
+        return None
+    return sum(phase_durations) / len(phase_durations)
+
+
+def format_eta(cells, durations):
+    estimates = [estimate_seconds(cell, durations) for cell in cells]
+    known = [estimate for estimate in estimates if estimate is not None]
+    eta = time.strftime('%H:%M:%S', time.gmtime(sum(known)))
+    unknown = len(estimates) - len(known)
+    if unknown > 0:
+        eta += f" + {unknown} cells without previous times"
+    return eta
+
+
+def run_cell(cell, plan):
+    extension = cell['extension']
+    dataset = cell['dataset']
+    N = cell['N']
+    index_params = cell['index_params']
+    if cell['phase'] == 'setup':
+        setup_extension(plan['datapath'], extension,
+                        {dataset: cell['N_values']})
+    elif cell['phase'] == 'create':
+        benchmark_create.generate_result(extension, dataset, N, index_params,
+                                         count=plan['create_count'], warmup=plan['warmup'])
+    elif cell['phase'] == 'select':
+        benchmark_select.generate_result(extension, dataset, N, plan['K'], index_params=index_params,
+                                         bulk=plan['bulk'], skip_index=True, warmup=plan['warmup'])
+    elif cell['phase'] == 'insert':
+        benchmark_insert.generate_result(
+            extension, dataset, N, index_params, bulk=plan['bulk'])
+
+
+def run_plan(plan_path, state_path=None, dry_run=False):
+    """
+    Runs every cell of the plan that is not done yet, in the order of
+    expand_plan, and records finished cells in the state file so that an
+    interrupted plan resumes where it stopped. A cell is done when the state
+    file or experiment_results has it for the current commit. When a cell
+    fails, the cells that depend on it, or on its index build, are skipped.
+    """
+    plan = load_plan(plan_path)
+    state_path = state_path or f"{plan_path}.state.json"
+    git_sha = get_git_sha()
+    state = load_state(state_path, git_sha)
+
+    setup_runs_table()
+    setup_results_table()
+    setup_timeseries_table()
+
+    cells = expand_plan(plan)
+    pending = [cell for cell in cells
+               if cell['id'] not in state['done'] and not is_cell_saved(cell, plan, git_sha)]
+    print(f"{len(cells) - len(pending)} of {len(cells)} cells done, ETA {format_eta(pending, state['durations'])}")
+    if dry_run:
+        for cell in pending:
+            print(cell['id'])
+        return
+
+    failed = set()
+    failed_builds = set()
+    built = None
+    for i, cell in enumerate(pending):
+        if cell['depends'] in failed or cell['build'] in failed_builds:
+            logging.warning(
+                f"Skipping {cell['id']} after a failed dependency")
+            failed.add(cell['id'])
+            continue
+        print(
+            f"[{i + 1}/{len(pending)}] {cell['id']} (ETA {format_eta(pending[i:], state['durations'])})")
+
+        start = time.time()
+        try:
+            # Selects of one build group follow each other, so each group builds its index once
+            if built is not None and built[0] != cell['build']:
+                delete_index(*built[1:])
+                built = None
+            if cell['build'] is not None and built is None:
+                delete_index(cell['extension'],
+                             cell['dataset'], cell['N'])
+                create_index(cell['extension'], cell['dataset'],
+                             cell['N'], index_params=cell['build_params'])
+                built = (cell['build'], cell['extension'],
+                         cell['dataset'], cell['N'])
+            run_cell(cell, plan)
+        except Exception as e:
+            logging.error(f"{cell['id']} failed: {e}")
+            failed.add(cell['id'])
+            if cell['build'] is not None and built is None:
+                failed_builds.add(cell['build'])
+            continue
+
+        state['durations'][cell['id']] = time.time() - start
+        state['done'].append(cell['id'])
+        save_state(state_path, state)
+
+    if built is not None:
+        delete_index(*built[1:])
+    print(f"{len(pending) - len(failed)} cells ran, {len(failed)} failed or skipped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="run the cells of an experiment plan that are not done yet")
+    parser.add_argument('plan', help='TOML experiment plan (see load_plan)')
+    parser.add_argument('--state',
+                        help='state file of finished cells (default: <plan>.state.json)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the cells that would run with the ETA instead')
+    cli.add_logging(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    run_plan(args.plan, args.state, args.dry_run)
@@ -1,12 +1,18 @@
 import os
 import argparse
 import logging
-import urllib.request
-from typing import Dict, List
+from typing import Dict, List, Optional
 from .utils.database import DatabaseConnection
-from .utils.constants import Extension, EXTENSION_NAMES, EXTENSIONS_USING_VECTOR, get_vector_dim, SUGGESTED_DATASET_SIZES, Dataset, VALID_DATASETS
+from .utils.constants import Extension, EXTENSION_NAMES, SUGGESTED_DATASET_SIZES, Dataset, VALID_DATASETS
 from .utils.names import get_table_name
+from .utils.load import parallel_copy_csv, parallel_copy_vectors, get_column_name, get_column_type, drop_primary_key, add_primary_key, has_base_truth_ids, DEFAULT_LOAD_WORKERS
+from .utils.numbers import convert_string_to_number
+from .utils.vector_files import find_vector_file
+from .utils.download import get_dataset_cache
+from .utils.process import RESULT_KEY_COLUMNS, CONFIGURATION_KEY_COLUMNS, LATEST_RESULTS_VIEW
+from .utils.timeseries import TIMESERIES_KEY_COLUMNS
 from .utils import cli
+from .truth import generate_truth_file
 
 
 def table_exists(extension, table):
@@ -45,29 +51,14 @@ def has_rows(extension, table):
 
 def get_create_table_query(extension, table_name):
     """Returns the SQL query to create a table."""
-    if 'truth' in table_name:
-        return f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id SERIAL PRIMARY KEY,
-                indices INTEGER[]
-            );
-        """
-    vector_size = get_vector_dim(table_name)
-    if extension in EXTENSIONS_USING_VECTOR:
-        return f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id SERIAL PRIMARY KEY,
-                v VECTOR({vector_size}),
-                r REAL[{vector_size}]
-            );
-        """
-    else:
-        return f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id SERIAL PRIMARY KEY,
-                v REAL[{vector_size}]
-            );
-        """
+    column = get_column_name(table_name)
+    column_type = get_column_type(extension, table_name)
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id SERIAL PRIMARY KEY,
+            {column} {column_type}
+        );
+    """
 
 
 def create_table(extension, table_name):
@@ -77,65 +68,127 @@ def create_table(extension, table_name):
         conn.execute(sql)
 
 
-def insert_table(extension, dest_table, source_csv):
+def insert_table(extension, dest_table, source_csv, workers=DEFAULT_LOAD_WORKERS):
     """Inserts data from a CSV file into the specified table."""
-    if 'truth' in dest_table:
-        sql = f"COPY {dest_table} (indices) FROM '{source_csv}' WITH csv"
-    elif extension in EXTENSIONS_USING_VECTOR:
-        sql = f"COPY {dest_table} (r) FROM '{source_csv}' WITH csv"
-    else:
-        sql = f"COPY {dest_table} (v) FROM '{source_csv}' WITH csv"
-    with DatabaseConnection(extension) as conn:
-        with open(source_csv, 'r') as f:
-            conn.copy_expert(sql, f)
-        if not 'truth' in dest_table and extension in EXTENSIONS_USING_VECTOR:
-            sql = f"UPDATE {dest_table} SET v = r; ALTER TABLE {dest_table} DROP COLUMN r;"
-            conn.execute(sql)
+    parallel_copy_csv(extension, dest_table, source_csv, workers=workers)
 
 
-def create_or_download_table(datapath, extension, table_name):
+def create_or_download_table(datapath, extension, table_name, workers=DEFAULT_LOAD_WORKERS, source=None):
     """
     Creates a table if it does not exist, and downloads and inserts data if the table 
-    is empty. 
+    is empty. A local {table_name}.fvecs/.ivecs/.bvecs/.npy file is loaded
+    instead of the CSV when one exists in datapath. CSVs are fetched from
+    `source` (see DatasetCache), defaulting to $DATASET_MIRROR or DATASET_URL.
+    Truth tables always hold base table ids, so ones loaded with 0-based ids
+    are reloaded.
     """
 
     create_table(extension, table_name)
 
+    if 'truth' in table_name and has_rows(extension, table_name) and not has_base_truth_ids(extension, table_name):
+        logging.warning(
+            f"Table {table_name} holds 0-based truth ids from an older load. Reloading it.")
+        with DatabaseConnection(extension) as conn:
+            conn.execute(f"TRUNCATE {table_name};")
+
     if has_rows(extension, table_name):
         logging.info(
             f"Table {table_name} exists for extension {extension.value} and has data. Skipping.")
 
+    elif find_vector_file(datapath, table_name) is not None:
+        # Binary vector files are preferred over CSV when present
+        source_file = find_vector_file(datapath, table_name)
+        parallel_copy_vectors(extension, table_name,
+                              source_file, workers=workers)
+
+        logging.info(
+            f"Inserted data from {source_file} into table {table_name} for extension {extension.value}")
+
     else:
-        # Download data if it doesn't exist
-        source_file = os.path.join(datapath, f"{table_name}.csv")
-        if not os.path.exists(source_file):
-            logging.info(
-                f"Source file {source_file} does not exist. Downloading...")
-            if not os.path.exists(datapath):
-                os.makedirs(datapath)
-            urllib.request.urlretrieve(
-                f"https://storage.googleapis.com/lanterndata/datasets/{table_name}.csv", source_file)
-            logging.info("Download complete.")
+        # Download data if it doesn't exist, or wait for a prefetch to finish
+        source_file = get_dataset_cache(
+            datapath, source).get(f"{table_name}.csv")
 
         # Insert data into the table
-        insert_table(extension, table_name, source_file)
+        insert_table(extension, table_name, source_file, workers=workers)
 
         logging.info(
             f"Inserted data into table {table_name} for extension {extension.value}")
 
 
-def create_or_download_tables(datapath: str, extension: Extension, dataset_sizes: Dict[Dataset, List[str]]):
+def derive_tables(datapath, extension, dataset, N, source_N, workers=DEFAULT_LOAD_WORKERS):
+    """
+    Creates the base table for N as a prefix copy of the base table for a
+    larger source_N, and its truth table from an exact k-NN search over the
+    query table. The truth is cached as an .ivecs file in datapath so other
+    extensions load it instead of recomputing it.
+    """
+    source_table = get_table_name(dataset, source_N, type='base')
+    base_table = get_table_name(dataset, N, type='base')
+    truth_table = get_table_name(dataset, N, type='truth')
+    query_table = get_table_name(dataset, N, type='query')
+    N_number = convert_string_to_number(N)
+
+    create_table(extension, base_table)
+    if has_rows(extension, base_table):
+        logging.info(
+            f"Table {base_table} exists for extension {extension.value} and has data. Skipping.")
+    else:
+        drop_primary_key(extension, base_table)
+        with DatabaseConnection(extension) as conn:
+            conn.execute(f"""
+                INSERT INTO {base_table} (id, v)
+                SELECT id, v
+                FROM {source_table}
+                WHERE id <= {N_number};
+            """)
+        add_primary_key(extension, base_table, N_number)
+        logging.info(
+            f"Created table {base_table} from the first {N} rows of {source_table} for extension {extension.value}")
+
+    create_table(extension, truth_table)
+    if not has_rows(extension, truth_table) and find_vector_file(datapath, truth_table) is None:
+        generate_truth_file(extension, source_table, query_table, N_number,
+                            os.path.join(datapath, f"{truth_table}.ivecs"))
+    create_or_download_table(datapath, extension,
+                             truth_table, workers=workers)
+
+
+def create_or_download_tables(datapath: str, extension: Extension, dataset_sizes: Dict[Dataset, List[str]], workers: int = DEFAULT_LOAD_WORKERS, source: Optional[str] = None, derive: bool = True):
+    """
+    Creates and fills the base, query and truth tables for every dataset
+    size. With derive, only the largest base and truth tables of each
+    dataset are downloaded and the smaller ones are derived from them.
+    """
     table_names = set()
+    derived_sizes = []
     for dataset, N_values in dataset_sizes.items():
+        largest_N = max(N_values, key=convert_string_to_number)
         for N in N_values:
-            table_names.add(get_table_name(dataset, N, type='base'))
-            table_names.add(get_table_name(dataset, N, type='truth'))
             table_names.add(get_table_name(dataset, N, type='query'))
-    for table_name in table_names:
-        create_or_download_table(datapath, extension, table_name)
+            if derive and N != largest_N:
+                derived_sizes.append((dataset, N, largest_N))
+            else:
+                table_names.add(get_table_name(dataset, N, type='base'))
+                table_names.add(get_table_name(dataset, N, type='truth'))
+    table_names = sorted(table_names)
+
+    # Download every missing file in the background while tables load, and
+    # stop downloading if a load fails
+    missing_files = [
+        f"{table_name}.csv" for table_name in table_names
+        if not has_rows(extension, table_name) and find_vector_file(datapath, table_name) is None]
+    with get_dataset_cache(datapath, source) as cache:
+        cache.prefetch(missing_files)
+        for table_name in table_names:
+            create_or_download_table(
+                datapath, extension, table_name, workers=workers, source=source)
 
+    for dataset, N, largest_N in derived_sizes:
+        derive_tables(datapath, extension, dataset, N, largest_N, workers)
 
-def setup_extension(datapath: str, extension: Extension, dataset_sizes: Dict[Dataset, List[str]] = SUGGESTED_DATASET_SIZES):
+
+def setup_extension(datapath: str, extension: Extension, dataset_sizes: Dict[Dataset, List[str]] = SUGGESTED_DATASET_SIZES, workers: int = DEFAULT_LOAD_WORKERS, source: Optional[str] = None, derive: bool = True):
     # Enables the extension if it is not already enabled
     extension_name = EXTENSION_NAMES[extension]
     logging.info(f"Enabling extension {extension_name}...")
@@ -144,14 +197,16 @@ def setup_extension(datapath: str, extension: Extension, dataset_sizes: Dict[Dat
     logging.info(f"Extension {extension_name} is enabled.")
 
     # Ensure all tables are created and populated
-    create_or_download_tables(datapath, extension, dataset_sizes)
+    create_or_download_tables(
+        datapath, extension, dataset_sizes, workers, source, derive)
 
 
 # Create the experiment_results table if it doesn't exist
 # Useful for notebook experiments
 def setup_results_table():
+    unique_result_sql = f"UNIQUE ({', '.join(RESULT_KEY_COLUMNS)})"
     with DatabaseConnection() as conn:
-        sql = """
+        sql = f"""
             CREATE TABLE IF NOT EXISTS experiment_results (
                 id SERIAL PRIMARY KEY,
                 extension TEXT NOT NULL,
@@ -159,12 +214,93 @@ def setup_results_table():
                 dataset TEXT NOT NULL,
                 n INTEGER NOT NULL,
                 k INTEGER NOT NULL DEFAULT 0,
+                qps INTEGER NOT NULL DEFAULT 0,
+                clients INTEGER NOT NULL DEFAULT 0,
+                write_pct INTEGER NOT NULL DEFAULT 0,
+                workers INTEGER NOT NULL DEFAULT 0,
+                run_id TEXT NOT NULL DEFAULT '',
                 out TEXT,
                 err TEXT,
                 metric_type TEXT NOT NULL,
                 metric_value DOUBLE PRECISION NOT NULL,
+                trials INTEGER NOT NULL DEFAULT 1,
+                stddev DOUBLE PRECISION,
+                ci_low DOUBLE PRECISION,
+                ci_high DOUBLE PRECISION,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                CONSTRAINT unique_result {unique_result_sql}
+            );
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS qps INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS clients INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS write_pct INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS workers INTEGER NOT NULL DEFAULT 0;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS run_id TEXT NOT NULL DEFAULT '';
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS trials INTEGER NOT NULL DEFAULT 1;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS stddev DOUBLE PRECISION;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS ci_low DOUBLE PRECISION;
+            ALTER TABLE experiment_results ADD COLUMN IF NOT EXISTS ci_high DOUBLE PRECISION;
+        """
+        conn.execute(sql)
+
+        # Results tables created before a key column was added keep their
+        # old unique constraint until it is rebuilt here
+        constraint = conn.select_one("""
+            SELECT pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conname = 'unique_result' AND conrelid = 'experiment_results'::regclass
+        """)
+        if constraint is None or constraint[0] != unique_result_sql:
+            conn.execute(f"""
+                ALTER TABLE experiment_results DROP CONSTRAINT IF EXISTS unique_result;
+                ALTER TABLE experiment_results ADD CONSTRAINT unique_result {unique_result_sql};
+            """)
+
+        # Latest result of every configuration over all runs
+        configuration_sql = ', '.join(CONFIGURATION_KEY_COLUMNS)
+        conn.execute(f"""
+            DROP VIEW IF EXISTS {LATEST_RESULTS_VIEW};
+            CREATE VIEW {LATEST_RESULTS_VIEW} AS
+            SELECT DISTINCT ON ({configuration_sql})
+                *
+            FROM
+                experiment_results
+            ORDER BY
+                {configuration_sql}, created_at DESC;
+        """)
+
+
+def setup_runs_table():
+    with DatabaseConnection() as conn:
+        sql = """
+            CREATE TABLE IF NOT EXISTS experiment_runs (
+                run_id TEXT PRIMARY KEY,
+                git_sha TEXT,
+                host TEXT,
+                host_info TEXT,
+                started_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+        """
+        conn.execute(sql)
+
+
+def setup_timeseries_table():
+    with DatabaseConnection() as conn:
+        sql = f"""
+            CREATE TABLE IF NOT EXISTS experiment_timeseries (
+                run_id TEXT NOT NULL,
+                series TEXT NOT NULL,
+                offset_s DOUBLE PRECISION NOT NULL,
+                extension TEXT NOT NULL,
+                index_params TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                k INTEGER NOT NULL DEFAULT 0,
+                tps DOUBLE PRECISION,
+                latency_average DOUBLE PRECISION,
+                latency_stddev DOUBLE PRECISION,
+                lag_average DOUBLE PRECISION,
                 created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                CONSTRAINT unique_result UNIQUE (metric_type, extension, index_params, dataset, n, k)
+                PRIMARY KEY ({', '.join(TIMESERIES_KEY_COLUMNS)})
             );
         """
         conn.execute(sql)
@@ -181,10 +317,18 @@ if __name__ == "__main__":
                         choices=[d for d in VALID_DATASETS], help="Dataset name")
     parser.add_argument("--N",
                         nargs='+', help="Dataset sizes")
+    parser.add_argument("--workers", type=int, default=DEFAULT_LOAD_WORKERS,
+                        help="Number of parallel COPY streams per table")
+    parser.add_argument("--mirror",
+                        help="Directory, file:// or http(s) URL to download datasets from")
+    parser.add_argument("--no-derive", dest="derive", action="store_false",
+                        help="Download every dataset size instead of deriving smaller ones from the largest")
     cli.add_logging(parser)
     args = parser.parse_args()
 
+    setup_runs_table()
     setup_results_table()
+    setup_timeseries_table()
 
     logging.basicConfig(level=getattr(logging, args.log.upper()))
 
@@ -194,8 +338,10 @@ if __name__ == "__main__":
 
     if args.extension is None:
         for extension in Extension:
-            setup_extension(args.datapath, extension, dataset_sizes)
+            setup_extension(args.datapath, extension,
+                            dataset_sizes, args.workers, args.mirror, args.derive)
     else:
         for extension in args.extension:
-            setup_extension(args.datapath, Extension(extension), dataset_sizes)
+            setup_extension(args.datapath, Extension(
+                extension), dataset_sizes, args.workers, args.mirror, args.derive)
     logging.info('Done!')
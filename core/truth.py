@@ -0,0 +1,240 @@
+import io
+import os
+import argparse
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .utils.database import DatabaseConnection
+from .utils.constants import Extension, Dataset
+from .utils.names import get_table_name
+from .utils.numbers import convert_string_to_number
+from .utils.load import mark_base_truth_ids
+from .utils.vector_files import decode_array_rows, encode_array_rows, write_vecs, COPY_BINARY_HEADER, COPY_BINARY_TRAILER
+from .utils import cli
+
+TRUTH_K = 100
+BASE_BLOCK_SIZE = 20000
+QUERY_BLOCK_SIZE = 1000
+DEFAULT_TRUTH_WORKERS = os.cpu_count() or 1
+
+
+def get_table_dim(extension, table):
+    sql = f"SELECT array_length(v::real[], 1) FROM {table} LIMIT 1"
+    with DatabaseConnection(extension) as conn:
+        return conn.select_one(sql)[0]
+
+
+def get_max_id(extension, table):
+    with DatabaseConnection(extension) as conn:
+        return conn.select_one(f"SELECT COALESCE(MAX(id), 0) FROM {table}")[0]
+
+
+def fetch_vectors(extension, table, start_id=0, end_id=None, dim=None):
+    """
+    Fetches the ids and vectors of rows with start_id < id <= end_id from a
+    dataset table as NumPy arrays, using a binary COPY.
+    """
+    dim = dim or get_table_dim(extension, table)
+    end_sql = '' if end_id is None else f"AND id <= {end_id}"
+    sql = f"""
+        COPY (
+            SELECT id, v::real[]
+            FROM {table}
+            WHERE id > {start_id} {end_sql}
+            ORDER BY id
+        ) TO STDOUT WITH (FORMAT binary)
+    """
+    f = io.BytesIO()
+    with DatabaseConnection(extension) as conn:
+        conn.copy_expert(sql, f)
+    return decode_array_rows(f.getvalue(), dim)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def top_k(similarities, K):
+    """Returns the column indices of the K largest values of every row, unordered."""
+    if similarities.shape[1] <= K:
+        return np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+    return np.argpartition(-similarities, K - 1, axis=1)[:, :K]
+
+
+def merge_top_k(similarities, ids, block_similarities, block_ids, K):
+    similarities = np.concatenate([similarities, block_similarities], axis=1)
+    ids = np.concatenate([ids, block_ids], axis=1)
+    top = top_k(similarities, K)
+    return np.take_along_axis(similarities, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+# Normalized queries and K, set once per worker process by init_worker
+_queries = None
+_K = None
+
+
+def init_worker(queries, K):
+    global _queries, _K
+    _queries = queries
+    _K = K
+
+
+def search_block(ids, vectors):
+    """
+    Returns the similarities and ids of the K most similar rows of one base
+    block for every query, unordered. Runs in a worker process.
+    """
+    vectors = normalize(vectors)
+    K = min(_K, len(ids))
+    similarities = np.empty((len(_queries), K), dtype=np.float32)
+    neighbor_ids = np.empty((len(_queries), K), dtype=np.int64)
+    for start in range(0, len(_queries), QUERY_BLOCK_SIZE):
+        end = start + QUERY_BLOCK_SIZE
+        block_similarities = _queries[start:end] @ vectors.T
+        top = top_k(block_similarities, K)
+        similarities[start:end] = np.take_along_axis(
+            block_similarities, top, axis=1)
+        neighbor_ids[start:end] = ids[top]
+    return similarities, neighbor_ids
+
+
+def search_blocks(blocks, queries, K=TRUTH_K, workers=DEFAULT_TRUTH_WORKERS):
+    """
+    Returns the ids of the K rows most similar to every query vector among
+    the (ids, vectors) base blocks, nearest first. Queries with fewer than K
+    candidate rows are padded with -1.
+
+    Blocks are searched by a pool of worker processes, each using one BLAS
+    matrix multiplication per block of queries and argpartition to keep a
+    partial top-K. The partial results are merged into a running top-K as
+    blocks complete.
+    """
+    queries = normalize(queries)
+    best_similarities = np.full((len(queries), K), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), K), -1, dtype=np.int64)
+
+    def merge(futures):
+        nonlocal best_similarities, best_ids
+        for future in futures:
+            block_similarities, block_ids = future.result()
+            best_similarities, best_ids = merge_top_k(
+                best_similarities, best_ids, block_similarities, block_ids, K)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(queries, K)) as executor:
+        pending = set()
+        for ids, vectors in blocks:
+            pending.add(executor.submit(search_block, ids, vectors))
+            # Bound the number of blocks held in memory at once
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                merge(done)
+        merge(pending)
+
+    order = np.argsort(-best_similarities, axis=1, kind='stable')
+    return np.take_along_axis(best_ids, order, axis=1)
+
+
+def get_exact_neighbors(extension, base_table, queries, N=None, K=TRUTH_K, block_size=BASE_BLOCK_SIZE, workers=DEFAULT_TRUTH_WORKERS):
+    """
+    Returns the ids of the K nearest rows of base_table (by cosine distance)
+    for every query vector, nearest first, considering only rows with
+    id <= N (all rows if N is None). The returned ids are base table ids.
+    Base vectors are streamed from the database in blocks of block_size
+    rows and searched by search_blocks.
+    """
+    N = get_max_id(extension, base_table) if N is None else N
+    dim = get_table_dim(extension, base_table)
+    blocks = (fetch_vectors(extension, base_table, start_id, min(start_id + block_size, N), dim)
+              for start_id in range(0, N, block_size))
+    return search_blocks(blocks, queries, K, workers)
+
+
+def save_truth_table(extension, truth_table, query_ids, neighbor_ids):
+    """Replaces the contents of a truth table with one row per query id."""
+    data = COPY_BINARY_HEADER + \
+        encode_array_rows(query_ids, neighbor_ids, '>i4') + COPY_BINARY_TRAILER
+    with DatabaseConnection(extension) as conn:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {truth_table} (
+                id SERIAL PRIMARY KEY,
+                indices INTEGER[]
+            );
+            TRUNCATE {truth_table};
+        """)
+        conn.copy_expert(
+            f"COPY {truth_table} (id, indices) FROM STDIN WITH (FORMAT binary)", io.BytesIO(data))
+        mark_base_truth_ids(conn, truth_table)
+
+
+def generate_truth_table(extension, base_table, query_table, truth_table, N=None, K=TRUTH_K, workers=DEFAULT_TRUTH_WORKERS):
+    """
+    Computes the exact K nearest neighbors of every row of query_table among
+    the rows of base_table with id <= N and stores their base ids in
+    truth_table, keyed by query id.
+    """
+    logging.info(
+        f"Computing exact top {K} neighbors of {query_table} in {base_table} into {truth_table}...")
+    query_ids, queries = fetch_vectors(extension, query_table)
+    neighbor_ids = get_exact_neighbors(
+        extension, base_table, queries, N, K, workers=workers)
+    save_truth_table(extension, truth_table, query_ids, neighbor_ids)
+
+
+def generate_truth_file(extension, base_table, query_table, N, path, K=TRUTH_K, workers=DEFAULT_TRUTH_WORKERS):
+    """
+    Computes the exact K nearest neighbors of every row of query_table among
+    the first N rows of base_table and writes them as an .ivecs file. As in
+    the standard .ivecs ground truth files, neighbors are 0-based row numbers
+    (base id - 1).
+    """
+    logging.info(
+        f"Computing exact top {K} neighbors of {query_table} in the first {N} rows of {base_table}...")
+    _, queries = fetch_vectors(extension, query_table)
+    neighbor_ids = get_exact_neighbors(
+        extension, base_table, queries, N, K, workers=workers)
+    write_vecs(path, (neighbor_ids - 1).astype(np.int32))
+    return path
+
+
+if __name__ == '__main__':
+    # Set up parser
+    parser = argparse.ArgumentParser(description="generate exact ground truth")
+    cli.add_extension(parser, allow_no_index=True)
+    parser.add_argument("--dataset", type=str, choices=[d.value for d in Dataset],
+                        help="Dataset name, used to derive table names")
+    parser.add_argument("--N", type=str, help="dataset size")
+    parser.add_argument("--base-table", help="Base table (overrides --dataset)")
+    parser.add_argument("--query-table",
+                        help="Query table (overrides --dataset)")
+    parser.add_argument("--truth-table",
+                        help="Truth table to write (overrides --dataset)")
+    parser.add_argument("--K", type=int, default=TRUTH_K,
+                        help="Number of neighbors per query")
+    parser.add_argument("--workers", type=int, default=DEFAULT_TRUTH_WORKERS,
+                        help="Number of worker processes")
+    cli.add_logging(parser)
+
+    # Parse arguments
+    parsed_args = parser.parse_args()
+    extension = Extension(parsed_args.extension)
+    logging.basicConfig(level=getattr(logging, parsed_args.log.upper()))
+    if parsed_args.dataset is not None and parsed_args.N is not None:
+        dataset = Dataset(parsed_args.dataset)
+        cli.validate_N(parser, dataset, parsed_args.N)
+        base_table = get_table_name(dataset, parsed_args.N, type='base')
+        query_table = get_table_name(dataset, parsed_args.N, type='query')
+        truth_table = get_table_name(dataset, parsed_args.N, type='truth')
+        N = convert_string_to_number(parsed_args.N)
+    else:
+        base_table, query_table, truth_table, N = None, None, None, None
+    base_table = parsed_args.base_table or base_table
+    query_table = parsed_args.query_table or query_table
+    truth_table = parsed_args.truth_table or truth_table
+    if None in (base_table, query_table, truth_table):
+        parser.error(
+            "Either --dataset and --N or --base-table, --query-table and --truth-table are required")
+
+    generate_truth_table(extension, base_table, query_table,
+                         truth_table, N, parsed_args.K, parsed_args.workers)
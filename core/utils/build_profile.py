@@ -0,0 +1,149 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from .database import DatabaseConnection
+
+# Seconds between samples of the backend building the index
+PROFILE_INTERVAL = 0.1
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_proc_kb_field(path, field):
+    """Returns a `field: value kB` line of a /proc file in bytes, or None."""
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    for line in lines:
+        key, _, value = line.partition(':')
+        if key == field:
+            return int(value.split()[0]) * 1024
+    return None
+
+
+def read_proc_memory(pid):
+    """
+    Returns the memory of a process in bytes, or None. This is its PSS, in
+    which shared pages (shared_buffers, libraries) are split between the
+    processes that map them, so that summing over processes counts them
+    once. Without smaps_rollup (Linux < 4.14), it is the anonymous RSS,
+    which leaves out shared memory.
+    """
+    pss = read_proc_kb_field(f"/proc/{pid}/smaps_rollup", 'Pss')
+    if pss is not None:
+        return pss
+    return read_proc_kb_field(f"/proc/{pid}/status", 'RssAnon')
+
+
+def read_proc_cpu_time(pid):
+    """Returns the user + system CPU seconds of a process, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so fields are counted from its closing parenthesis
+    fields = stat[stat.rindex(')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def read_proc_write_bytes(pid):
+    """Returns the bytes a process caused to be written to storage, or None."""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith('write_bytes:'):
+            return int(line.split()[1])
+    return None
+
+
+class BuildProfiler:
+    """
+    Samples the backend that runs CREATE INDEX, and its parallel workers,
+    in a background thread. The backend is found in pg_stat_activity by the
+    application name of the client, so the client must connect with
+    PGAPPNAME set to `application_name`.
+
+    Memory (summed PSS, see read_proc_memory), CPU time and write bytes are
+    read from /proc and are only available on Linux when the database runs
+    on this host and is readable by this user; otherwise they stay None. The phases of pg_stat_progress_create_index
+    are recorded with their start offsets in seconds.
+    """
+
+    def __init__(self, extension):
+        self.extension = extension
+        self.application_name = f"benchmark_create_{uuid.uuid4().hex[:12]}"
+        self.peak_memory = None
+        self.cpu_time = None
+        self.write_bytes = None
+        self.phases = []
+        self._cpu_times = {}
+        self._write_bytes = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def get_timeline(self):
+        return '\n'.join(f"{offset:.2f} s: {phase}" for offset, phase in self.phases)
+
+    def _run(self):
+        try:
+            with DatabaseConnection(self.extension, autocommit=True) as conn:
+                self._sample_until_stopped(conn)
+        except Exception as e:
+            logging.warning(f"Index build profiling failed: {e}")
+
+    def _sample_until_stopped(self, conn):
+        start = time.time()
+        leader_pid = None
+        while not self._stop.is_set():
+            if leader_pid is None:
+                row = conn.select_one(
+                    "SELECT pid FROM pg_stat_activity WHERE application_name = %s", data=(self.application_name,))
+                leader_pid = row and row[0]
+            if leader_pid is not None:
+                pids = [row[0] for row in conn.select(
+                    "SELECT pid FROM pg_stat_activity WHERE pid = %s OR leader_pid = %s", data=(leader_pid, leader_pid))]
+                progress = conn.select_one(
+                    "SELECT phase FROM pg_stat_progress_create_index WHERE pid = %s", data=(leader_pid,))
+                if progress is not None and (len(self.phases) == 0 or self.phases[-1][1] != progress[0]):
+                    self.phases.append((time.time() - start, progress[0]))
+                self._sample_processes(pids)
+            self._stop.wait(PROFILE_INTERVAL)
+
+    def _sample_processes(self, pids):
+        memory = None
+        for pid in pids:
+            process_memory = read_proc_memory(pid)
+            if process_memory is not None:
+                memory = (memory or 0) + process_memory
+            cpu_time = read_proc_cpu_time(pid)
+            if cpu_time is not None:
+                self._cpu_times[pid] = cpu_time
+            write_bytes = read_proc_write_bytes(pid)
+            if write_bytes is not None:
+                self._write_bytes[pid] = write_bytes
+
+        # Counters of exited parallel workers keep their last sampled value
+        if memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, memory)
+        if self._cpu_times:
+            self.cpu_time = sum(self._cpu_times.values())
+        if self._write_bytes:
+            self.write_bytes = sum(self._write_bytes.values())
@@ -1,11 +1,31 @@
 import logging
 from typing import Dict
 from .constants import VALID_DATASETS, VALID_DATASET_SIZES, VALID_INDEX_PARAMS, Extension
+from .stats import DEFAULT_WARMUP_RUNS, DEFAULT_TRIALS
 
 def add_logging(parser):
     parser.add_argument("--log", default="WARNING", help="Logging level", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
 
 
+def add_native(parser):
+    parser.add_argument("--native", action="store_true",
+                        help="Use the asyncio load generator instead of pgbench")
+
+
+def add_trials(parser):
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP_RUNS,
+                        help="Number of warm-up runs to throw away")
+    parser.add_argument("--trials", type=int, default=DEFAULT_TRIALS,
+                        help="Number of measured trials")
+
+
+def add_clients_sweep(parser):
+    parser.add_argument("--clients-sweep", action="store_true",
+                        help="Measure throughput and latency for every number of clients instead")
+    parser.add_argument("--clients", nargs='+', type=int,
+                        help="Numbers of clients of the sweep (default: 1, 2, 4, ... 2x cores)")
+
+
 def add_dataset(parser):
     choices = [d for d in VALID_DATASETS]
     parser.add_argument("--dataset", type=str, choices=choices,
@@ -28,11 +28,14 @@ EXTENSION_NAMES = {
 EXTENSIONS_USING_VECTOR = [Extension.PGVECTOR_IVFFLAT,
                            Extension.PGVECTOR_HNSW, Extension.NONE]
 
+# maintenance_work_mem of index builds, in MB
+DEFAULT_MAINTENANCE_WORK_MEM = 2048
+
 DEFAULT_INDEX_PARAMS = {
-    Extension.PGVECTOR_IVFFLAT: {'lists': 100, 'probes': 16},
-    Extension.PGVECTOR_HNSW: {'m': 32, 'ef_construction': 128, 'ef': 10},
-    Extension.LANTERN: {'m': 32, 'ef_construction': 128, 'ef': 10},
-    Extension.NEON: {'m': 32, 'ef_construction': 128, 'ef': 10},
+    Extension.PGVECTOR_IVFFLAT: {'lists': 100, 'probes': 16, 'maintenance_work_mem': DEFAULT_MAINTENANCE_WORK_MEM},
+    Extension.PGVECTOR_HNSW: {'m': 32, 'ef_construction': 128, 'ef': 10, 'maintenance_work_mem': DEFAULT_MAINTENANCE_WORK_MEM},
+    Extension.LANTERN: {'m': 32, 'ef_construction': 128, 'ef': 10, 'maintenance_work_mem': DEFAULT_MAINTENANCE_WORK_MEM},
+    Extension.NEON: {'m': 32, 'ef_construction': 128, 'ef': 10, 'maintenance_work_mem': DEFAULT_MAINTENANCE_WORK_MEM},
     Extension.NONE: {},
 }
 
@@ -51,10 +54,14 @@ SUGGESTED_INDEX_PARAMS = {
 
 VALID_INDEX_PARAMS = {
     index: list(set().union(*(param_set.keys()
-                for param_set in default_params)))
+                for param_set in default_params), DEFAULT_INDEX_PARAMS[index].keys()))
     for index, default_params in SUGGESTED_INDEX_PARAMS.items()
 }
 
+# Extensions whose index builds can use several processes or threads
+PARALLEL_BUILD_EXTENSIONS = [Extension.PGVECTOR_IVFFLAT,
+                             Extension.PGVECTOR_HNSW, Extension.LANTERN]
+
 
 """
 Metric constants
@@ -67,11 +74,23 @@ class Metric(Enum):
 
     SELECT_LATENCY = 'select latency (ms)'
     SELECT_LATENCY_STDDEV = 'select latency (stddev ms)'
+    SELECT_LATENCY_P50 = 'select latency (p50 ms)'
+    SELECT_LATENCY_P90 = 'select latency (p90 ms)'
+    SELECT_LATENCY_P95 = 'select latency (p95 ms)'
+    SELECT_LATENCY_P99 = 'select latency (p99 ms)'
+    SELECT_LATENCY_P999 = 'select latency (p99.9 ms)'
+    SELECT_LATENCY_MAX = 'select latency (max ms)'
 
     SELECT_TPS = 'select tps'
 
+    SELECT_ACHIEVED_QPS = 'select achieved qps'
+    SELECT_SATURATION_QPS = 'select saturation qps'
+
     RECALL_AFTER_INSERT = 'recall (after insert)'
     RECALL_AFTER_CREATE = 'recall (after create)'
+    RECALL_AFTER_CREATE_P5 = 'recall (after create, p5)'
+    RECALL_AFTER_CREATE_P50 = 'recall (after create, p50)'
+    RECALL_AFTER_CREATE_MIN = 'recall (after create, min)'
 
     BUFFER_SHARED_HIT_COUNT = 'buffer shared hits'
     BUFFER_SHARED_HIT_COUNT_STDDEV = 'buffer shared hits (stddev)'
@@ -83,6 +102,12 @@ class Metric(Enum):
 
     SELECT_BULK_LATENCY = 'select bulk latency (ms)'
     SELECT_BULK_LATENCY_STDDEV = 'select bulk latency (stddev ms)'
+    SELECT_BULK_LATENCY_P50 = 'select bulk latency (p50 ms)'
+    SELECT_BULK_LATENCY_P90 = 'select bulk latency (p90 ms)'
+    SELECT_BULK_LATENCY_P95 = 'select bulk latency (p95 ms)'
+    SELECT_BULK_LATENCY_P99 = 'select bulk latency (p99 ms)'
+    SELECT_BULK_LATENCY_P999 = 'select bulk latency (p99.9 ms)'
+    SELECT_BULK_LATENCY_MAX = 'select bulk latency (max ms)'
 
     SELECT_BULK_TPS = 'select bulk tps'
 
@@ -96,27 +121,201 @@ class Metric(Enum):
 
     INSERT_LATENCY = 'insert latency (ms)'
     INSERT_LATENCY_STDDEV = 'insert latency (stddev ms)'
+    INSERT_LATENCY_P50 = 'insert latency (p50 ms)'
+    INSERT_LATENCY_P90 = 'insert latency (p90 ms)'
+    INSERT_LATENCY_P95 = 'insert latency (p95 ms)'
+    INSERT_LATENCY_P99 = 'insert latency (p99 ms)'
+    INSERT_LATENCY_P999 = 'insert latency (p99.9 ms)'
+    INSERT_LATENCY_MAX = 'insert latency (max ms)'
 
     INSERT_TPS = 'insert tps'
 
+    INSERT_WAL = 'insert wal (bytes)'
+    INSERT_WAL_PER_ROW = 'insert wal (bytes per row)'
+    INSERT_WAL_PER_DIMENSION = 'insert wal (bytes per dimension)'
+
+    INSERT_INDEX_SIZE = 'insert index size (bytes)'
+    INSERT_INDEX_SIZE_PER_ROW = 'insert index size (bytes per row)'
+    INSERT_INDEX_SIZE_PER_DIMENSION = 'insert index size (bytes per dimension)'
+
     # Insert bulk
 
     INSERT_BULK_LATENCY = 'insert bulk latency (ms)'
     INSERT_BULK_LATENCY_STDDEV = 'insert bulk latency (stddev ms)'
+    INSERT_BULK_LATENCY_P50 = 'insert bulk latency (p50 ms)'
+    INSERT_BULK_LATENCY_P90 = 'insert bulk latency (p90 ms)'
+    INSERT_BULK_LATENCY_P95 = 'insert bulk latency (p95 ms)'
+    INSERT_BULK_LATENCY_P99 = 'insert bulk latency (p99 ms)'
+    INSERT_BULK_LATENCY_P999 = 'insert bulk latency (p99.9 ms)'
+    INSERT_BULK_LATENCY_MAX = 'insert bulk latency (max ms)'
 
     INSERT_BULK_TPS = 'insert bulk tps'
 
+    INSERT_BULK_WAL = 'insert bulk wal (bytes)'
+    INSERT_BULK_WAL_PER_ROW = 'insert bulk wal (bytes per row)'
+    INSERT_BULK_WAL_PER_DIMENSION = 'insert bulk wal (bytes per dimension)'
+
+    INSERT_BULK_INDEX_SIZE = 'insert bulk index size (bytes)'
+    INSERT_BULK_INDEX_SIZE_PER_ROW = 'insert bulk index size (bytes per row)'
+    INSERT_BULK_INDEX_SIZE_PER_DIMENSION = 'insert bulk index size (bytes per dimension)'
+
+    # Mixed select and insert
+
+    MIXED_SELECT_TPS = 'mixed select tps'
+    MIXED_INSERT_TPS = 'mixed insert tps'
+    MIXED_WRITE_PCT = 'mixed write (% of transactions)'
+
+    MIXED_SELECT_LATENCY_P50 = 'mixed select latency (p50 ms)'
+    MIXED_SELECT_LATENCY_P95 = 'mixed select latency (p95 ms)'
+    MIXED_SELECT_LATENCY_P99 = 'mixed select latency (p99 ms)'
+    MIXED_SELECT_LATENCY_MAX = 'mixed select latency (max ms)'
+
+    RECALL_DURING_INSERT = 'recall (during insert)'
+    RECALL_DRIFT_DURING_INSERT = 'recall drift (during insert)'
+
     # Create
 
     DISK_USAGE = 'disk usage (bytes)'
     DISK_USAGE_STDDEV = 'disk usage (stddev bytes)'
+    DISK_USAGE_PER_ROW = 'disk usage (bytes per row)'
+    DISK_USAGE_PER_DIMENSION = 'disk usage (bytes per dimension)'
+
+    HEAP_SIZE = 'heap size (bytes)'
+    HEAP_SIZE_PER_ROW = 'heap size (bytes per row)'
+    HEAP_SIZE_PER_DIMENSION = 'heap size (bytes per dimension)'
+
+    TOAST_SIZE = 'toast size (bytes)'
+    TOAST_SIZE_PER_ROW = 'toast size (bytes per row)'
+    TOAST_SIZE_PER_DIMENSION = 'toast size (bytes per dimension)'
+
+    FSM_SIZE = 'fsm size (bytes)'
+    FSM_SIZE_PER_ROW = 'fsm size (bytes per row)'
+    FSM_SIZE_PER_DIMENSION = 'fsm size (bytes per dimension)'
+
+    VM_SIZE = 'vm size (bytes)'
+    VM_SIZE_PER_ROW = 'vm size (bytes per row)'
+    VM_SIZE_PER_DIMENSION = 'vm size (bytes per dimension)'
+
+    CREATE_WAL = 'create wal (bytes)'
+    CREATE_WAL_PER_ROW = 'create wal (bytes per row)'
+    CREATE_WAL_PER_DIMENSION = 'create wal (bytes per dimension)'
 
     CREATE_LATENCY = 'create latency (ms)'
     CREATE_LATENCY_STDDEV = 'create latency (stddev ms)'
 
+    CREATE_PEAK_MEMORY = 'create peak memory (bytes)'
+    CREATE_CPU_TIME = 'create cpu time (s)'
+    CREATE_WRITE_BYTES = 'create disk writes (bytes)'
+
+    CREATE_EXTERNAL_EXPORT_LATENCY = 'create external export (ms)'
+    CREATE_EXTERNAL_BUILD_LATENCY = 'create external build (ms)'
+    CREATE_EXTERNAL_TRANSFER_LATENCY = 'create external transfer (ms)'
+    CREATE_EXTERNAL_IMPORT_LATENCY = 'create external import (ms)'
+    CREATE_EXTERNAL_THROUGHPUT = 'create external throughput (rows/s)'
+    EXTERNAL_INDEX_FILE_SIZE = 'external index file size (bytes)'
+
+    CREATE_SPEEDUP = 'create speedup'
+    CREATE_EFFICIENCY = 'create parallel efficiency'
+
+    # Hyperparameter optimizer
+
+    PARETO_OPTIMAL = 'pareto optimal'
+
 
 VALID_METRICS = [metric.value for metric in Metric]
 
+# Latency percentiles recorded per benchmark run, 100 being the max
+LATENCY_PERCENTILES = [50, 90, 95, 99, 99.9, 100]
+
+SELECT_LATENCY_PERCENTILE_METRICS = {
+    50: Metric.SELECT_LATENCY_P50,
+    90: Metric.SELECT_LATENCY_P90,
+    95: Metric.SELECT_LATENCY_P95,
+    99: Metric.SELECT_LATENCY_P99,
+    99.9: Metric.SELECT_LATENCY_P999,
+    100: Metric.SELECT_LATENCY_MAX,
+}
+
+SELECT_BULK_LATENCY_PERCENTILE_METRICS = {
+    50: Metric.SELECT_BULK_LATENCY_P50,
+    90: Metric.SELECT_BULK_LATENCY_P90,
+    95: Metric.SELECT_BULK_LATENCY_P95,
+    99: Metric.SELECT_BULK_LATENCY_P99,
+    99.9: Metric.SELECT_BULK_LATENCY_P999,
+    100: Metric.SELECT_BULK_LATENCY_MAX,
+}
+
+INSERT_LATENCY_PERCENTILE_METRICS = {
+    50: Metric.INSERT_LATENCY_P50,
+    90: Metric.INSERT_LATENCY_P90,
+    95: Metric.INSERT_LATENCY_P95,
+    99: Metric.INSERT_LATENCY_P99,
+    99.9: Metric.INSERT_LATENCY_P999,
+    100: Metric.INSERT_LATENCY_MAX,
+}
+
+INSERT_BULK_LATENCY_PERCENTILE_METRICS = {
+    50: Metric.INSERT_BULK_LATENCY_P50,
+    90: Metric.INSERT_BULK_LATENCY_P90,
+    95: Metric.INSERT_BULK_LATENCY_P95,
+    99: Metric.INSERT_BULK_LATENCY_P99,
+    99.9: Metric.INSERT_BULK_LATENCY_P999,
+    100: Metric.INSERT_BULK_LATENCY_MAX,
+}
+
+# Worst phase of a mixed select and insert workload
+MIXED_SELECT_LATENCY_PERCENTILE_METRICS = {
+    50: Metric.MIXED_SELECT_LATENCY_P50,
+    95: Metric.MIXED_SELECT_LATENCY_P95,
+    99: Metric.MIXED_SELECT_LATENCY_P99,
+    100: Metric.MIXED_SELECT_LATENCY_MAX,
+}
+
+# Disk footprint components with their (bytes, bytes per row, bytes per
+# vector dimension) metrics. The index is the index alone, the heap its main
+# fork, and wal the WAL generated by the build or the inserts
+CREATE_FOOTPRINT_METRICS = {
+    'index': (Metric.DISK_USAGE, Metric.DISK_USAGE_PER_ROW, Metric.DISK_USAGE_PER_DIMENSION),
+    'heap': (Metric.HEAP_SIZE, Metric.HEAP_SIZE_PER_ROW, Metric.HEAP_SIZE_PER_DIMENSION),
+    'toast': (Metric.TOAST_SIZE, Metric.TOAST_SIZE_PER_ROW, Metric.TOAST_SIZE_PER_DIMENSION),
+    'fsm': (Metric.FSM_SIZE, Metric.FSM_SIZE_PER_ROW, Metric.FSM_SIZE_PER_DIMENSION),
+    'vm': (Metric.VM_SIZE, Metric.VM_SIZE_PER_ROW, Metric.VM_SIZE_PER_DIMENSION),
+    'wal': (Metric.CREATE_WAL, Metric.CREATE_WAL_PER_ROW, Metric.CREATE_WAL_PER_DIMENSION),
+}
+
+INSERT_FOOTPRINT_METRICS = {
+    'index': (Metric.INSERT_INDEX_SIZE, Metric.INSERT_INDEX_SIZE_PER_ROW, Metric.INSERT_INDEX_SIZE_PER_DIMENSION),
+    'wal': (Metric.INSERT_WAL, Metric.INSERT_WAL_PER_ROW, Metric.INSERT_WAL_PER_DIMENSION),
+}
+
+INSERT_BULK_FOOTPRINT_METRICS = {
+    'index': (Metric.INSERT_BULK_INDEX_SIZE, Metric.INSERT_BULK_INDEX_SIZE_PER_ROW, Metric.INSERT_BULK_INDEX_SIZE_PER_DIMENSION),
+    'wal': (Metric.INSERT_BULK_WAL, Metric.INSERT_BULK_WAL_PER_ROW, Metric.INSERT_BULK_WAL_PER_DIMENSION),
+}
+
+FOOTPRINT_METRICS = [
+    metric
+    for footprint_metrics in [CREATE_FOOTPRINT_METRICS, INSERT_FOOTPRINT_METRICS, INSERT_BULK_FOOTPRINT_METRICS]
+    for metrics in footprint_metrics.values()
+    for metric in metrics
+]
+
+# Phases of an external index build with lantern-cli
+EXTERNAL_PHASE_METRICS = {
+    'export': Metric.CREATE_EXTERNAL_EXPORT_LATENCY,
+    'build': Metric.CREATE_EXTERNAL_BUILD_LATENCY,
+    'transfer': Metric.CREATE_EXTERNAL_TRANSFER_LATENCY,
+    'import': Metric.CREATE_EXTERNAL_IMPORT_LATENCY,
+}
+
+LATENCY_PERCENTILE_METRICS = [
+    metric
+    for percentile_metrics in [SELECT_LATENCY_PERCENTILE_METRICS, SELECT_BULK_LATENCY_PERCENTILE_METRICS,
+                               INSERT_LATENCY_PERCENTILE_METRICS, INSERT_BULK_LATENCY_PERCENTILE_METRICS,
+                               MIXED_SELECT_LATENCY_PERCENTILE_METRICS]
+    for metric in percentile_metrics.values()
+]
+
 NO_INDEX_METRICS = [
     Metric.SELECT_LATENCY,
     Metric.SELECT_TPS,
@@ -129,8 +328,14 @@ METRICS_THAT_SHOULD_DECREASE = [
     Metric.SELECT_BULK_LATENCY,
     Metric.INSERT_LATENCY,
     Metric.INSERT_BULK_LATENCY,
-    Metric.DISK_USAGE,
+    *FOOTPRINT_METRICS,
     Metric.CREATE_LATENCY,
+    Metric.CREATE_PEAK_MEMORY,
+    Metric.CREATE_CPU_TIME,
+    Metric.CREATE_WRITE_BYTES,
+    *EXTERNAL_PHASE_METRICS.values(),
+    Metric.EXTERNAL_INDEX_FILE_SIZE,
+    *LATENCY_PERCENTILE_METRICS,
 ]
 
 METRICS_THAT_SHOULD_INCREASE = [
@@ -139,7 +344,17 @@ METRICS_THAT_SHOULD_INCREASE = [
     Metric.INSERT_TPS,
     Metric.INSERT_BULK_TPS,
     Metric.RECALL_AFTER_CREATE,
+    Metric.RECALL_AFTER_CREATE_P5,
+    Metric.RECALL_AFTER_CREATE_P50,
+    Metric.RECALL_AFTER_CREATE_MIN,
     Metric.RECALL_AFTER_INSERT,
+    Metric.SELECT_SATURATION_QPS,
+    Metric.MIXED_SELECT_TPS,
+    Metric.MIXED_INSERT_TPS,
+    Metric.RECALL_DURING_INSERT,
+    Metric.CREATE_SPEEDUP,
+    Metric.CREATE_EFFICIENCY,
+    Metric.CREATE_EXTERNAL_THROUGHPUT,
 ]
 
 """
@@ -150,23 +365,69 @@ Experiment parameter constants
 class ExperimentParam(Enum):
     N = 'n'
     K = 'k'
+    QPS = 'qps'
+    CLIENTS = 'clients'
+    WRITE_PCT = 'write_pct'
+    WORKERS = 'workers'
 
 
 EXPERIMENT_PARAMETERS = {
-    Metric.SELECT_LATENCY: [ExperimentParam.N, ExperimentParam.K],
-    Metric.SELECT_TPS: [ExperimentParam.N, ExperimentParam.K],
+    Metric.SELECT_LATENCY: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.CLIENTS],
+    Metric.SELECT_TPS: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.CLIENTS],
+    Metric.SELECT_ACHIEVED_QPS: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.QPS],
+    Metric.SELECT_SATURATION_QPS: [ExperimentParam.N, ExperimentParam.K],
     Metric.RECALL_AFTER_CREATE: [ExperimentParam.N, ExperimentParam.K],
+    Metric.RECALL_AFTER_CREATE_P5: [ExperimentParam.N, ExperimentParam.K],
+    Metric.RECALL_AFTER_CREATE_P50: [ExperimentParam.N, ExperimentParam.K],
+    Metric.RECALL_AFTER_CREATE_MIN: [ExperimentParam.N, ExperimentParam.K],
     Metric.RECALL_AFTER_INSERT: [ExperimentParam.N, ExperimentParam.K],
-    Metric.INSERT_LATENCY: [],
+    Metric.RECALL_DURING_INSERT: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.WRITE_PCT],
+    Metric.MIXED_SELECT_TPS: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.WRITE_PCT],
+    Metric.MIXED_INSERT_TPS: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.WRITE_PCT],
+    Metric.MIXED_WRITE_PCT: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.WRITE_PCT],
+    **{metric: [ExperimentParam.N, ExperimentParam.K, ExperimentParam.WRITE_PCT]
+       for metric in MIXED_SELECT_LATENCY_PERCENTILE_METRICS.values()},
+    Metric.INSERT_LATENCY: [ExperimentParam.CLIENTS],
+    Metric.INSERT_TPS: [ExperimentParam.CLIENTS],
     Metric.INSERT_BULK_LATENCY: [],
-    Metric.DISK_USAGE: [ExperimentParam.N],
-    Metric.CREATE_LATENCY: [ExperimentParam.N],
+    **{metric: [ExperimentParam.N, ExperimentParam.K]
+       for metric in SELECT_LATENCY_PERCENTILE_METRICS.values()},
+    **{metric: [ExperimentParam.N, ExperimentParam.K]
+       for metric in SELECT_BULK_LATENCY_PERCENTILE_METRICS.values()},
+    **{metric: [] for metric in INSERT_LATENCY_PERCENTILE_METRICS.values()},
+    **{metric: [] for metric in INSERT_BULK_LATENCY_PERCENTILE_METRICS.values()},
+    **{metric: [ExperimentParam.N] for metric in FOOTPRINT_METRICS},
+    Metric.CREATE_LATENCY: [ExperimentParam.N, ExperimentParam.WORKERS],
+    Metric.CREATE_PEAK_MEMORY: [ExperimentParam.N, ExperimentParam.WORKERS],
+    Metric.CREATE_CPU_TIME: [ExperimentParam.N, ExperimentParam.WORKERS],
+    **{metric: [ExperimentParam.N] for metric in EXTERNAL_PHASE_METRICS.values()},
+    Metric.CREATE_EXTERNAL_THROUGHPUT: [ExperimentParam.N],
+    Metric.EXTERNAL_INDEX_FILE_SIZE: [ExperimentParam.N],
+    Metric.CREATE_SPEEDUP: [ExperimentParam.N, ExperimentParam.WORKERS],
+    Metric.CREATE_EFFICIENCY: [ExperimentParam.N, ExperimentParam.WORKERS],
+    Metric.CREATE_WRITE_BYTES: [ExperimentParam.N, ExperimentParam.WORKERS],
     Metric.BUFFER_READ_COUNT: [ExperimentParam.N, ExperimentParam.K],
     Metric.BUFFER_SHARED_HIT_COUNT: [ExperimentParam.N, ExperimentParam.K],
+    Metric.PARETO_OPTIMAL: [ExperimentParam.N, ExperimentParam.K],
 }
 
 SUGGESTED_K_VALUES = [1, 3, 5, 10, 20, 40, 80]
 
+
+def get_suggested_client_counts(max_clients=None):
+    """Returns 1, 2, 4, ... up to max_clients, which defaults to twice the core count."""
+    max_clients = max_clients or 2 * (os.cpu_count() or 1)
+    client_counts = []
+    clients = 1
+    while clients < max_clients:
+        client_counts.append(clients)
+        clients *= 2
+    return client_counts + [max_clients]
+
+
+# Target arrival rates (transactions per second) of an open-loop QPS sweep
+SUGGESTED_QPS_VALUES = [50, 100, 200, 400, 800, 1600, 3200, 6400, 12800]
+
 """
 Dataset constants
 """
@@ -1,13 +1,137 @@
 import os
+import re
+import time
+import shlex
+import shutil
+import logging
+import subprocess
 from .constants import Extension, Dataset
 from .names import get_table_name, get_index_name
 from .constants import coalesce_index_params, get_vector_dim, Extension
-from .database import get_database_url, run_command
+from .database import DatabaseConnection, get_database_url
 
 
 DIR = '/tmp/external_indexes'
 
+# Command of lantern-cli, which can be replaced by a local stand-in, e.g.
+# LANTERN_CLI=external/lantern_cli_standin.py
+LANTERN_CLI = os.environ.get('LANTERN_CLI', 'lantern-cli')
+
+# Skips importing the index file, e.g. for the stand-in's files, which Lantern
+# cannot read. The file is then only uploaded to the server, without the
+# lo_export that needs a superuser, and only the export, build and transfer
+# phases are measured. On by default with the stand-in.
+SKIP_IMPORT = os.environ.get(
+    'LANTERN_SKIP_IMPORT', '1' if 'lantern_cli_standin' in LANTERN_CLI else '0') == '1'
+
+# Directory on the database server that index files are transferred to
+SERVER_DIR = os.environ.get('LANTERN_SERVER_INDEX_DIR', '/tmp')
+
+# lantern-cli output line that ends exporting the vectors and starts the graph build
+BUILD_START_PATTERN = re.compile(
+    r'(creat|build)\w*\s+(the\s+)?index|indexing', re.IGNORECASE)
+
+TRANSFER_CHUNK_SIZE = 1 << 20
+
+
+def get_lantern_cli_command(dataset, N, params, index_file):
+    table = get_table_name(dataset, N)
+    index = get_index_name(dataset, N)
+    database_url = get_database_url(Extension.LANTERN)
+    command = [
+        *shlex.split(LANTERN_CLI), 'create-index',
+        '-u', database_url,
+        '-t', table,
+        '-c', 'v',
+        '-m', str(params['m']),
+        '--ef', str(params['ef']),
+        '--efc', str(params['ef_construction']),
+        '-d', str(get_vector_dim(dataset)),
+        '--metric-kind', 'cos',
+        '--out', index_file,
+        '--index-name', index,
+    ]
+    if params.get('cpu'):
+        # lantern-cli builds with every core, so it is pinned to `cpu` of them
+        if shutil.which('taskset'):
+            command = ['taskset', '-c', f"0-{params['cpu'] - 1}"] + command
+        else:
+            logging.warning(
+                f"taskset not found, building with every core instead of {params['cpu']}")
+    return command
+
+
+def run_lantern_cli(command):
+    """
+    Runs lantern-cli and returns the seconds until the graph build started
+    (None if its output never said so) and until it finished.
+    """
+    start = time.time()
+    build_start = None
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True)
+    output = []
+    for line in process.stdout:
+        output.append(line)
+        if build_start is None and BUILD_START_PATTERN.search(line):
+            build_start = time.time() - start
+    process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"lantern-cli failed with exit code {process.returncode}: {''.join(output)}")
+    if build_start is None:
+        logging.warning(
+            "No lantern-cli output line matched BUILD_START_PATTERN, so the export "
+            f"and build phases are reported as one build phase. Output: {''.join(output)}")
+    return build_start, time.time() - start
+
+
+def transfer_index_file(conn, index_file, server_file=None):
+    """
+    Copies the index file to the database server as a large object, which
+    works when the server runs on another host, and writes it to server_file
+    there. lo_export needs a superuser, so without server_file the file is
+    only uploaded.
+    """
+    lobject = conn.conn.lobject(0, 'wb')
+    try:
+        with open(index_file, 'rb') as f:
+            while chunk := f.read(TRANSFER_CHUNK_SIZE):
+                lobject.write(chunk)
+        lobject.close()
+        if server_file is not None:
+            conn.select_one("SELECT lo_export(%s, %s)",
+                            data=(lobject.oid, server_file))
+    finally:
+        conn.select_one("SELECT lo_unlink(%s)", data=(lobject.oid,))
+        conn.conn.commit()
+
+
+def import_index_file(conn, dataset, N, params, server_file):
+    table = get_table_name(dataset, N)
+    index = get_index_name(dataset, N)
+    sql = f"""
+        CREATE INDEX {index} ON {table} USING
+        lantern_hnsw (v dist_cos_ops) WITH (
+            dim={get_vector_dim(dataset)},
+            M={params['m']},
+            ef_construction={params['ef_construction']},
+            ef={params['ef']},
+            _experimental_index_path='{server_file}'
+        );
+    """
+    conn.execute(sql)
+
+
 def create_external_index(extension: Extension, dataset: Dataset, N: str, index_params={}):
+    """
+    Builds the index outside the database with lantern-cli and imports it.
+    Returns the durations in ms of exporting the vectors (None when
+    lantern-cli doesn't report where the build starts), building the graph,
+    transferring the file to the server and importing it (None with
+    SKIP_IMPORT), with their total as 'latency', and the size of the
+    .usearch file in bytes.
+    """
     # Only Lantern is supported for now. Throw error if not Lantern
     if extension != Extension.LANTERN:
         raise NotImplementedError(
@@ -23,28 +147,35 @@ def create_external_index(extension: Extension, dataset: Dataset, N: str, index_
         os.makedirs(DIR)
 
     # Get data
-    table = get_table_name(dataset, N)
     index = get_index_name(dataset, N)
     params = coalesce_index_params(extension, index_params)
     index_file = f"{DIR}/{index}.usearch"
+    server_file = f"{SERVER_DIR}/{index}.usearch"
+
+    # Export the vectors and build the graph
+    build_start, build_end = run_lantern_cli(
+        get_lantern_cli_command(dataset, N, params, index_file))
+    file_size = os.path.getsize(index_file)
+
+    with DatabaseConnection(extension) as conn:
+        t1 = time.time()
+        transfer_index_file(conn, index_file,
+                            None if SKIP_IMPORT else server_file)
+        t2 = time.time()
+        if not SKIP_IMPORT:
+            import_index_file(conn, dataset, N, params, server_file)
+        t3 = time.time()
 
-    # Create external index
-    database_url = get_database_url(extension)
-    command = ' '.join([
-        'lantern-cli create-index',
-        f"-u '{database_url}'",
-        f"-t \"{table}\"",
-        '-c "v"',
-        f"-m {params['m']}",
-        f"--ef {params['ef']}",
-        f"--efc {params['ef_construction']}",
-        f"-d {get_vector_dim(dataset)}",
-        '--metric-kind cos',
-        f"--out {index_file}",
-        f"--index-name {index}",
-        f"--import",
-    ])
-    _, err = run_command(command)
-    if err:
-        print(err)
+    os.remove(index_file)
 
+    phases = {
+        'export': None if build_start is None else build_start * 1000,
+        'build': (build_end - (build_start or 0)) * 1000,
+        'transfer': (t2 - t1) * 1000,
+        'import': None if SKIP_IMPORT else (t3 - t2) * 1000,
+    }
+    return {
+        **phases,
+        'latency': build_end * 1000 + phases['transfer'] + (phases['import'] or 0),
+        'file_size': file_size,
+    }
@@ -2,34 +2,47 @@ from .names import get_table_name, get_index_name
 from .constants import coalesce_index_params, get_vector_dim, Extension
 from .database import DatabaseConnection
 from .create_external_index import create_external_index
+from .index_cache import restore_index, label_index
 
 
-def get_create_pgvector_ivfflat_index_query(table, index, index_params):
+def get_parallel_workers_sql(workers):
+    """
+    Limits a pgvector build to `workers` processes: the leader and
+    workers - 1 parallel maintenance workers. Without workers, the server
+    settings are used. Postgres may still launch fewer workers for small
+    tables or when max_worker_processes is reached.
+    """
+    if workers is None:
+        return ''
+    return f"""
+        SET max_parallel_maintenance_workers = {workers - 1};
+        SET max_parallel_workers = {workers - 1};
+    """
+
+
+def get_create_pgvector_ivfflat_index_query(table, index, index_params, workers=None):
     params = coalesce_index_params(Extension.PGVECTOR_IVFFLAT, index_params)
     sql = f"""
-        SET maintenance_work_mem = '2GB';
+        {get_parallel_workers_sql(workers)}
+        SET maintenance_work_mem = '{params['maintenance_work_mem']}MB';
         CREATE INDEX {index} ON {table} USING
         ivfflat (v vector_cosine_ops) WITH (
             lists = {params['lists']}
         );
-        SET LOCAL ivfflat.probes = {params['probes']};
-        SET enable_seqscan = off;
     """
     return sql
 
 
-def get_create_pgvector_hnsw_index_query(table, index, index_params):
+def get_create_pgvector_hnsw_index_query(table, index, index_params, workers=None):
     params = coalesce_index_params(Extension.PGVECTOR_HNSW, index_params)
     sql = f"""
-        SET maintenance_work_mem = '2GB';
+        {get_parallel_workers_sql(workers)}
+        SET maintenance_work_mem = '{params['maintenance_work_mem']}MB';
         CREATE INDEX {index} ON {table} USING
         hnsw (v vector_cosine_ops) WITH (
             m={params['m']},
-            ef_construction={params['ef_construction']},
-            external={params['external']}
+            ef_construction={params['ef_construction']}
         );
-        SET LOCAL hnsw.ef_search = {params['ef']};
-        SET enable_seqscan = off;
     """
     return sql
 
@@ -38,19 +51,14 @@ def get_create_lantern_index_query(table, index, index_params):
     params = coalesce_index_params(Extension.LANTERN, index_params)
     vector_dim = get_vector_dim(table)
     sql = f"""
-        SET maintenance_work_mem = '2GB';
-        SET lantern.external_index_host='127.0.0.1';
-        SET lantern.external_index_port=8998;
-        SET lantern.external_index_secure=false;
+        SET maintenance_work_mem = '{params['maintenance_work_mem']}MB';
         CREATE INDEX {index} ON {table} USING
         lantern_hnsw (v dist_cos_ops) WITH (
             dim={vector_dim},
             M={params['m']},
             ef_construction={params['ef_construction']},
-            ef={params['ef']},
-            external={params['external']}
+            ef={params['ef']}
         );
-        SET enable_seqscan = off;
     """
     return sql
 
@@ -59,7 +67,7 @@ def get_create_neon_index_query(table, index, index_params):
     params = coalesce_index_params(Extension.NEON, index_params)
     vector_dim = get_vector_dim(table)
     sql = f"""
-        SET maintenance_work_mem = '2GB';
+        SET maintenance_work_mem = '{params['maintenance_work_mem']}MB';
         CREATE INDEX {index} ON {table} USING
         hnsw (v) WITH (
             dims={vector_dim},
@@ -67,26 +75,28 @@ def get_create_neon_index_query(table, index, index_params):
             efconstruction={params['ef_construction']},
             efsearch={params['ef']}
         );
-        SET enable_seqscan = off;
     """
     return sql
 
 
-def create_custom_index_query(extension, table, index, index_params):
+def create_custom_index_query(extension, table, index, index_params, workers=None):
+    if workers is not None and extension not in [Extension.PGVECTOR_IVFFLAT, Extension.PGVECTOR_HNSW]:
+        raise ValueError(
+            f"Extension {extension.value} does not support parallel index builds in SQL")
     if extension == Extension.LANTERN:
         return get_create_lantern_index_query(table, index, index_params)
     elif extension == Extension.PGVECTOR_IVFFLAT:
-        return get_create_pgvector_ivfflat_index_query(table, index, index_params)
+        return get_create_pgvector_ivfflat_index_query(table, index, index_params, workers)
     elif extension == Extension.PGVECTOR_HNSW:
-        return get_create_pgvector_hnsw_index_query(table, index, index_params)
+        return get_create_pgvector_hnsw_index_query(table, index, index_params, workers)
     elif extension == Extension.NEON:
         return get_create_neon_index_query(table, index, index_params)
 
 
-def get_create_index_query(extension, dataset, N, index_params):
+def get_create_index_query(extension, dataset, N, index_params, workers=None):
     table = get_table_name(dataset, N)
     index = get_index_name(dataset, N)
-    return create_custom_index_query(extension, table, index, index_params)
+    return create_custom_index_query(extension, table, index, index_params, workers)
 
 
 def create_custom_index(extension, table, index, index_params={}):
@@ -97,7 +107,18 @@ def create_custom_index(extension, table, index, index_params={}):
 
 
 def create_index(extension, dataset, N, index_params={}):
-    sql = get_create_index_query(extension, dataset, N, index_params)
-    if sql is not None:
+    """
+    Builds the index, or restores an identical one kept by delete_index
+    when the index cache is enabled (see index_cache).
+    """
+    if restore_index(extension, dataset, N, index_params):
+        return
+    if extension == Extension.LANTERN and index_params.get('external'):
+        create_external_index(extension, dataset, N, index_params)
+    else:
+        sql = get_create_index_query(extension, dataset, N, index_params)
+        if sql is None:
+            return
         with DatabaseConnection(extension) as conn:
             conn.execute(sql)
+    label_index(extension, dataset, N, index_params)
@@ -1,11 +1,123 @@
 import os
+import atexit
 import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
 import logging
 import subprocess
-import os
+import threading
 import re
-from tempfile import NamedTemporaryFile
-from .constants import Extension
+import glob
+import numpy as np
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from .constants import Extension, LATENCY_PERCENTILES
+
+POOL_MAX_CONNECTIONS = int(os.environ.get('POOL_MAX_CONNECTIONS', 64))
+
+
+class ConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    Thread-safe connection pool for a single database that keeps track of how
+    many connections it had to open and how many times it reused one. When
+    POOL_MAX_CONNECTIONS connections are checked out, getconn waits for one
+    to be returned instead of raising PoolError.
+    """
+
+    def __init__(self, database_url):
+        self.opened = 0
+        self.reused = 0
+        self._available = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+        super().__init__(0, POOL_MAX_CONNECTIONS, database_url)
+        # Connections are opened on demand, but kept when they are returned;
+        # psycopg2 closes returned connections beyond minconn
+        self.minconn = POOL_MAX_CONNECTIONS
+
+    def _connect(self, key=None):
+        self.opened += 1
+        return super()._connect(key)
+
+    def _getconn(self, key=None):
+        # Runs under the pool lock (see ThreadedConnectionPool.getconn), so
+        # no other thread can take or open a connection in between
+        opened = self.opened
+        conn = super()._getconn(key)
+        if self.opened == opened:
+            self.reused += 1
+        return conn
+
+    def getconn(self, key=None):
+        self._available.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        if not close and not conn.closed:
+            try:
+                reset_connection(conn)
+            except psycopg2.Error as e:
+                logging.warning(f"Could not reset pooled connection: {e}")
+                close = True
+        try:
+            super().putconn(conn, key, close or conn.closed)
+        finally:
+            self._available.release()
+
+
+# Pools are keyed by process id as well as database url so that forked child
+# processes never share the parent's sockets
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(extension=None):
+    database_url = get_database_url(extension)
+    key = (os.getpid(), database_url)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(database_url)
+        return _pools[key]
+
+
+def reset_connection(conn):
+    """
+    Roll back any open transaction and discard all session state (settings
+    such as enable_seqscan and hnsw.ef_search, temporary tables, prepared
+    statements, advisory locks and LISTEN registrations) so the next user
+    starts from a clean session. DISCARD ALL cannot run in a transaction.
+    """
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DISCARD ALL")
+
+
+def get_pool_stats():
+    """
+    Returns the number of connections opened and reused, per database url.
+    """
+    stats = {}
+    for (pid, database_url), pool in _pools.items():
+        if pid == os.getpid():
+            stats[database_url] = {'opened': pool.opened, 'reused': pool.reused}
+    return stats
+
+
+def close_pools():
+    with _pools_lock:
+        for (pid, database_url), pool in list(_pools.items()):
+            if pid != os.getpid():
+                continue
+            logging.info(
+                f"Connection pool for {database_url}: opened {pool.opened}, reused {pool.reused}")
+            pool.closeall()
+            del _pools[(pid, database_url)]
+
+
+atexit.register(close_pools)
 
 
 class DatabaseConnection:
@@ -14,14 +126,15 @@ class DatabaseConnection:
         self.autocommit = autocommit
 
     def __enter__(self):
-        self.conn = psycopg2.connect(get_database_url(self.extension))
+        self.pool = get_pool(self.extension)
+        self.conn = self.pool.getconn()
         self.conn.autocommit = self.autocommit
         self.cur = self.conn.cursor()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.cur.close()
-        self.conn.close()
+        self.pool.putconn(self.conn)
 
     def copy_expert(self, sql, file):
         """
@@ -78,13 +191,51 @@ class DatabaseConnection:
             raise
 
 
-def run_pgbench(extension, query, clients=32, threads=32, transactions=15):
+def get_pgbench_latency_percentiles(log_prefix):
+    """
+    Computes latency percentiles in ms (100 is the max) from the
+    per-transaction logs written by `pgbench --log`. Each line holds
+    `client_id transaction_no time script_no time_epoch time_us [schedule_lag]`
+    with times in microseconds. With --rate, pgbench already measures `time`
+    from the scheduled start of the transaction, so it includes the schedule
+    lag (queueing delay) and the lag is not added again.
+    """
+    latencies = []
+    for log_file in glob.glob(f"{log_prefix}.*"):
+        with open(log_file) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 6 or fields[2] in ('skipped', 'failed'):
+                    continue
+                latencies.append(float(fields[2]))
+    if not latencies:
+        return {}
+    values = np.percentile(np.array(latencies), LATENCY_PERCENTILES) / 1000
+    return dict(zip(LATENCY_PERCENTILES, values.tolist()))
+
+
+def run_pgbench(extension, query, clients=32, threads=32, transactions=15, rate=None, duration=None, settings=None):
+    """
+    Runs a pgbench script. Clients connect with settings (name to value)
+    applied through PGOPTIONS.
+    """
+    settings = settings or {}
     with NamedTemporaryFile(mode="w", delete=False) as tmp_file:
         tmp_file.write(query)
         tmp_file_path = tmp_file.name
 
-    command = f'pgbench { get_database_url(extension)} -f {tmp_file_path} -c {clients} -j {threads} -t {transactions} -P 5 -r'
-    stdout, stderr = run_command(command)
+    rate_option = '' if rate is None else f' --rate={rate}'
+    # With a duration (seconds), clients run until it elapses instead of a fixed number of transactions
+    length_option = f'-t {transactions}' if duration is None else f'-T {duration}'
+    with TemporaryDirectory() as log_dir:
+        log_prefix = os.path.join(log_dir, 'pgbench_log')
+        command = f'pgbench { get_database_url(extension)} -f {tmp_file_path} -c {clients} -j {threads} {length_option} -P 5 -r{rate_option} --log --log-prefix={log_prefix}'
+        env = None
+        if settings:
+            pgoptions = ' '.join(f"-c {name}={value}" for name, value in settings.items())
+            env = {**os.environ, 'PGOPTIONS': f"{os.environ.get('PGOPTIONS', '')} {pgoptions}".strip()}
+        stdout, stderr = run_command(command, env=env)
+        latency_percentiles = get_pgbench_latency_percentiles(log_prefix)
 
     # Extract latency average using regular expression
     latency_average = None
@@ -105,12 +256,12 @@ def run_pgbench(extension, query, clients=32, threads=32, transactions=15):
     if tps_match:
         tps = float(tps_match.group(1))
 
-    return stdout, stderr, tps, latency_average, latency_stddev
+    return stdout, stderr, tps, latency_average, latency_stddev, latency_percentiles
 
 
-def run_command(command):
+def run_command(command, env=None):
     process = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
     output, error = process.communicate()
     return output.decode(), error.decode()
 
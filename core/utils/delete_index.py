@@ -1,5 +1,6 @@
 from .names import get_index_name
 from .database import DatabaseConnection
+from .index_cache import keep_index, has_kept_indexes
 
 
 def get_drop_index_query(dataset, N):
@@ -9,12 +10,19 @@ def get_drop_index_query(dataset, N):
 
 
 def delete_index(extension, dataset, N):
+    """
+    Drops the index, unless the index cache is enabled and it was built by
+    create_index, in which case it is kept for reuse (see keep_index). The
+    extension is not dropped while kept indexes depend on it.
+    """
+    keep_index(extension, dataset, N)
     commands = ['SET enable_seqscan = on;']
     if extension != 'none':
         commands.append(get_drop_index_query(dataset, N))
-    if extension == 'lantern':
+    drop_extension = not has_kept_indexes(extension)
+    if extension == 'lantern' and drop_extension:
         commands.append('DROP EXTENSION IF EXISTS lantern;')
-    if extension == 'neon':
+    if extension == 'neon' and drop_extension:
         commands.append('DROP EXTENSION IF EXISTS embedding;')
     sql = '\n'.join(commands)
     with DatabaseConnection(extension) as conn:
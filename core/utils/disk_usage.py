@@ -0,0 +1,55 @@
+from .database import DatabaseConnection
+from .process import save_trials
+
+
+def get_current_wal_lsn(extension):
+    with DatabaseConnection(extension) as conn:
+        return conn.select_one("SELECT pg_current_wal_lsn()")[0]
+
+
+def get_wal_bytes(extension, start_lsn):
+    """
+    Returns the bytes of WAL generated since start_lsn, by this benchmark
+    and by anything else writing to the server at the same time.
+    """
+    with DatabaseConnection(extension) as conn:
+        return int(conn.select_one("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", data=(start_lsn,))[0])
+
+
+def get_relation_sizes(extension, table, index):
+    """
+    Returns the bytes of the index (all forks), the table's heap, TOAST
+    (with its index), free space map and visibility map.
+    """
+    sql = f"""
+        SELECT
+            pg_total_relation_size('{index}'),
+            pg_relation_size(c.oid, 'main'),
+            COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0),
+            pg_relation_size(c.oid, 'fsm'),
+            pg_relation_size(c.oid, 'vm')
+        FROM
+            pg_class c
+        WHERE
+            c.oid = '{table}'::regclass
+    """
+    with DatabaseConnection(extension) as conn:
+        index_size, heap, toast, fsm, vm = conn.select_one(sql)
+    return {'index': index_size, 'heap': heap, 'toast': toast, 'fsm': fsm, 'vm': vm}
+
+
+def save_footprint(footprint_metrics, footprints, rows, dim, **kwargs):
+    """
+    Saves the components of footprint_metrics (see CREATE_FOOTPRINT_METRICS)
+    of repeated measurements in bytes, bytes per row and bytes per vector
+    dimension of a row.
+    """
+    for component, (metric, per_row_metric, per_dimension_metric) in footprint_metrics.items():
+        values = [footprint[component]
+                  for footprint in footprints if component in footprint]
+        save_trials(metric, values, **kwargs)
+        if rows > 0:
+            save_trials(per_row_metric, [
+                        value / rows for value in values], **kwargs)
+            save_trials(per_dimension_metric, [
+                        value / (rows * dim) for value in values], **kwargs)
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DATASET_URL = os.environ.get(
+    'DATASET_URL', 'https://storage.googleapis.com/lanterndata/datasets')
+MANIFEST_FILE_NAME = 'manifest.json'
+DOWNLOAD_CHUNK_SIZE = 8 * 2**20
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 60
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+
+def normalize_source(source):
+    """Turns a local mirror directory into a file:// URL."""
+    if urllib.parse.urlparse(source).scheme in ('http', 'https', 'file'):
+        return source.rstrip('/')
+    return 'file://' + os.path.abspath(source)
+
+
+def get_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DatasetCache:
+    """
+    Downloads dataset files into `datapath` from `source`, which can be an
+    HTTP(S) URL, a file:// URL or a local mirror directory.
+
+    Files are downloaded to `{file}.part`, resumed with HTTP range requests
+    after a failure, and only renamed into place once their size (and sha256
+    when the source publishes a manifest.json) checks out. Completed files
+    are recorded in `{datapath}/manifest.json` so a truncated file is never
+    mistaken for a finished one.
+
+    Use it as a context manager, or call close(), so that background
+    downloads stop when loading fails.
+    """
+
+    def __init__(self, datapath, source=DATASET_URL, workers=DEFAULT_DOWNLOAD_WORKERS):
+        self.datapath = datapath
+        self.source = normalize_source(source)
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+        os.makedirs(datapath, exist_ok=True)
+        self.manifest_path = os.path.join(datapath, MANIFEST_FILE_NAME)
+        self.manifest = self._load_manifest()
+        self.source_manifest = self._load_source_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _load_source_manifest(self):
+        try:
+            with urllib.request.urlopen(f"{self.source}/{MANIFEST_FILE_NAME}", timeout=DOWNLOAD_TIMEOUT) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logging.info(
+                f"No manifest at {self.source}, checking sizes only: {e}")
+            return {}
+
+    def get_path(self, file_name):
+        return os.path.join(self.datapath, file_name)
+
+    def get_expected_size(self, file_name):
+        if 'size' in self.source_manifest.get(file_name, {}):
+            return self.source_manifest[file_name]['size']
+        url = f"{self.source}/{file_name}"
+        if url.startswith('file://'):
+            return os.path.getsize(urllib.parse.urlparse(url).path)
+        request = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            content_length = response.headers.get('Content-Length')
+        return None if content_length is None else int(content_length)
+
+    def is_complete(self, file_name):
+        path = self.get_path(file_name)
+        if not os.path.exists(path):
+            return False
+        entry = self.manifest.get(file_name)
+        if entry is not None:
+            return os.path.getsize(path) == entry['size']
+
+        # Files downloaded before the manifest existed are kept if their size
+        # matches the source, and resumed as partial downloads otherwise
+        try:
+            expected_size = self.get_expected_size(file_name)
+        except (urllib.error.URLError, OSError) as e:
+            logging.warning(
+                f"Could not reach {self.source} to check the size of {path}, assuming it is complete: {e}")
+            expected_size = None
+        if expected_size is not None and os.path.getsize(path) != expected_size:
+            logging.warning(
+                f"{path} is incomplete ({os.path.getsize(path)} of {expected_size} bytes), resuming")
+            os.replace(path, path + '.part')
+            return False
+        self._record(file_name)
+        return True
+
+    def _record(self, file_name):
+        path = self.get_path(file_name)
+        with self.lock:
+            self.manifest[file_name] = {
+                'size': os.path.getsize(path),
+                'sha256': get_sha256(path),
+            }
+            self._save_manifest()
+
+    def _copy(self, src, dst):
+        """Copies src to dst in chunks, stopping when the cache is closed."""
+        while chunk := src.read(DOWNLOAD_CHUNK_SIZE):
+            if self.closed.is_set():
+                raise DownloadCancelled()
+            dst.write(chunk)
+
+    def _fetch(self, file_name, part_path):
+        """Appends the missing bytes of file_name to part_path."""
+        url = f"{self.source}/{file_name}"
+        offset = os.path.getsize(part_path) if os.path.exists(
+            part_path) else 0
+
+        if url.startswith('file://'):
+            with open(urllib.parse.urlparse(url).path, 'rb') as src, open(part_path, 'ab') as dst:
+                src.seek(offset)
+                self._copy(src, dst)
+            return
+
+        request = urllib.request.Request(url)
+        if offset > 0:
+            request.add_header('Range', f"bytes={offset}-")
+        try:
+            response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # Range starts at the end of the file, nothing left to fetch
+                return
+            raise
+        with response:
+            mode = 'ab' if response.status == 206 else 'wb'
+            with open(part_path, mode) as dst:
+                self._copy(response, dst)
+
+    def _verify(self, file_name, part_path):
+        expected = self.source_manifest.get(file_name, {})
+        expected_size = expected.get('size') or self.get_expected_size(file_name)
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                os.remove(part_path)
+            raise IOError(
+                f"Downloaded {size} of {expected_size} bytes of {file_name}")
+        if 'sha256' in expected and get_sha256(part_path) != expected['sha256']:
+            os.remove(part_path)
+            raise IOError(f"Checksum mismatch for {file_name}")
+
+    def download(self, file_name):
+        """Downloads file_name if it is not complete yet and returns its path."""
+        path = self.get_path(file_name)
+        if self.is_complete(file_name):
+            return path
+
+        part_path = path + '.part'
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                logging.info(
+                    f"Downloading {self.source}/{file_name} (attempt {attempt + 1})...")
+                self._fetch(file_name, part_path)
+                self._verify(file_name, part_path)
+                break
+            except (urllib.error.URLError, OSError) as e:
+                logging.warning(f"Download of {file_name} failed: {e}")
+                if attempt == DOWNLOAD_RETRIES - 1 or self.closed.is_set():
+                    raise
+                time.sleep(2 ** attempt)
+
+        os.replace(part_path, path)
+        self._record(file_name)
+        logging.info(f"Download of {file_name} complete.")
+        return path
+
+    def prefetch(self, file_names):
+        """Starts downloading file_names in the background."""
+        for file_name in file_names:
+            if file_name not in self.futures:
+                self.futures[file_name] = self.executor.submit(
+                    self.download, file_name)
+
+    def get(self, file_name):
+        """Returns the local path of file_name, waiting for its download."""
+        self.prefetch([file_name])
+        return self.futures[file_name].result()
+
+    def close(self):
+        """
+        Cancels downloads that have not started and stops running ones after
+        their current chunk, keeping their .part files to resume later.
+        """
+        self.closed.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+_caches = {}
+
+
+def get_dataset_cache(datapath, source=None):
+    source = source or os.environ.get('DATASET_MIRROR') or DATASET_URL
+    key = (datapath, normalize_source(source))
+    if key not in _caches or _caches[key].closed.is_set():
+        _caches[key] = DatasetCache(datapath, source)
+    return _caches[key]
@@ -0,0 +1,233 @@
+import os
+import json
+import hashlib
+import logging
+from .constants import Extension, EXTENSION_NAMES, coalesce_index_params
+from .database import DatabaseConnection
+from .names import get_table_name, get_index_name
+from .search_profile import SEARCH_INDEX_PARAMS
+from .load import get_column_name, get_column_type
+
+# Disk space of kept tables and their indexes (e.g. 20GB, see pg_size_bytes).
+# The cache is off unless this is set.
+INDEX_CACHE_SIZE = os.environ.get('INDEX_CACHE_SIZE')
+
+INDEX_CACHE_TABLE = 'index_cache'
+
+# Rows, spread evenly over the ids, whose contents are checksummed in the
+# cache key (see get_table_fingerprint)
+FINGERPRINT_ROWS = 1000
+
+
+def is_index_cache_enabled(extension):
+    return bool(INDEX_CACHE_SIZE) and extension != Extension.NONE
+
+
+def setup_index_cache(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {INDEX_CACHE_TABLE} (
+            cache_key TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            kept_table TEXT NOT NULL,
+            index_params TEXT NOT NULL,
+            size_bytes BIGINT NOT NULL,
+            last_used TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+def has_kept_indexes(extension):
+    """Returns whether the database of the extension holds kept indexes."""
+    if not is_index_cache_enabled(extension):
+        return False
+    with DatabaseConnection(extension) as conn:
+        if conn.select_one("SELECT to_regclass(%s)", data=(INDEX_CACHE_TABLE,))[0] is None:
+            return False
+        return conn.select_one(f"SELECT EXISTS (SELECT 1 FROM {INDEX_CACHE_TABLE})")[0]
+
+
+def get_cache_params(extension, index_params):
+    """Returns the params that an index is built with, without search params."""
+    params = coalesce_index_params(extension, index_params)
+    return {param: value for param, value in params.items()
+            if param not in SEARCH_INDEX_PARAMS[extension]}
+
+
+def get_table_fingerprint(conn, table):
+    """
+    Returns the row count, MAX(id) and a checksum of the ids and vectors of
+    FINGERPRINT_ROWS rows spread evenly over the ids. The sampled rows are
+    read through the primary key, so only the count scans the table.
+    """
+    column = get_column_name(table)
+    count, max_id = conn.select_one(f"SELECT COUNT(*), MAX(id) FROM {table}")
+    if max_id is None:
+        return [count, max_id, None]
+    step = max(max_id // FINGERPRINT_ROWS, 1)
+    checksum = conn.select_one(f"""
+        SELECT
+            md5(string_agg(t.id || ':' || t.{column}::text, ',' ORDER BY t.id))
+        FROM
+            generate_series(1, %s, %s) AS s(id)
+        JOIN
+            {table} t ON t.id = s.id
+    """, data=(max_id, step))[0]
+    return [count, max_id, checksum]
+
+
+def get_cache_key(conn, extension, table, cache_params):
+    """
+    Hashes the extension version, build params and a fingerprint of the
+    table contents (see get_table_fingerprint), so that an index is only
+    reused on the same rows and by the same extension build.
+    """
+    version = conn.select_one(
+        "SELECT extversion FROM pg_extension WHERE extname = %s", data=(EXTENSION_NAMES[extension],))
+    fingerprint = get_table_fingerprint(conn, table)
+    key = json.dumps([extension.value, version and version[0], table, cache_params, fingerprint],
+                     sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_kept_table_name(table, cache_key):
+    return f"{table}_kept_{cache_key[:16]}"
+
+
+def label_index(extension, dataset, N, index_params):
+    """
+    Records the build params and cache key of a new index in its comment,
+    so that keep_index knows what it was built with and on which rows. The
+    key is computed right after the build, before benchmarks write to the
+    table.
+    """
+    if not is_index_cache_enabled(extension):
+        return
+    table = get_table_name(dataset, N)
+    index = get_index_name(dataset, N)
+    cache_params = get_cache_params(extension, index_params)
+    with DatabaseConnection(extension) as conn:
+        label = json.dumps({
+            'cache_key': get_cache_key(conn, extension, table, cache_params),
+            'params': cache_params,
+        }, sort_keys=True)
+        conn.execute(f"COMMENT ON INDEX {index} IS %s", data=(label,))
+
+
+def evict_indexes(conn):
+    """Drops the least recently used kept tables beyond INDEX_CACHE_SIZE."""
+    rows = conn.select(f"""
+        SELECT
+            cache_key,
+            kept_table,
+            SUM(size_bytes) OVER (ORDER BY last_used DESC) > pg_size_bytes(%s)
+        FROM
+            {INDEX_CACHE_TABLE}
+        ORDER BY
+            last_used DESC
+    """, data=(INDEX_CACHE_SIZE,))
+    for cache_key, kept_table, over_budget in rows:
+        if over_budget:
+            logging.info(f"Evicting kept table {kept_table}")
+            conn.execute(
+                f"DROP TABLE IF EXISTS {kept_table}; DELETE FROM {INDEX_CACHE_TABLE} WHERE cache_key = %s", data=(cache_key,))
+
+
+def get_rename_table_query(source_table, source_index, dest_table, dest_index):
+    """
+    Renames a dataset table with its primary key, id sequence and vector
+    index, so that every name follows the table name.
+    """
+    return f"""
+        ALTER TABLE {source_table} RENAME TO {dest_table};
+        ALTER INDEX {source_table}_pkey RENAME TO {dest_table}_pkey;
+        ALTER SEQUENCE {source_table}_id_seq RENAME TO {dest_table}_id_seq;
+        ALTER INDEX {source_index} RENAME TO {dest_index};
+    """
+
+
+def keep_index(extension, dataset, N):
+    """
+    Detaches the table with the index instead of dropping the index, if it
+    was built by create_index (see label_index) on rows that have not
+    changed since. The table is renamed out of the way with its index and
+    an identical table without the index takes its place, so the kept index
+    is never written to and no catalog flags are changed. Indexes built
+    elsewhere, e.g. by benchmark_create to measure the build, are left to
+    be dropped.
+    """
+    if not is_index_cache_enabled(extension):
+        return
+    table = get_table_name(dataset, N)
+    index = get_index_name(dataset, N)
+    try:
+        with DatabaseConnection(extension) as conn:
+            label = conn.select_one(
+                "SELECT obj_description(to_regclass(%s), 'pg_class')", data=(index,))[0]
+            if label is None:
+                return
+            label = json.loads(label)
+            cache_key = label['cache_key']
+            if get_cache_key(conn, extension, table, label['params']) != cache_key:
+                logging.info(
+                    f"Not keeping index {index}: {table} changed since it was built")
+                return
+            setup_index_cache(conn)
+            kept_table = get_kept_table_name(table, cache_key)
+            column = get_column_name(table)
+            conn.execute(f"""
+                DROP TABLE IF EXISTS {kept_table};
+                DELETE FROM {INDEX_CACHE_TABLE} WHERE cache_key = %s;
+                {get_rename_table_query(table, index, kept_table, f"{kept_table}_index")}
+                CREATE TABLE {table} (
+                    id SERIAL,
+                    {column} {get_column_type(extension, table)}
+                );
+                INSERT INTO {table} (id, {column})
+                SELECT id, {column} FROM {kept_table};
+                ALTER TABLE {table} ADD PRIMARY KEY (id);
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST(MAX(id), 1)) FROM {table};
+                INSERT INTO {INDEX_CACHE_TABLE} (cache_key, table_name, kept_table, index_params, size_bytes)
+                VALUES (%s, %s, %s, %s, pg_total_relation_size('{kept_table}'));
+            """, data=(cache_key, cache_key, table, kept_table, json.dumps(label['params'], sort_keys=True)))
+            logging.info(f"Kept index {index} on {kept_table}")
+            evict_indexes(conn)
+    except Exception as e:
+        logging.warning(f"Could not keep index {index}: {e}")
+
+
+def restore_index(extension, dataset, N, index_params=None):
+    """
+    Swaps in a kept table whose index has the same cache key as the index
+    that create_index would build, and returns whether there was one.
+    """
+    if not is_index_cache_enabled(extension):
+        return False
+    table = get_table_name(dataset, N)
+    index = get_index_name(dataset, N)
+    cache_params = get_cache_params(extension, index_params or {})
+    try:
+        with DatabaseConnection(extension) as conn:
+            setup_index_cache(conn)
+            cache_key = get_cache_key(conn, extension, table, cache_params)
+            row = conn.select_one(
+                f"SELECT kept_table, to_regclass(kept_table) IS NOT NULL FROM {INDEX_CACHE_TABLE} WHERE cache_key = %s",
+                data=(cache_key,))
+            if row is None:
+                return False
+            kept_table, exists = row
+            if not exists:
+                # Dropped by hand
+                conn.execute(
+                    f"DELETE FROM {INDEX_CACHE_TABLE} WHERE cache_key = %s", data=(cache_key,))
+                return False
+            # The kept table has the same rows, so it replaces the table
+            conn.execute(f"""
+                DELETE FROM {INDEX_CACHE_TABLE} WHERE cache_key = %s;
+                DROP TABLE {table};
+                {get_rename_table_query(kept_table, f"{kept_table}_index", table, index)}
+            """, data=(cache_key,))
+            logging.info(f"Restored index {index} from {kept_table}")
+            return True
+    except Exception as e:
+        logging.warning(f"Could not restore index {index}: {e}")
+        return False
@@ -0,0 +1,274 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .database import DatabaseConnection
+from .constants import EXTENSIONS_USING_VECTOR, get_vector_dim
+from .vector_files import read_vector_file, encode_array_rows, encode_vector_rows, BinaryCopyStream
+
+DEFAULT_LOAD_WORKERS = os.cpu_count() or 1
+
+TRUTH_IDS_COMMENT = 'base ids'
+
+
+class FileRange:
+    """
+    Read-only file-like object over the bytes [start, end) of a file, so that
+    several COPY streams can read disjoint parts of the same file.
+    """
+
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def split_file(path, count):
+    """
+    Split a text file into at most `count` byte ranges that start and end on
+    line boundaries.
+    """
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            f.seek(max(size * i // count, boundaries[-1]))
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def get_id_offsets(counts):
+    """
+    Returns the id offset of every range of a file split by split_file: the
+    number of rows in the ranges before it.
+    """
+    offsets = [0]
+    for count in counts[:-1]:
+        offsets.append(offsets[-1] + count)
+    return offsets
+
+
+def get_column_name(table):
+    return 'indices' if 'truth' in table else 'v'
+
+
+def get_column_type(extension, table):
+    """Returns the type of the data column of a dataset table."""
+    if 'truth' in table:
+        return 'INTEGER[]'
+    vector_dim = get_vector_dim(table)
+    if extension in EXTENSIONS_USING_VECTOR:
+        return f"VECTOR({vector_dim})"
+    return f"REAL[{vector_dim}]"
+
+
+def get_staging_column_type(table):
+    """Returns the type that the CSV text is parsed into before conversion."""
+    return 'INTEGER[]' if 'truth' in table else 'REAL[]'
+
+
+def get_staging_conversion(extension, table):
+    """
+    Returns the expression that converts the staging column r into the data
+    column. Prebuilt truth CSVs, like .ivecs ground truth, hold 0-based row
+    numbers while dataset ids start at 1, so their elements are shifted.
+    """
+    if 'truth' in table:
+        return "ARRAY(SELECT i + 1 FROM unnest(r) WITH ORDINALITY AS u(i, o) ORDER BY o)"
+    if extension in EXTENSIONS_USING_VECTOR:
+        return f"r::{get_column_type(extension, table)}"
+    return 'r'
+
+
+def mark_base_truth_ids(conn, table):
+    """Records that a truth table holds base table ids (see has_base_truth_ids)."""
+    conn.execute(f"COMMENT ON TABLE {table} IS %s", data=(TRUTH_IDS_COMMENT,))
+
+
+def has_base_truth_ids(extension, table):
+    """
+    Returns whether a truth table was filled with base table ids, by this
+    module or by core.truth. Truth tables loaded before the ids were shifted
+    hold 0-based row numbers and have no such comment.
+    """
+    with DatabaseConnection(extension) as conn:
+        comment = conn.select_one(
+            "SELECT obj_description(to_regclass(%s), 'pg_class')", data=(table,))[0]
+    return comment == TRUTH_IDS_COMMENT
+
+
+def get_staging_table_name(table, index):
+    return f"{table}_staging{index}"
+
+
+def drop_primary_key(extension, table):
+    with DatabaseConnection(extension) as conn:
+        conn.execute(
+            f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey;")
+
+
+def add_primary_key(extension, table, row_count):
+    with DatabaseConnection(extension) as conn:
+        conn.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id);")
+        if row_count > 0:
+            conn.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), {row_count});")
+
+
+def discard_partial_load(extension, table, staging_tables=None):
+    """
+    Empties a table whose parallel load failed, so that has_rows does not
+    take it for loaded, and restores its primary key.
+    """
+    with DatabaseConnection(extension) as conn:
+        conn.execute('\n'.join(
+            [f"DROP TABLE IF EXISTS {staging_table};" for staging_table in staging_tables or []] +
+            [f"TRUNCATE {table};"]))
+    add_primary_key(extension, table, 0)
+
+
+def log_load_rate(table, rows, size, seconds):
+    seconds = max(seconds, 1e-9)
+    logging.info(
+        f"Loaded {rows} rows ({size / 2**20:.2f} MiB) into {table} in {seconds:.2f} s: " +
+        f"{rows / seconds:.0f} rows/s, {size / 2**20 / seconds:.2f} MiB/s")
+
+
+def parallel_copy_csv(extension, table, source_csv, workers=DEFAULT_LOAD_WORKERS):
+    """
+    Loads a CSV file into an existing dataset table with `workers` parallel
+    COPY streams.
+
+    Each worker copies one byte range of the file into its own UNLOGGED
+    staging table, whose identity column numbers rows in file order. The
+    staging rows are then converted straight into the final column type with
+    their ids offset by the number of rows in the preceding ranges, so ids
+    match line numbers exactly as with a single COPY. The primary key is
+    built once at the end. If any range fails, the table is emptied again
+    (see discard_partial_load) and the error is raised.
+    """
+    start_time = time.time()
+    ranges = split_file(source_csv, workers)
+    column = get_column_name(table)
+    staging_type = get_staging_column_type(table)
+    conversion = get_staging_conversion(extension, table)
+
+    def copy_range(index):
+        start, end = ranges[index]
+        staging_table = get_staging_table_name(table, index)
+        with DatabaseConnection(extension) as conn:
+            conn.execute(f"""
+                DROP TABLE IF EXISTS {staging_table};
+                CREATE UNLOGGED TABLE {staging_table} (
+                    id BIGINT GENERATED ALWAYS AS IDENTITY,
+                    r {staging_type}
+                );
+            """)
+            with FileRange(source_csv, start, end) as f:
+                conn.copy_expert(
+                    f"COPY {staging_table} (r) FROM STDIN WITH csv", f)
+            return conn.select_one(f"SELECT COUNT(*) FROM {staging_table};")[0]
+
+    def insert_range(index, offset):
+        staging_table = get_staging_table_name(table, index)
+        with DatabaseConnection(extension) as conn:
+            conn.execute(f"""
+                INSERT INTO {table} (id, {column})
+                SELECT {offset} + id, {conversion}
+                FROM {staging_table};
+                DROP TABLE {staging_table};
+            """)
+
+    drop_primary_key(extension, table)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(copy_range, range(len(ranges))))
+            offsets = get_id_offsets(counts)
+            list(executor.map(insert_range, range(len(ranges)), offsets))
+    except Exception:
+        logging.error(f"Loading {source_csv} into {table} failed, emptying {table}")
+        discard_partial_load(extension, table, [
+            get_staging_table_name(table, index) for index in range(len(ranges))])
+        raise
+    row_count = sum(counts)
+    add_primary_key(extension, table, row_count)
+    if 'truth' in table:
+        with DatabaseConnection(extension) as conn:
+            mark_base_truth_ids(conn, table)
+
+    log_load_rate(table, row_count, os.path.getsize(
+        source_csv), time.time() - start_time)
+    return row_count
+
+
+def get_binary_encoder(extension, table):
+    if 'truth' in table:
+        # .ivecs ground truth holds 0-based row numbers, dataset ids start at 1
+        return lambda ids, values: encode_array_rows(ids, values + 1, '>i4')
+    if extension in EXTENSIONS_USING_VECTOR:
+        return encode_vector_rows
+    return lambda ids, values: encode_array_rows(ids, values, '>f4')
+
+
+def parallel_copy_vectors(extension, table, source_file, workers=DEFAULT_LOAD_WORKERS):
+    """
+    Loads a memory-mapped vector file (see VECTOR_FILE_EXTENSIONS) into an
+    existing dataset table with `workers` parallel binary COPY streams.
+
+    Row ids are sent explicitly, so the streams write disjoint id ranges
+    straight into the final table. Vector columns are sent in pgvector's
+    binary format, everything else as binary arrays. If any stream fails,
+    the table is emptied again (see discard_partial_load).
+    """
+    start_time = time.time()
+    vectors = read_vector_file(source_file)
+    if 'truth' not in table and vectors.shape[1] != get_vector_dim(table):
+        raise ValueError(
+            f"{source_file} has vectors of dimension {vectors.shape[1]}, expected {get_vector_dim(table)} for {table}")
+    column = get_column_name(table)
+    encode = get_binary_encoder(extension, table)
+    row_count = vectors.shape[0]
+    boundaries = [row_count * index // workers for index in range(workers + 1)]
+
+    def copy_range(start, end):
+        if end <= start:
+            return
+        stream = BinaryCopyStream(vectors, start, end, encode)
+        with DatabaseConnection(extension) as conn:
+            conn.copy_expert(
+                f"COPY {table} (id, {column}) FROM STDIN WITH (FORMAT binary)", stream)
+
+    drop_primary_key(extension, table)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(copy_range, boundaries[:-1], boundaries[1:]))
+    except Exception:
+        logging.error(f"Loading {source_file} into {table} failed, emptying {table}")
+        discard_partial_load(extension, table)
+        raise
+    add_primary_key(extension, table, row_count)
+    if 'truth' in table:
+        with DatabaseConnection(extension) as conn:
+            mark_base_truth_ids(conn, table)
+
+    log_load_rate(table, row_count, os.path.getsize(
+        source_file), time.time() - start_time)
+    return row_count
@@ -0,0 +1,287 @@
+import re
+import time
+import random
+import asyncio
+import threading
+import asyncpg
+from .database import get_database_url, run_pgbench
+from .constants import LATENCY_PERCENTILES
+from .search_profile import get_active_search_settings
+
+# Latencies are recorded in microseconds. Values below 2^8 are exact, larger
+# values keep 7 significant bits (< 1% relative error) like an HDR histogram.
+HISTOGRAM_EXACT_BITS = 8
+HISTOGRAM_SUB_BUCKET_BITS = 7
+HISTOGRAM_MAX_BITS = 40
+
+# Seconds between progress lines, as with pgbench -P 5
+PROGRESS_INTERVAL = 5
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram with a fixed number of buckets, so that
+    recording is O(1) and histograms from several threads can be merged.
+    """
+
+    def __init__(self):
+        sub_buckets = 1 << HISTOGRAM_SUB_BUCKET_BITS
+        self.counts = [0] * ((1 << HISTOGRAM_EXACT_BITS) +
+                             (HISTOGRAM_MAX_BITS - HISTOGRAM_EXACT_BITS) * sub_buckets)
+        self.count = 0
+        self.total = 0
+        self.total_squared = 0
+        self.max = 0
+
+    @staticmethod
+    def get_index(value):
+        if value < (1 << HISTOGRAM_EXACT_BITS):
+            return value
+        shift = value.bit_length() - HISTOGRAM_EXACT_BITS
+        sub_buckets = 1 << HISTOGRAM_SUB_BUCKET_BITS
+        return (1 << HISTOGRAM_EXACT_BITS) + (shift - 1) * sub_buckets + (value >> shift) - sub_buckets
+
+    @staticmethod
+    def get_value(index):
+        """Returns the midpoint of the range of values recorded at index."""
+        if index < (1 << HISTOGRAM_EXACT_BITS):
+            return index
+        sub_buckets = 1 << HISTOGRAM_SUB_BUCKET_BITS
+        offset = index - (1 << HISTOGRAM_EXACT_BITS)
+        shift = offset // sub_buckets + 1
+        return ((offset % sub_buckets + sub_buckets) << shift) + (1 << shift) / 2
+
+    def record(self, latency_us):
+        latency_us = max(int(latency_us), 0)
+        self.counts[min(self.get_index(latency_us), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += latency_us
+        self.total_squared += latency_us ** 2
+        self.max = max(self.max, latency_us)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.total_squared += other.total_squared
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def stddev(self):
+        if self.count < 2:
+            return None
+        variance = (self.total_squared - self.total ** 2 / self.count) / \
+            (self.count - 1)
+        return max(variance, 0) ** 0.5
+
+    def percentile(self, percentile):
+        if self.count == 0:
+            return None
+        if percentile >= 100:
+            return self.max
+        # Rounded so that e.g. p99.9 of 5000 values is the 4995th, not the 4996th
+        rank = round(percentile / 100 * self.count, 9)
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count > 0 and cumulative >= rank:
+                return min(self.get_value(index), self.max)
+        return self.max
+
+
+def parse_pgbench_script(query):
+    """
+    Splits a pgbench script into its `\\set name random(a, b)` variables and
+    the SQL to run.
+    """
+    variables = []
+    sql_lines = []
+    for line in query.splitlines():
+        match = re.match(
+            r'\s*\\set\s+(\w+)\s+random\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)', line)
+        if match:
+            variables.append(
+                (match.group(1), int(match.group(2)), int(match.group(3))))
+        elif line.strip().startswith('\\'):
+            raise ValueError(f"Unsupported pgbench meta-command: {line}")
+        else:
+            sql_lines.append(line)
+    return variables, '\n'.join(sql_lines)
+
+
+def render_sql(variables, sql):
+    for name, low, high in variables:
+        sql = re.sub(rf":{name}\b", str(random.randint(low, high)), sql)
+    return sql
+
+
+async def run_client(database_url, variables, sql, transactions, interval, histogram, lag_histogram, deadline=None, settings=None):
+    """
+    Runs `transactions` transactions on one connection, or as many as fit
+    before the deadline (a time.perf_counter() value). With an interval
+    (mean seconds between arrivals), transactions are scheduled as a Poisson
+    process and latency is measured from the scheduled start, so queueing
+    delay is included as with pgbench --rate.
+    """
+    conn = await asyncpg.connect(database_url, server_settings=settings)
+    try:
+        scheduled = time.perf_counter()
+        count = 0
+        while (count < transactions) if deadline is None else (time.perf_counter() < deadline):
+            count += 1
+            if interval is not None:
+                scheduled += random.expovariate(1 / interval)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                start = time.perf_counter()
+                lag_histogram.record((start - scheduled) * 1e6)
+            else:
+                start = time.perf_counter()
+                scheduled = start
+            await conn.execute(render_sql(variables, sql))
+            histogram.record((time.perf_counter() - scheduled) * 1e6)
+    finally:
+        await conn.close()
+
+
+def run_thread(database_url, variables, sql, clients, transactions, interval, histogram, lag_histogram, errors, deadline=None, settings=None):
+    """Runs clients on one event loop, appending the exceptions they raise to errors."""
+    async def run_clients():
+        results = await asyncio.gather(*[
+            run_client(database_url, variables, sql, transactions,
+                       interval, histogram, lag_histogram, deadline, settings)
+            for _ in range(clients)], return_exceptions=True)
+        errors.extend(result for result in results
+                      if isinstance(result, BaseException))
+    try:
+        asyncio.run(run_clients())
+    except Exception as e:
+        errors.append(e)
+
+
+def get_histogram_totals(histograms):
+    return (sum(h.count for h in histograms), sum(h.total for h in histograms),
+            sum(h.total_squared for h in histograms))
+
+
+def get_progress_line(offset, interval, previous, current, previous_lag, current_lag, rate):
+    """Formats the transactions between two histogram totals like a pgbench -P line."""
+    count, total, total_squared = (c - p for c, p in zip(current, previous))
+    latency_average = total / count / 1000 if count else 0
+    if count > 1:
+        variance = (total_squared - total ** 2 / count) / (count - 1)
+        latency_stddev = f"{max(variance, 0) ** 0.5 / 1000:.3f}"
+    else:
+        latency_stddev = 'NaN'
+    line = f"progress: {offset:.1f} s, {count / interval:.1f} tps, lat {latency_average:.3f} ms stddev {latency_stddev}"
+    if rate is not None:
+        lag_count, lag_total, _ = (c - p for c, p in zip(current_lag, previous_lag))
+        line += f", lag {lag_total / lag_count / 1000 if lag_count else 0:.3f} ms"
+    return line
+
+
+def run_native_load(extension, query, clients=32, threads=32, transactions=15, rate=None, duration=None, settings=None):
+    """
+    Runs a pgbench-style script with an asyncio load generator instead of
+    pgbench. Clients are spread over `threads` event loops and each runs
+    `transactions` transactions, or keeps running for `duration` seconds
+    when it is set. Without a rate the load is closed-loop; with a rate
+    (transactions per second over all clients) it is open-loop. Clients
+    connect with settings (name to value) applied.
+
+    Like pgbench -P, a progress line is written to stderr every
+    PROGRESS_INTERVAL seconds. Returns the same values as run_pgbench:
+    stdout, stderr, tps, the latency average and stddev in ms and a dict of
+    latency percentiles in ms (100 is the max). If any client fails, its
+    error is written to stderr and tps, latency and percentiles are empty,
+    as when pgbench fails.
+    """
+    database_url = get_database_url(extension)
+    variables, sql = parse_pgbench_script(query)
+    threads = max(min(threads, clients), 1)
+    interval = None if rate is None else clients / rate
+
+    histograms = [LatencyHistogram() for _ in range(threads)]
+    lag_histograms = [LatencyHistogram() for _ in range(threads)]
+    errors = []
+    start = time.perf_counter()
+    deadline = None if duration is None else start + duration
+    workers = []
+    for index in range(threads):
+        thread_clients = clients // threads + \
+            (1 if index < clients % threads else 0)
+        workers.append(threading.Thread(target=run_thread, args=(
+            database_url, variables, sql, thread_clients, transactions, interval, histograms[index], lag_histograms[index], errors, deadline, settings)))
+
+    for worker in workers:
+        worker.start()
+
+    progress_lines = []
+    previous, previous_lag = get_histogram_totals(
+        histograms), get_histogram_totals(lag_histograms)
+    next_progress = start + PROGRESS_INTERVAL
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(max(next_progress - time.perf_counter(), 0))
+            if time.perf_counter() >= next_progress:
+                current, current_lag = get_histogram_totals(
+                    histograms), get_histogram_totals(lag_histograms)
+                progress_lines.append(get_progress_line(
+                    next_progress - start, PROGRESS_INTERVAL, previous, current, previous_lag, current_lag, rate))
+                previous, previous_lag = current, current_lag
+                next_progress += PROGRESS_INTERVAL
+    elapsed = time.perf_counter() - start
+
+    stderr = ''.join(line + '\n' for line in progress_lines)
+    if errors:
+        stderr += ''.join(
+            f"client error: {type(error).__name__}: {error}\n" for error in errors)
+        return '', stderr, None, None, None, {}
+
+    histogram, lag_histogram = LatencyHistogram(), LatencyHistogram()
+    for thread_histogram, thread_lag_histogram in zip(histograms, lag_histograms):
+        histogram.merge(thread_histogram)
+        lag_histogram.merge(thread_lag_histogram)
+
+    if duration is None and histogram.count < clients * transactions:
+        raise RuntimeError(
+            f"Only {histogram.count} of {clients * transactions} transactions completed")
+
+    tps = histogram.count / elapsed
+    latency_average = histogram.mean() / 1000
+    latency_stddev = (histogram.stddev() or 0) / 1000
+    latency_percentiles = {
+        p: histogram.percentile(p) / 1000 for p in LATENCY_PERCENTILES}
+
+    lines = [
+        f"number of clients: {clients}",
+        f"number of threads: {threads}",
+        f"number of transactions per client: {transactions}",
+        f"number of transactions actually processed: {histogram.count}",
+        f"latency average = {latency_average:.3f} ms",
+        f"latency stddev = {latency_stddev:.3f} ms",
+    ]
+    lines += [f"latency {'max' if p == 100 else f'p{p}'} = {value:.3f} ms"
+              for p, value in latency_percentiles.items()]
+    if rate is not None:
+        lines.append(f"rate limit schedule lag: avg {lag_histogram.mean() / 1000:.3f} " +
+                     f"(max {lag_histogram.max / 1000:.3f}) ms")
+    lines.append(f"tps = {tps:.6f}")
+    stdout = '\n'.join(lines) + '\n'
+
+    return stdout, stderr, tps, latency_average, latency_stddev, latency_percentiles
+
+
+def run_load(extension, query, clients=32, threads=32, transactions=15, native=False, rate=None, duration=None):
+    """
+    Runs a benchmark script with pgbench, or with the native load generator
+    when native is set, with the settings of the active SearchProfile. Both
+    return the same values, see run_native_load.
+    """
+    settings = get_active_search_settings()
+    if native:
+        return run_native_load(extension, query, clients, threads, transactions, rate, duration, settings)
+    return run_pgbench(extension, query, clients, threads, transactions, rate, duration, settings)
@@ -1,6 +1,15 @@
 import json
+import atexit
+import logging
+from psycopg2.extras import execute_values
 from .numbers import convert_string_to_number
 from .database import DatabaseConnection
+from .run import get_run_id, register_run
+from .stats import get_trial_stats
+
+# Every run keeps its own results; reads go through a view of the latest
+# result of every configuration
+LATEST_RESULTS_VIEW = 'latest_experiment_results'
 
 
 def dump_index_params(index_params):
@@ -27,7 +36,7 @@ def get_distinct_index_params(metric_type, extension, dataset, N=None):
         SELECT DISTINCT
             index_params
         FROM
-            experiment_results
+            {LATEST_RESULTS_VIEW}
         WHERE
             {metric_type_sql}
             AND extension = %s
@@ -46,11 +55,22 @@ def get_distinct_index_params(metric_type, extension, dataset, N=None):
     return index_params
 
 
-def get_experiment_results_for_params(metric_type, extension, index_params, dataset, N=None, K=None):
-    x_param = 'N' if N is None else 'K'
+def get_experiment_results_for_params(metric_type, extension, index_params, dataset, N=None, K=None, qps=0, clients=0, write_pct=0, workers=0, x_param=None):
+    """
+    Returns (x, metric values...) rows ordered by x_param, which defaults to
+    N, or K when N is fixed. Results of open-loop runs at a target rate, of
+    client-count sweeps, of mixed workloads and of parallel build sweeps are
+    only included for the given qps, clients, write_pct and workers (all
+    values if None).
+    """
+    x_param = x_param or ('N' if N is None else 'K')
 
     n_sql = '' if N is None else f"AND N = {convert_string_to_number(N)}"
     k_sql = '' if K is None else f"AND K = {K}"
+    qps_sql = '' if qps is None else f"AND qps = {qps}"
+    clients_sql = '' if clients is None else f"AND clients = {clients}"
+    write_pct_sql = '' if write_pct is None else f"AND write_pct = {write_pct}"
+    workers_sql = '' if workers is None else f"AND workers = {workers}"
 
     metric_type_sql, metric_type_value, multiple_metrics = get_metric_sql_and_value(
         metric_type)
@@ -68,7 +88,7 @@ def get_experiment_results_for_params(metric_type, extension, index_params, data
             {x_param},
             {columns_sql}
         FROM
-            experiment_results
+            {LATEST_RESULTS_VIEW}
         WHERE
             {metric_type_sql}
             AND extension = %s
@@ -76,6 +96,10 @@ def get_experiment_results_for_params(metric_type, extension, index_params, data
             AND dataset = %s
             {n_sql}
             {k_sql}
+            {qps_sql}
+            {clients_sql}
+            {write_pct_sql}
+            {workers_sql}
         {group_by_sql}
         ORDER BY
             {x_param}
@@ -102,12 +126,12 @@ def get_experiment_results(metric_type, extension, dataset, N=None):
     return values
 
 
-def get_experiment_result(metric_type, extension, index_params, dataset, N, K):
+def select_experiment_result(columns, metric_type, extension, index_params, dataset, N, K, qps=0, clients=0, write_pct=0, workers=0):
     sql = f"""
         SELECT
-            metric_value
+            {', '.join(columns)}
         FROM
-            experiment_results
+            {LATEST_RESULTS_VIEW}
         WHERE
             metric_type = %s
             AND extension = %s
@@ -115,45 +139,197 @@ def get_experiment_result(metric_type, extension, index_params, dataset, N, K):
             AND dataset = %s
             AND N = %s
             AND K = %s
+            AND qps = %s
+            AND clients = %s
+            AND write_pct = %s
+            AND workers = %s
     """
     data = (metric_type.value, extension.value, dump_index_params(
-        index_params), dataset.value, convert_string_to_number(N), K or 0)
+        index_params), dataset.value, convert_string_to_number(N), K or 0, qps, clients, write_pct, workers)
     with DatabaseConnection() as conn:
-        result = conn.select_one(sql, data=data)
+        return conn.select_one(sql, data=data)
+
+
+def get_experiment_result(metric_type, extension, index_params, dataset, N, K, qps=0, clients=0, write_pct=0, workers=0):
+    result = select_experiment_result(
+        ['metric_value'], metric_type, extension, index_params, dataset, N, K, qps, clients, write_pct, workers)
     return 0.0 if result is None else result[0]
 
 
-def save_result(metric_type, metric_value, extension, index_params, dataset, n, k=0, out=None, err=None):
-    TABLE_COLUMNS = [
-        'extension',
-        'index_params',
-        'dataset',
-        'n',
-        'k',
-        'metric_type',
-        'metric_value',
-        'out',
-        'err',
-    ]
-
-    columns = ', '.join(TABLE_COLUMNS)
-    placeholders = ', '.join(['%s'] * len(TABLE_COLUMNS))
+def get_experiment_result_ci(metric_type, extension, index_params, dataset, N, K, qps=0, clients=0, write_pct=0, workers=0):
+    """Returns the (low, high) 95% CI of a result of repeated trials, or None."""
+    result = select_experiment_result(
+        ['ci_low', 'ci_high'], metric_type, extension, index_params, dataset, N, K, qps, clients, write_pct, workers)
+    if result is None or None in result:
+        return None
+    return tuple(result)
+
+
+RESULT_COLUMNS = [
+    'extension',
+    'index_params',
+    'dataset',
+    'n',
+    'k',
+    'qps',
+    'clients',
+    'write_pct',
+    'workers',
+    'run_id',
+    'metric_type',
+    'metric_value',
+    'trials',
+    'stddev',
+    'ci_low',
+    'ci_high',
+    'out',
+    'err',
+]
+
+RESULT_KEY_COLUMNS = [
+    'metric_type',
+    'extension',
+    'index_params',
+    'dataset',
+    'n',
+    'k',
+    'qps',
+    'clients',
+    'write_pct',
+    'workers',
+    'run_id',
+]
+
+# Identifies a configuration across runs
+CONFIGURATION_KEY_COLUMNS = [
+    col for col in RESULT_KEY_COLUMNS if col != 'run_id']
+
+
+def get_upsert_results_sql():
+    columns = ', '.join(RESULT_COLUMNS)
     updates = ', '.join(
-        map(lambda col: f"{col} = EXCLUDED.{col}", TABLE_COLUMNS))
+        map(lambda col: f"{col} = EXCLUDED.{col}", RESULT_COLUMNS + ['created_at']))
 
     sql = f"""
         INSERT INTO
             experiment_results ({columns})
         VALUES
-            ({placeholders})
+            %s
         ON CONFLICT ON CONSTRAINT
             unique_result
         DO UPDATE SET
             {updates}
     """
+    return sql
+
 
-    data = (
-        extension.value, dump_index_params(index_params), dataset.value, n, k, metric_type.value, metric_value, out, err)
+def get_result_row(metric_type, metric_value, extension, index_params, dataset, n, k=0, qps=0, clients=0, write_pct=0, workers=0, trials=1, stddev=None, ci_low=None, ci_high=None, out=None, err=None):
+    row = {
+        'extension': extension.value,
+        'index_params': dump_index_params(index_params),
+        'dataset': dataset.value,
+        'n': n,
+        'k': k,
+        'qps': qps,
+        'clients': clients,
+        'write_pct': write_pct,
+        'workers': workers,
+        'run_id': get_run_id(),
+        'metric_type': metric_type.value,
+        'metric_value': metric_value,
+        'trials': trials,
+        'stddev': stddev,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'out': out,
+        'err': err,
+    }
+    return tuple(row[col] for col in RESULT_COLUMNS)
 
+
+def upsert_results(rows):
+    if len(rows) == 0:
+        return
+    register_run()
     with DatabaseConnection() as conn:
-        conn.execute(sql, data=data)
+        execute_values(conn.cur, get_upsert_results_sql(), rows)
+        conn.conn.commit()
+
+
+class ResultSink:
+    """
+    Buffers experiment results and writes them with a single multi-row upsert
+    when the sink is flushed, when it holds max_rows results, or when the
+    `with` block exits (including on an exception).
+
+    While a sink is open, save_result writes into it instead of the database.
+    """
+
+    def __init__(self, max_rows=1000):
+        self.max_rows = max_rows
+        self.rows = {}
+
+    def __enter__(self):
+        _active_sinks.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_sinks.remove(self)
+        if exc_type is None:
+            self.flush()
+            return
+        # A failed flush must not replace the exception that ended the block
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Could not save results after {exc_type.__name__}: {e}")
+
+    def add(self, *args, **kwargs):
+        row = get_result_row(*args, **kwargs)
+        # A multi-row upsert cannot touch the same row twice, so later results
+        # replace earlier ones with the same key, as sequential upserts would
+        key = tuple(row[RESULT_COLUMNS.index(col)]
+                    for col in RESULT_KEY_COLUMNS)
+        self.rows.pop(key, None)
+        self.rows[key] = row
+        if len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        rows = list(self.rows.values())
+        self.rows = {}
+        try:
+            upsert_results(rows)
+        except Exception:
+            logging.error(
+                f"Could not save {len(rows)} results: {rows}")
+            raise
+
+
+_active_sinks = []
+
+
+def flush_result_sinks():
+    for sink in _active_sinks:
+        sink.flush()
+
+
+atexit.register(flush_result_sinks)
+
+
+def save_result(*args, **kwargs):
+    if len(_active_sinks) > 0:
+        _active_sinks[-1].add(*args, **kwargs)
+    else:
+        upsert_results([get_result_row(*args, **kwargs)])
+
+
+def save_trials(metric_type, values, **kwargs):
+    """
+    Saves the mean of the values of repeated trials with their stddev and
+    bootstrap 95% CI (see get_trial_stats). Failed trials (None) are ignored.
+    """
+    stats = get_trial_stats(values)
+    if stats['metric_value'] is None:
+        return
+    save_result(metric_type=metric_type, **stats, **kwargs)
@@ -0,0 +1,41 @@
+import numpy as np
+
+RECALL_QUERY_COUNT = 100
+
+
+def to_padded_array(rows, width, fill):
+    """Packs lists of ids of varying length into a (len(rows), width) array."""
+    array = np.full((len(rows), width), fill, dtype=np.int64)
+    for index, row in enumerate(rows):
+        row = (row or [])[:width]
+        array[index, :len(row)] = row
+    return array
+
+
+def get_recall_hits(result_ids, truth_ids, K):
+    """
+    Number of the first K truth ids found in the first K results, per query.
+    Padding (negative ids, see to_padded_array) never matches.
+    """
+    matches = result_ids[:, :K, None] == truth_ids[:, None, :K]
+    matches &= (result_ids[:, :K, None] >= 0) & (truth_ids[:, None, :K] >= 0)
+    return matches.any(axis=2).sum(axis=1)
+
+
+def get_recall_stats(result_ids, truth_ids, K_values):
+    """
+    Computes recall@K for every K from one (queries, max K) array of result
+    ids in distance order and one array of truth ids. Returns, per K, the
+    mean recall and the p5, p50 and min of the per-query recall distribution.
+    Both arrays hold base table ids (see load.has_base_truth_ids).
+    """
+    stats = {}
+    for K in K_values:
+        recalls = get_recall_hits(result_ids, truth_ids, K) / K
+        stats[K] = {
+            'mean': float(recalls.mean()),
+            'p5': float(np.percentile(recalls, 5)),
+            'p50': float(np.percentile(recalls, 50)),
+            'min': float(recalls.min()),
+        }
+    return stats
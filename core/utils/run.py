@@ -0,0 +1,56 @@
+import os
+import json
+import uuid
+import socket
+import platform
+import subprocess
+from .database import DatabaseConnection
+
+# Identifies every result written by this process; set BENCHMARK_RUN_ID to
+# group several processes (e.g. a CI job) into one run
+RUN_ID = os.environ.get('BENCHMARK_RUN_ID') or uuid.uuid4().hex
+
+_registered = False
+
+
+def get_run_id():
+    return RUN_ID
+
+
+def get_git_sha():
+    if os.environ.get('GITHUB_SHA'):
+        return os.environ['GITHUB_SHA']
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def get_host_info():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def register_run():
+    """Records the current run in experiment_runs, once per process."""
+    global _registered
+    if _registered:
+        return
+    sql = """
+        INSERT INTO
+            experiment_runs (run_id, git_sha, host, host_info)
+        VALUES
+            (%s, %s, %s, %s)
+        ON CONFLICT (run_id) DO NOTHING
+    """
+    data = (get_run_id(), get_git_sha(), socket.gethostname(),
+            json.dumps(get_host_info(), sort_keys=True))
+    with DatabaseConnection() as conn:
+        conn.execute(sql, data=data)
+    _registered = True
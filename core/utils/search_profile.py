@@ -0,0 +1,81 @@
+import json
+from .constants import Extension, coalesce_index_params
+from .database import DatabaseConnection
+
+# Settings that make queries search with the index params of every
+# extension. Lantern and Neon read ef from the index options instead.
+SEARCH_INDEX_PARAMS = {
+    Extension.PGVECTOR_IVFFLAT: {'probes': 'ivfflat.probes'},
+    Extension.PGVECTOR_HNSW: {'ef': 'hnsw.ef_search'},
+    Extension.LANTERN: {},
+    Extension.NEON: {},
+    Extension.NONE: {},
+}
+
+INDEX_SCAN_NODE_TYPES = ['Index Scan', 'Index Only Scan']
+
+
+def get_search_settings(extension, index_params={}):
+    """Returns the settings (name to value) that benchmark sessions search with."""
+    if extension == Extension.NONE:
+        return {}
+    params = coalesce_index_params(extension, index_params)
+    settings = {'enable_seqscan': 'off'}
+    for param, setting in SEARCH_INDEX_PARAMS[extension].items():
+        settings[setting] = str(params[param])
+    return settings
+
+
+class SearchProfile:
+    """
+    Applies the search settings of an index to every benchmark session
+    started in the `with` block: pgbench and native load generator clients
+    (see get_active_search_settings) and connections passed to
+    apply_search_profile, e.g. for recall and EXPLAIN queries.
+    """
+
+    def __init__(self, extension, index_params={}):
+        self.settings = get_search_settings(extension, index_params)
+
+    def __enter__(self):
+        _active_profiles.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_profiles.remove(self)
+
+
+_active_profiles = []
+
+
+def get_active_search_settings():
+    return _active_profiles[-1].settings if len(_active_profiles) > 0 else {}
+
+
+def apply_search_profile(conn):
+    """Applies the active search settings to a DatabaseConnection's session."""
+    for name, value in get_active_search_settings().items():
+        conn.select_one("SELECT set_config(%s, %s, false)",
+                        data=(name, value))
+
+
+def find_index_scans(plan, index):
+    if plan.get('Node Type') in INDEX_SCAN_NODE_TYPES and plan.get('Index Name') == index:
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from find_index_scans(child, index)
+
+
+def assert_index_scan(extension, query, index):
+    """
+    Raises a RuntimeError unless the plan of query, under the active search
+    settings, scans index.
+    """
+    with DatabaseConnection(extension) as conn:
+        apply_search_profile(conn)
+        plan = conn.select_one(f"EXPLAIN (FORMAT JSON) {query}")[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if not any(find_index_scans(plan[0]['Plan'], index)):
+        raise RuntimeError(
+            f"Query does not scan index {index}: {json.dumps(plan[0]['Plan'])}")
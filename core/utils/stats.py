@@ -0,0 +1,40 @@
+import os
+import statistics
+import numpy as np
+
+CONFIDENCE = 0.95
+BOOTSTRAP_RESAMPLES = 10000
+
+# Load runs thrown away before measuring, and measured trials per result
+DEFAULT_WARMUP_RUNS = int(os.environ.get('BENCHMARK_WARMUP_RUNS', 1))
+DEFAULT_TRIALS = int(os.environ.get('BENCHMARK_TRIALS', 3))
+
+
+def bootstrap_ci(values, confidence=CONFIDENCE, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    """Percentile bootstrap confidence interval of the mean of values."""
+    values = np.asarray(values, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    means = rng.choice(values, size=(resamples, len(values))).mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def get_trial_stats(values):
+    """
+    Summarizes the values of repeated trials as save_result keyword
+    arguments: the mean as metric_value, the number of trials and, with at
+    least two trials, the stddev and a bootstrap 95% CI of the mean.
+    """
+    values = [value for value in values if value is not None]
+    if len(values) == 0:
+        return {'metric_value': None}
+    stats = {'metric_value': statistics.mean(values), 'trials': len(values)}
+    if len(values) > 1:
+        stats['stddev'] = statistics.stdev(values)
+        stats['ci_low'], stats['ci_high'] = bootstrap_ci(values)
+    return stats
+
+
+def ci_overlap(ci, other_ci):
+    return ci[0] <= other_ci[1] and other_ci[0] <= ci[1]
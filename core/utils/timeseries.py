@@ -0,0 +1,134 @@
+import re
+import math
+from psycopg2.extras import execute_values
+from .database import DatabaseConnection
+from .process import dump_index_params
+from .numbers import convert_string_to_number
+from .run import get_run_id
+
+# pgbench -P lines, e.g.
+# progress: 5.0 s, 2385.9 tps, lat 13.399 ms stddev 3.587, 0 failed, lag 0.120 ms
+PROGRESS_PATTERN = re.compile(
+    r'progress: ([\d.]+) s, ([\d.]+) tps, lat ([\d.]+) ms stddev ([\d.]+|-?nan)(?:, \d+ failed)?(?:, \d+ retried, \d+ retries)?(?:, lag ([\d.]+) ms)?',
+    re.IGNORECASE)
+
+TIMESERIES_COLUMNS = [
+    'run_id',
+    'series',
+    'offset_s',
+    'extension',
+    'index_params',
+    'dataset',
+    'n',
+    'k',
+    'tps',
+    'latency_average',
+    'latency_stddev',
+    'lag_average',
+]
+
+TIMESERIES_KEY_COLUMNS = [
+    'run_id',
+    'series',
+    'extension',
+    'index_params',
+    'dataset',
+    'n',
+    'k',
+    'offset_s',
+]
+
+
+def parse_float(value):
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def parse_progress(output):
+    """
+    Parses the progress lines that pgbench -P (or the native load generator)
+    writes into samples of (offset_s, tps, latency_average, latency_stddev,
+    lag_average), with latencies in ms.
+    """
+    samples = []
+    for match in PROGRESS_PATTERN.finditer(output or ''):
+        samples.append(tuple(parse_float(value) for value in match.groups()))
+    return samples
+
+
+def get_upsert_timeseries_sql():
+    columns = ', '.join(TIMESERIES_COLUMNS)
+    keys = ', '.join(TIMESERIES_KEY_COLUMNS)
+    updates = ', '.join(
+        map(lambda col: f"{col} = EXCLUDED.{col}", TIMESERIES_COLUMNS))
+    return f"""
+        INSERT INTO
+            experiment_timeseries ({columns})
+        VALUES
+            %s
+        ON CONFLICT ({keys})
+        DO UPDATE SET
+            {updates}
+    """
+
+
+def save_timeseries(series, samples, extension, index_params, dataset, n, k=0, offset=0):
+    """
+    Saves (offset_s, tps, latency_average, latency_stddev, lag_average)
+    samples of one series of the current run, shifting their offsets by
+    `offset` seconds so that several load runs form one series.
+    """
+    rows = [
+        (get_run_id(), series, offset + offset_s, extension.value, dump_index_params(index_params),
+         dataset.value, n, k, tps, latency_average, latency_stddev, lag_average)
+        for offset_s, tps, latency_average, latency_stddev, lag_average in samples
+    ]
+    if len(rows) == 0:
+        return
+    with DatabaseConnection() as conn:
+        execute_values(conn.cur, get_upsert_timeseries_sql(), rows)
+        conn.conn.commit()
+
+
+def save_progress(series, output, extension, index_params, dataset, n, k=0, offset=0):
+    """Saves the progress lines of a load run's output as a time series."""
+    save_timeseries(series, parse_progress(output), extension,
+                    index_params, dataset, n, k, offset)
+
+
+def get_timeseries(series, extension, index_params, dataset, N, K=0, run_id=None):
+    """
+    Returns the (offset_s, tps, latency_average, latency_stddev, lag_average)
+    samples of a series, from the latest run that recorded it by default.
+    """
+    run_sql = 'run_id = %s' if run_id is not None else f"""
+        run_id = (
+            SELECT run_id
+            FROM experiment_timeseries
+            WHERE {' AND '.join(f"{col} = %s" for col in TIMESERIES_KEY_COLUMNS[1:-1])}
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+    """
+    key = (series, extension.value, index_params if isinstance(index_params, str) else dump_index_params(index_params),
+           dataset.value, convert_string_to_number(N), K)
+    sql = f"""
+        SELECT
+            offset_s,
+            tps,
+            latency_average,
+            latency_stddev,
+            lag_average
+        FROM
+            experiment_timeseries
+        WHERE
+            {run_sql}
+            AND {' AND '.join(f"{col} = %s" for col in TIMESERIES_KEY_COLUMNS[1:-1])}
+        ORDER BY
+            offset_s
+    """
+    data = ((run_id,) if run_id is not None else key) + key
+    with DatabaseConnection() as conn:
+        return conn.select(sql, data=data)
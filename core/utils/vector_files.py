@@ -0,0 +1,179 @@
+import os
+import numpy as np
+
+VECTOR_FILE_EXTENSIONS = ['fvecs', 'ivecs', 'bvecs', 'npy']
+
+
+def read_vecs(path, dtype):
+    """
+    Memory-maps a .fvecs, .ivecs or .bvecs file as a (rows, dim) array. Each
+    row on disk is a little-endian int32 dimension followed by the values.
+    """
+    dim = int(np.fromfile(path, dtype='<i4', count=1)[0])
+    if np.dtype(dtype).itemsize == 1:
+        raw = np.memmap(path, dtype=np.uint8, mode='r')
+        return raw.reshape(-1, dim + 4)[:, 4:]
+    raw = np.memmap(path, dtype='<i4', mode='r')
+    return raw.reshape(-1, dim + 1)[:, 1:].view(dtype)
+
+
+def read_vector_file(path):
+    """
+    Returns a memory-mapped (rows, dim) array for a vector file in one of the
+    VECTOR_FILE_EXTENSIONS formats. Nothing is read until rows are accessed.
+    """
+    file_extension = os.path.splitext(path)[1][1:]
+    if file_extension == 'fvecs':
+        return read_vecs(path, '<f4')
+    if file_extension == 'ivecs':
+        return read_vecs(path, '<i4')
+    if file_extension == 'bvecs':
+        return read_vecs(path, np.uint8)
+    if file_extension == 'npy':
+        vectors = np.load(path, mmap_mode='r')
+        if vectors.ndim != 2:
+            raise ValueError(
+                f"Expected a 2-dimensional array in {path}, got shape {vectors.shape}")
+        return vectors
+    raise ValueError(
+        f"Unknown vector file format '{file_extension}'. Valid formats are: {', '.join(VECTOR_FILE_EXTENSIONS)}")
+
+
+def find_vector_file(datapath, table_name):
+    for file_extension in VECTOR_FILE_EXTENSIONS:
+        path = os.path.join(datapath, f"{table_name}.{file_extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+"""
+Binary COPY encoding
+"""
+
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + \
+    np.array([0, 0], dtype='>i4').tobytes()
+COPY_BINARY_TRAILER = np.array([-1], dtype='>i2').tobytes()
+
+FLOAT4_OID = 700
+INT4_OID = 23
+
+
+def get_vector_row_dtype(dim):
+    """Row of (id INTEGER, v VECTOR(dim)) in pgvector's binary format."""
+    return np.dtype([
+        ('field_count', '>i2'),
+        ('id_length', '>i4'),
+        ('id', '>i4'),
+        ('v_length', '>i4'),
+        ('dim', '>i2'),
+        ('unused', '>i2'),
+        ('values', '>f4', (dim,)),
+    ])
+
+
+def get_array_row_dtype(dim, element_type):
+    """Row of (id INTEGER, v element_type[]) in PostgreSQL's binary array format."""
+    return np.dtype([
+        ('field_count', '>i2'),
+        ('id_length', '>i4'),
+        ('id', '>i4'),
+        ('v_length', '>i4'),
+        ('ndim', '>i4'),
+        ('has_null', '>i4'),
+        ('element_oid', '>i4'),
+        ('dim', '>i4'),
+        ('lower_bound', '>i4'),
+        ('elements', [('length', '>i4'), ('value', element_type)], (dim,)),
+    ])
+
+
+def encode_vector_rows(ids, vectors):
+    rows = np.empty(len(ids), dtype=get_vector_row_dtype(vectors.shape[1]))
+    rows['field_count'] = 2
+    rows['id_length'] = 4
+    rows['id'] = ids
+    rows['v_length'] = 4 + 4 * vectors.shape[1]
+    rows['dim'] = vectors.shape[1]
+    rows['unused'] = 0
+    rows['values'] = vectors
+    return rows.tobytes()
+
+
+def encode_array_rows(ids, values, element_type='>f4'):
+    element_oid = INT4_OID if np.dtype(element_type).kind == 'i' else FLOAT4_OID
+    dim = values.shape[1]
+    rows = np.empty(len(ids), dtype=get_array_row_dtype(dim, element_type))
+    rows['field_count'] = 2
+    rows['id_length'] = 4
+    rows['id'] = ids
+    rows['v_length'] = 20 + 8 * dim
+    rows['ndim'] = 1
+    rows['has_null'] = 0
+    rows['element_oid'] = element_oid
+    rows['dim'] = dim
+    rows['lower_bound'] = 1
+    rows['elements']['length'] = 4
+    rows['elements']['value'] = values
+    return rows.tobytes()
+
+
+class BinaryCopyStream:
+    """
+    File-like object that produces a binary COPY stream for rows
+    [start, end) of `vectors`, encoding `block_size` rows at a time so only
+    one block is ever held in memory.
+    """
+
+    def __init__(self, vectors, start, end, encode, id_offset=1, block_size=10000):
+        self.vectors = vectors
+        self.encode = encode
+        self.id_offset = id_offset
+        self.blocks = iter(range(start, end, block_size))
+        self.end = end
+        self.block_size = block_size
+        self.buffer = COPY_BINARY_HEADER
+        self.position = 0
+        self.done = False
+
+    def _next_chunk(self):
+        block_start = next(self.blocks, None)
+        if block_start is None:
+            self.done = True
+            return COPY_BINARY_TRAILER
+        block_end = min(block_start + self.block_size, self.end)
+        ids = np.arange(block_start, block_end) + self.id_offset
+        return self.encode(ids, np.asarray(self.vectors[block_start:block_end]))
+
+    def read(self, size=-1):
+        if self.position >= len(self.buffer):
+            if self.done:
+                return b''
+            self.buffer, self.position = self._next_chunk(), 0
+        if size < 0:
+            size = len(self.buffer) - self.position
+        data = self.buffer[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+
+def decode_array_rows(data, dim, element_type='>f4'):
+    """
+    Decodes a binary COPY stream of (id INTEGER, v element_type[dim]) rows
+    into an array of ids and a (rows, dim) array of values.
+    """
+    body = data[len(COPY_BINARY_HEADER):len(data) - len(COPY_BINARY_TRAILER)]
+    rows = np.frombuffer(body, dtype=get_array_row_dtype(dim, element_type))
+    values = rows['elements']['value']
+    return rows['id'].astype(np.int64), values.astype(values.dtype.newbyteorder('='))
+
+
+def write_vecs(path, values):
+    """Writes a (rows, dim) int32 or float32 array as .ivecs or .fvecs."""
+    values = np.ascontiguousarray(values)
+    rows = np.empty((values.shape[0], values.shape[1] + 1), dtype='<i4')
+    rows[:, 0] = values.shape[1]
+    rows[:, 1:] = values.astype(values.dtype.newbyteorder('<')).view('<i4')
+    tmp_path = path + '.tmp'
+    rows.tofile(tmp_path)
+    os.replace(tmp_path, path)
@@ -6,8 +6,11 @@ from external.utils import cli
 if __name__ == "__main__":
     extension, index_params, dataset, N, K = cli.get_args(
         "get benchmarks json for tests or CI/CD")
-    benchmarks = get_benchmarks(extension, index_params, dataset, N, K)
-    benchmarks_json = {}
-    for metric, value, in benchmarks:
+    benchmarks = get_benchmarks(
+        extension, index_params, dataset, N, K, return_ci=True)
+    benchmarks_json = {'ci': {}}
+    for metric, value, ci in benchmarks:
         benchmarks_json[metric.value] = value
+        if ci is not None:
+            benchmarks_json['ci'][metric.value] = ci
     print(json.dumps(benchmarks_json))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import sys
+import time
+import struct
+import argparse
+import numpy as np
+import psycopg2
+
+# Seconds per row the stand-in spends "building the graph"
+BUILD_SECONDS_PER_ROW = 1e-6
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="local stand-in for `lantern-cli create-index`, for testing external index builds")
+    parser.add_argument('command', choices=['create-index'])
+    parser.add_argument('-u', dest='uri', required=True)
+    parser.add_argument('-t', dest='table', required=True)
+    parser.add_argument('-c', dest='column', required=True)
+    parser.add_argument('-m', type=int, required=True)
+    parser.add_argument('--ef', type=int, required=True)
+    parser.add_argument('--efc', type=int, required=True)
+    parser.add_argument('-d', dest='dims', type=int, required=True)
+    parser.add_argument('--metric-kind', default='cos')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--index-name')
+    return parser.parse_args(args)
+
+
+def export_vectors(args):
+    """
+    Reads the ids and vectors of the table. A .npy file of vectors can be
+    given instead of the database URL, with ids numbered from 1, so that the
+    stand-in also runs without a database.
+    """
+    if args.uri.endswith('.npy'):
+        vectors = np.load(args.uri)
+        return list(zip(range(1, len(vectors) + 1), vectors.tolist()))
+    conn = psycopg2.connect(args.uri)
+    try:
+        with conn.cursor(name='lantern_cli_standin') as cur:
+            cur.execute(
+                f"SELECT id, {args.column}::real[] FROM {args.table} ORDER BY id")
+            return [(id, vector) for id, vector in cur]
+    finally:
+        conn.close()
+
+
+def write_index_file(args, rows):
+    """
+    Writes the exported vectors with a small header. The file has roughly
+    the size of a .usearch file but is not one, so it cannot be imported
+    by Lantern (see SKIP_IMPORT in core.utils.create_external_index).
+    """
+    with open(args.out, 'wb') as f:
+        f.write(struct.pack('<4sIIII', b'SNDN', args.dims, args.m, args.efc, args.ef))
+        for id, vector in rows:
+            f.write(struct.pack(f"<q{args.dims}f", id, *vector))
+            # Neighbor lists of the base layer
+            f.write(bytes(8 * 2 * args.m))
+
+
+if __name__ == '__main__':
+    # Prints the same phase lines as lantern-cli, which BUILD_START_PATTERN
+    # in core.utils.create_external_index splits the export and build at
+    args = parse_args(sys.argv[1:])
+    print(f"Exporting vectors from {args.table}.{args.column}", flush=True)
+    rows = export_vectors(args)
+    print(f"Exported {len(rows)} vectors", flush=True)
+    print(
+        f"Creating index with m={args.m}, ef_construction={args.efc}, ef={args.ef}", flush=True)
+    time.sleep(len(rows) * BUILD_SECONDS_PER_ROW)
+    write_index_file(args, rows)
+    print(f"Index saved to {args.out}", flush=True)
@@ -2,6 +2,7 @@ from core.utils.delete_index import delete_index
 from core.utils.process import save_result
 from core.utils.numbers import convert_string_to_number
 from core.utils.constants import Extension, Metric, Dataset
+from core.utils.build_profile import BuildProfiler
 from core import benchmark_create, benchmark_insert, benchmark_select
 from external.utils import cli
 
@@ -23,10 +24,11 @@ if __name__ == "__main__":
     }
 
     delete_index(extension, dataset, N)
+    profiler = BuildProfiler(extension)
     latency_create = benchmark_create.generate_performance_result(
-        extension, dataset, N, index_params)
-    disk_usage = benchmark_create.generate_disk_usage_result(
-        extension, dataset, N)
+        extension, dataset, N, index_params, profiler)
+    disk_usage = benchmark_create.generate_footprint_result(
+        extension, dataset, N)['index']
     benchmark_select.generate_result(
         extension, dataset, N, [K], index_params, bulk=True, skip_index=True)
     benchmark_select.generate_result(
@@ -34,6 +36,7 @@ if __name__ == "__main__":
     delete_index(extension, dataset, N)
     save_result(Metric.CREATE_LATENCY, latency_create, **create_kwargs)
     save_result(Metric.DISK_USAGE, disk_usage, **create_kwargs)
+    benchmark_create.save_profile_results([profiler], **create_kwargs)
 
     benchmark_insert.generate_result(
         extension, dataset, N, index_params, K=None, bulk=True, max_N=100)
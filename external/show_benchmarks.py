@@ -1,7 +1,7 @@
 import argparse
 import logging
 from typing import List, Tuple
-from core.utils.constants import Metric
+from core.utils.constants import Metric, LATENCY_PERCENTILE_METRICS
 from external.utils import cli
 from external.utils.get_benchmarks import get_benchmarks
 
@@ -13,6 +13,10 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
 
 
 def get_corresponding_stddev_result(metric_name, benchmarks):
+    # Percentiles describe the distribution themselves
+    if Metric(metric_name) in LATENCY_PERCENTILE_METRICS:
+        return None
+
     metric_name_without_unit = metric_name.split("(")[0].strip()
     for result in benchmarks:
         metric = result[0].value
@@ -29,16 +33,16 @@ def get_metric_name(metric_name: str, bulk_size: int):
     return metric_name.replace("bulk", "bulk({})".format(bulk_size))
 
 def print_benchmarks(benchmarks: List[Tuple[Metric, str, str]], markdown=False):
-    divider_length = 96
+    divider_length = 101
     divider_line = "-" * divider_length
 
     if markdown:
         print("# Benchmarks")
     else:
         print(divider_line)
-    print("| %-31s | %20s | %20s | %12s |" %
+    print("| %-36s | %20s | %20s | %12s |" %
           ("metric", "old", "new", "pct change"))
-    print(f"|{33 * '-'}|{22 * '-'}|{22 * '-'}|{14 * '-'}|")
+    print(f"|{38 * '-'}|{22 * '-'}|{22 * '-'}|{14 * '-'}|")
 
     for metric, old_value, new_value in benchmarks:
         # Do not show stddev values
@@ -72,7 +76,7 @@ def print_benchmarks(benchmarks: List[Tuple[Metric, str, str]], markdown=False):
         metric_name = get_metric_name(metric.value, 100)
         data = (metric_name, display_old_value,
                 display_new_value, display_pct_change)
-        print("| %-31s | %20s | %20s | %12s |" % data)
+        print("| %-36s | %20s | %20s | %12s |" % data)
 
     if not markdown:
         print(divider_line)
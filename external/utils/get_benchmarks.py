@@ -4,8 +4,8 @@ import json
 import logging
 from github import Github
 import urllib3
-from core.utils.constants import Metric
-from core.utils.process import get_experiment_result
+from core.utils.constants import Metric, SELECT_LATENCY_PERCENTILE_METRICS, SELECT_BULK_LATENCY_PERCENTILE_METRICS, INSERT_LATENCY_PERCENTILE_METRICS, INSERT_BULK_LATENCY_PERCENTILE_METRICS
+from core.utils.process import get_experiment_result, get_experiment_result_ci
 import zipfile
 
 REPO_NAME = 'lanterndata/lantern'
@@ -93,13 +93,24 @@ def get_old_benchmarks():
     return {}
 
 
-def get_benchmarks(extension, index_params, dataset, N, K, return_old=False):
+def get_benchmarks(extension, index_params, dataset, N, K, return_old=False, return_ci=False):
+    """
+    Returns (metric, value) tuples, (metric, old value, new value) with
+    return_old. With return_ci, every tuple also holds the 95% CI of each
+    value (None when the value is not the mean of repeated trials).
+    """
     benchmarks = []
 
     def add_metric(metric_type, use_K=False):
+        k = K if use_K else 0
         new_metric = get_experiment_result(
-            metric_type, extension, index_params, dataset, N, K=K if use_K else 0)
-        benchmarks.append((metric_type, new_metric))
+            metric_type, extension, index_params, dataset, N, K=k)
+        if return_ci:
+            new_ci = get_experiment_result_ci(
+                metric_type, extension, index_params, dataset, N, K=k)
+            benchmarks.append((metric_type, new_metric, new_ci))
+        else:
+            benchmarks.append((metric_type, new_metric))
 
     add_metric(Metric.RECALL_AFTER_CREATE, use_K=True)
     add_metric(Metric.RECALL_AFTER_INSERT, use_K=True)
@@ -107,24 +118,41 @@ def get_benchmarks(extension, index_params, dataset, N, K, return_old=False):
     add_metric(Metric.SELECT_BULK_TPS, use_K=True)
     add_metric(Metric.SELECT_LATENCY, use_K=True)
     add_metric(Metric.SELECT_LATENCY_STDDEV, use_K=True)
+    for metric in SELECT_LATENCY_PERCENTILE_METRICS.values():
+        add_metric(metric, use_K=True)
     add_metric(Metric.SELECT_BULK_LATENCY, use_K=True)
     add_metric(Metric.SELECT_BULK_LATENCY_STDDEV, use_K=True)
+    for metric in SELECT_BULK_LATENCY_PERCENTILE_METRICS.values():
+        add_metric(metric, use_K=True)
     add_metric(Metric.CREATE_LATENCY)
+    add_metric(Metric.CREATE_PEAK_MEMORY)
+    add_metric(Metric.CREATE_CPU_TIME)
+    add_metric(Metric.CREATE_WRITE_BYTES)
     add_metric(Metric.INSERT_TPS)
     add_metric(Metric.INSERT_BULK_TPS)
     add_metric(Metric.INSERT_LATENCY)
     add_metric(Metric.INSERT_LATENCY_STDDEV)
+    for metric in INSERT_LATENCY_PERCENTILE_METRICS.values():
+        add_metric(metric)
     add_metric(Metric.INSERT_BULK_LATENCY)
     add_metric(Metric.INSERT_BULK_LATENCY_STDDEV)
+    for metric in INSERT_BULK_LATENCY_PERCENTILE_METRICS.values():
+        add_metric(metric)
     add_metric(Metric.DISK_USAGE)
 
     if return_old:
         old_benchmarks = get_old_benchmarks()
         new_benchmarks = []
+        old_cis = old_benchmarks.get('ci', {})
         for benchmark in benchmarks:
-            metric, new_value = benchmark
+            metric, new_value = benchmark[:2]
             old_value = old_benchmarks.get(metric.value)
-            new_benchmarks.append((metric, old_value, new_value))
+            if return_ci:
+                old_ci = old_cis.get(metric.value)
+                new_benchmarks.append(
+                    (metric, old_value, new_value, old_ci and tuple(old_ci), benchmark[2]))
+            else:
+                new_benchmarks.append((metric, old_value, new_value))
         benchmarks = new_benchmarks
 
     return benchmarks
@@ -2,30 +2,42 @@ import sys
 import logging
 from typing import List, Tuple
 from core.utils.constants import Metric, METRICS_THAT_SHOULD_DECREASE, METRICS_THAT_SHOULD_INCREASE
+from core.utils.stats import ci_overlap
 from external.utils.get_benchmarks import get_benchmarks
 from external.utils import cli
 
 
-def validate_benchmarks(benchmarks: List[Tuple[Metric, str, str]]):
+def is_significant(pct_change, old_ci, new_ci):
+    """
+    A change is significant when the 95% CIs of both values don't overlap,
+    or, without CIs, when the values differ by more than 10%.
+    """
+    if old_ci is not None and new_ci is not None:
+        return not ci_overlap(old_ci, new_ci)
+    return abs(pct_change) > 0.1
+
+
+def validate_benchmarks(benchmarks: List[Tuple[Metric, str, str, tuple, tuple]]):
     warnings = []
     errors = []
 
-    for metric, old_value, new_value in benchmarks:
+    for metric, old_value, new_value, old_ci, new_ci in benchmarks:
         if old_value is None or new_value is None:
             continue
 
         diff = new_value - old_value
         pct_change = diff / (old_value or 1)
+        significant = is_significant(pct_change, old_ci, new_ci)
 
         if metric in METRICS_THAT_SHOULD_INCREASE:
-            if pct_change < -0.1:
+            if pct_change < 0 and significant:
                 errors.append(
                     f"{metric.value} decreased by {pct_change * 100:.2f}%")
             elif pct_change < 0:
                 warnings.append(
                     f"{metric.value} decreased by {pct_change * 100:.2f}%")
         elif metric in METRICS_THAT_SHOULD_DECREASE:
-            if pct_change > 0.1:
+            if pct_change > 0 and significant:
                 errors.append(
                     f"{metric.value} increased by {pct_change * 100:.2f}%")
             elif pct_change > 0:
@@ -44,5 +56,5 @@ if __name__ == "__main__":
     extension, index_params, dataset, N, K = cli.get_args(
         "validate benchmark results for tests or CI/CD")
     benchmarks = get_benchmarks(
-        extension, index_params, dataset, N, K, return_old=True)
+        extension, index_params, dataset, N, K, return_old=True, return_ci=True)
     validate_benchmarks(benchmarks)
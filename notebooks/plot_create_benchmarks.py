@@ -2,7 +2,7 @@ import json
 import plotly.graph_objects as go
 from core.utils.constants import Metric
 from core.utils.process import get_experiment_results_for_params
-from core.utils.plot import plot_line_with_stddev, plot_bar
+from core.utils.plot import plot_line_with_stddev, plot_bar, plot_line
 
 
 def plot_latency_results(configuration, dataset, plot_type = 'line'):
@@ -49,4 +49,23 @@ def plot_disk_usage_results(configuration, dataset, plot_type = 'line'):
         xaxis=dict(title='Number of rows'),
         yaxis=dict(title='Disk Usage (bytes)'),
     )
-    fig.show()
\ No newline at end of file
+    fig.show()
+
+def plot_speedup_results(configuration, dataset, N, metric_type=Metric.CREATE_SPEEDUP):
+    fig = go.Figure()
+    for extension, index_params_list in configuration.items():
+        for index, index_params in enumerate(index_params_list):
+            results = get_experiment_results_for_params(
+                metric_type, extension, json.dumps(index_params), dataset, N=N, workers=None, x_param='workers')
+            results = [result for result in results if result[0] > 0]
+            if len(results) == 0:
+                continue
+            worker_counts, values = zip(*results)
+            plot_line(fig, extension, index_params,
+                      worker_counts, values, index=index)
+    fig.update_layout(
+        title=f"{metric_type.value} over Number of Workers for {dataset.value} (N={N})",
+        xaxis=dict(title='Workers'),
+        yaxis=dict(title=metric_type.value),
+    )
+    fig.show()
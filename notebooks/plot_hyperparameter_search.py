@@ -5,7 +5,12 @@ from core.utils.numbers import convert_string_to_number
 from core.hyperparameter_search import HYPERPARAMETER_SEARCH_K
 
 
-def plot_hyperparameter_search(extensions, dataset, N, xaxis=Metric.RECALL_AFTER_CREATE, yaxis=Metric.SELECT_LATENCY):
+def plot_hyperparameter_search(extensions, dataset, N, xaxis=Metric.RECALL_AFTER_CREATE, yaxis=Metric.SELECT_LATENCY, K=HYPERPARAMETER_SEARCH_K, target_recall=None):
+    """
+    Plots every benchmarked hyperparameter, and connects those on the Pareto
+    front saved by the hyperparameter optimizer (see
+    run_hyperparameter_optimizer) with a line.
+    """
     colors = ['blue', 'orange', 'green', 'purple', 'red']
 
     fig = go.Figure()
@@ -15,9 +20,10 @@ def plot_hyperparameter_search(extensions, dataset, N, xaxis=Metric.RECALL_AFTER
             SELECT
                 index_params,
                 MAX(CASE WHEN metric_type = %s THEN metric_value ELSE NULL END),
+                MAX(CASE WHEN metric_type = %s THEN metric_value ELSE NULL END),
                 MAX(CASE WHEN metric_type = %s THEN metric_value ELSE NULL END)
             FROM
-                experiment_results
+                latest_experiment_results
             WHERE
                 extension = %s
                 AND dataset = %s
@@ -27,12 +33,12 @@ def plot_hyperparameter_search(extensions, dataset, N, xaxis=Metric.RECALL_AFTER
             GROUP BY
                 index_params
         """
-        data = (xaxis.value, yaxis.value, extension.value, dataset.value,
-                convert_string_to_number(N), HYPERPARAMETER_SEARCH_K, [xaxis.value, yaxis.value])
+        data = (xaxis.value, yaxis.value, Metric.PARETO_OPTIMAL.value, extension.value, dataset.value,
+                convert_string_to_number(N), K, [xaxis.value, yaxis.value, Metric.PARETO_OPTIMAL.value])
         with DatabaseConnection() as conn:
             results = conn.select(sql, data=data)
 
-        index_params, xaxis_data, yaxis_data = zip(*results)
+        index_params, xaxis_data, yaxis_data, pareto_optimal = zip(*results)
 
         fig.add_trace(go.Scatter(
             x=xaxis_data,
@@ -48,8 +54,24 @@ def plot_hyperparameter_search(extensions, dataset, N, xaxis=Metric.RECALL_AFTER
             name=extension.value.upper()
         ))
 
+        front = sorted((x, y) for x, y, optimal in zip(
+            xaxis_data, yaxis_data, pareto_optimal) if optimal == 1.0)
+        if len(front) > 0:
+            front_x, front_y = zip(*front)
+            fig.add_trace(go.Scatter(
+                x=front_x,
+                y=front_y,
+                mode='lines',
+                line=dict(color=colors[idx % len(colors)], dash='dash'),
+                name=f"{extension.value.upper()} Pareto front"
+            ))
+
+    if target_recall is not None:
+        fig.add_vline(x=target_recall, line_dash='dot',
+                      annotation_text=f"target recall {target_recall}")
+
     fig.update_layout(
-        title=f"{yaxis.value} and {xaxis.value} for with {dataset.value} {N}",
+        title=f"{yaxis.value} and {xaxis.value} for with {dataset.value} {N}, K={K}",
         xaxis=dict(title=xaxis.value),
         yaxis=dict(title=yaxis.value),
         margin=dict(l=50, r=50, b=50, t=50),
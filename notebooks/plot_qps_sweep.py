@@ -0,0 +1,41 @@
+import json
+import plotly.graph_objects as go
+from core.utils.constants import Metric, SELECT_LATENCY_PERCENTILE_METRICS, SELECT_BULK_LATENCY_PERCENTILE_METRICS
+from core.utils.process import get_experiment_results_for_params, get_experiment_result
+from core.utils.plot import plot_line
+
+
+# Plot a latency percentile against achieved QPS for every configuration of a QPS sweep
+def plot_qps_sweep(configuration, dataset, N, K, percentile=99, bulk=False):
+    percentile_metrics = SELECT_BULK_LATENCY_PERCENTILE_METRICS if bulk else SELECT_LATENCY_PERCENTILE_METRICS
+    latency_metric = percentile_metrics[percentile]
+    metric_types = [Metric.SELECT_ACHIEVED_QPS, latency_metric]
+
+    fig = go.Figure()
+    saturation_points = []
+    for extension, index_params_list in configuration.items():
+        for index, index_params in enumerate(index_params_list):
+            results = get_experiment_results_for_params(
+                metric_types, extension, json.dumps(index_params), dataset, N=N, K=K, qps=None, x_param='qps')
+            results = [result for result in results if result[0] > 0]
+            if len(results) == 0:
+                continue
+            _, achieved_qps, latencies = zip(*results)
+            plot_line(fig, extension, index_params,
+                      list(achieved_qps), latencies, index=index)
+
+            saturation_qps = get_experiment_result(
+                Metric.SELECT_SATURATION_QPS, extension, index_params, dataset, N, K)
+            if saturation_qps:
+                saturation_points.append(
+                    f"{extension.value.upper()} - {index_params}: {saturation_qps:.0f}")
+
+    fig.update_layout(
+        title=f"{latency_metric.value} vs. achieved QPS ({dataset.value}, N={N}, K={K})",
+        xaxis_title='achieved QPS',
+        yaxis_title=latency_metric.value,
+    )
+    if saturation_points:
+        fig.add_annotation(text='Saturation QPS<br>' + '<br>'.join(saturation_points),
+                           xref='paper', yref='paper', x=0, y=1, showarrow=False, align='left')
+    fig.show()
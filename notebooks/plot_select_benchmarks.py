@@ -1,18 +1,27 @@
 import json
 import plotly.graph_objects as go
+from core.utils.constants import ExperimentParam
 from core.utils.process import get_experiment_results_for_params
 from core.utils.plot import plot_line, plot_line_with_stddev, plot_bar
 
 
+def get_param_kwarg(param):
+    return param.value.upper() if param in [ExperimentParam.N, ExperimentParam.K] else param.value
+
+
 # Given a mapping of extension to index_params and fixed parameter, support plotting latency vs. variable parameter
-def generate_plot(configuration, dataset, fixed_param, fixed_param_value, variable_param, metric_type, metric_stddev_type=None, plot_type = 'line'):
+# Sweeps over clients or QPS need both N and K fixed, e.g. fixed_params={ExperimentParam.K: 10}
+def generate_plot(configuration, dataset, fixed_param, fixed_param_value, variable_param, metric_type, metric_stddev_type=None, plot_type = 'line', fixed_params={}):
     fig = go.Figure()
+    params = {get_param_kwarg(param): value for param, value in {fixed_param: fixed_param_value, **fixed_params}.items()}
+    if variable_param in [ExperimentParam.QPS, ExperimentParam.CLIENTS]:
+        params[variable_param.value] = None
     for extension, index_params_list in configuration.items():
         for index, index_params in enumerate(index_params_list):
             metric_types = [
                 metric_type, metric_stddev_type] if metric_stddev_type is not None else [metric_type]
             results = get_experiment_results_for_params(
-                metric_types, extension, json.dumps(index_params), dataset, **{(fixed_param.value.upper()): fixed_param_value})
+                metric_types, extension, json.dumps(index_params), dataset, x_param=variable_param.value, **params)
             if len(results) == 0:
                 continue
             if metric_stddev_type is not None:
@@ -32,6 +41,8 @@ def generate_plot(configuration, dataset, fixed_param, fixed_param_value, variab
     variable_param_value = variable_param.value
     if variable_param_value == 'n':
         variable_param_value = 'number of rows'
+    if variable_param_value == 'clients':
+        variable_param_value = 'number of clients'
     fig.update_layout(
         title=f"{metric_type.value} vs. {variable_param_value} ({dataset.value}, {fixed_param.value.upper()}={fixed_param_value})",
         xaxis_title=variable_param_value,
@@ -0,0 +1,24 @@
+import plotly.graph_objects as go
+from core.utils.timeseries import get_timeseries
+from core.utils.plot import plot_line
+
+
+# Plot tps or latency over the course of a run, e.g. series='select' or 'insert'
+def plot_timeseries(configuration, dataset, N, series, K=0, y='latency_average', run_id=None):
+    columns = ['offset_s', 'tps', 'latency_average', 'latency_stddev', 'lag_average']
+    fig = go.Figure()
+    for extension, index_params_list in configuration.items():
+        for index, index_params in enumerate(index_params_list):
+            results = get_timeseries(series, extension, index_params, dataset, N, K, run_id)
+            if len(results) == 0:
+                continue
+            offsets = [row[0] for row in results]
+            values = [row[columns.index(y)] for row in results]
+            plot_line(fig, extension, index_params, offsets, values, index=index)
+
+    fig.update_layout(
+        title=f"{series} {y} over time ({dataset.value}, N={N}, K={K})",
+        xaxis_title='seconds since start',
+        yaxis_title=y,
+    )
+    fig.show()
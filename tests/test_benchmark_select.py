@@ -0,0 +1,44 @@
+from core.benchmark_select import get_saturation_qps, is_saturated, SATURATION_P99_FACTOR
+
+
+def get_curve(capacity, qps_values, base_p99=5.0):
+    """
+    Synthetic open-loop sweep of a server that serves `capacity` QPS: below
+    it every target is met and p99 grows with utilization as in an M/M/1
+    queue; above it throughput flattens and the queue makes p99 explode.
+    """
+    steps = []
+    for target_qps in qps_values:
+        utilization = target_qps / capacity
+        if utilization < 1:
+            steps.append((target_qps, target_qps, base_p99 / (1 - utilization)))
+        else:
+            steps.append((target_qps, capacity, base_p99 * 100 * utilization))
+    return steps
+
+
+def test_saturation_point_on_synthetic_curve():
+    steps = get_curve(1000, [100, 200, 400, 600, 800, 900, 1200, 1600])
+    # p99 at 900 QPS (50 ms) is over 5x the one at 100 QPS (5.56 ms)
+    assert get_saturation_qps(steps) == 800
+
+
+def test_throughput_shortfall_saturates():
+    steps = [(100, 100, 1.0), (200, 199, 1.1), (400, 300, 1.2), (800, 310, 1.3)]
+    assert get_saturation_qps(steps) == 199
+
+
+def test_explicit_p99_limit():
+    steps = get_curve(1000, [100, 200, 400, 600, 800, 900])
+    assert get_saturation_qps(steps, max_p99=10) == 400
+    assert get_saturation_qps(steps, max_p99=1000) == 900
+
+
+def test_first_step_saturated():
+    assert get_saturation_qps([(1000, 100, 1.0), (2000, 100, 2.0)]) is None
+
+
+def test_is_saturated_uses_first_step_p99():
+    first_step = (100, 100, 2.0)
+    assert not is_saturated((200, 200, 2.0 * SATURATION_P99_FACTOR), first_step)
+    assert is_saturated((200, 200, 2.0 * SATURATION_P99_FACTOR + 0.1), first_step)
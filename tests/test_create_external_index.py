@@ -0,0 +1,82 @@
+import os
+import sys
+import logging
+import numpy as np
+from core.benchmark_create import save_external_trials
+from core.utils import process
+from core.utils.constants import Extension, Dataset, Metric, EXTERNAL_PHASE_METRICS
+from core.utils.create_external_index import run_lantern_cli, BUILD_START_PATTERN
+from core.utils.process import ResultSink, RESULT_COLUMNS
+
+STANDIN = os.path.join(os.path.dirname(__file__), '..',
+                       'external', 'lantern_cli_standin.py')
+
+
+def get_standin_command(vectors_file, index_file, dim):
+    return [
+        sys.executable, STANDIN, 'create-index',
+        '-u', vectors_file,
+        '-t', 'sift_10k',
+        '-c', 'v',
+        '-m', '4',
+        '--ef', '8',
+        '--efc', '16',
+        '-d', str(dim),
+        '--out', index_file,
+    ]
+
+
+def test_standin_output_splits_export_and_build(tmp_path):
+    vectors = np.random.default_rng(0).random((200, 8), dtype=np.float32)
+    vectors_file = str(tmp_path / 'vectors.npy')
+    np.save(vectors_file, vectors)
+    index_file = str(tmp_path / 'index.usearch')
+
+    build_start, build_end = run_lantern_cli(
+        get_standin_command(vectors_file, index_file, 8))
+
+    assert build_start is not None
+    assert 0 < build_start <= build_end
+    # Header, then id, vector and base layer neighbors of every row
+    assert os.path.getsize(index_file) == 20 + 200 * (8 + 4 * 8 + 8 * 2 * 4)
+
+
+def test_build_start_pattern():
+    assert BUILD_START_PATTERN.search(
+        'Creating index with m=4, ef_construction=16, ef=8')
+    assert BUILD_START_PATTERN.search('[*] Building the index...')
+    assert not BUILD_START_PATTERN.search('Exported 200 vectors')
+
+
+def test_unsplit_output_is_one_build_phase(caplog):
+    command = [sys.executable, '-c', "print('done')"]
+    with caplog.at_level(logging.WARNING):
+        build_start, build_end = run_lantern_cli(command)
+    assert build_start is None
+    assert build_end > 0
+    assert 'BUILD_START_PATTERN' in caplog.text
+
+
+def test_save_external_trials_without_import(monkeypatch):
+    saved = []
+    monkeypatch.setattr(process, 'upsert_results', saved.extend)
+    results = [
+        {'export': 100, 'build': 300, 'transfer': 50, 'import': None,
+         'latency': 450, 'file_size': 4000},
+        {'export': 120, 'build': 280, 'transfer': 70, 'import': None,
+         'latency': 470, 'file_size': 4000},
+    ]
+    with ResultSink():
+        save_external_trials(results, [], extension=Extension.LANTERN, index_params={'external': True},
+                             dataset=Dataset.SIFT, n=10000)
+
+    metrics = {row[RESULT_COLUMNS.index('metric_type')]: row[RESULT_COLUMNS.index('metric_value')]
+               for row in saved}
+    assert metrics[Metric.CREATE_LATENCY.value] == 460
+    assert metrics[EXTERNAL_PHASE_METRICS['export'].value] == 110
+    assert metrics[EXTERNAL_PHASE_METRICS['build'].value] == 290
+    assert metrics[EXTERNAL_PHASE_METRICS['transfer'].value] == 60
+    assert EXTERNAL_PHASE_METRICS['import'].value not in metrics
+    assert metrics[Metric.EXTERNAL_INDEX_FILE_SIZE.value] == 4000
+    assert metrics[Metric.CREATE_EXTERNAL_THROUGHPUT.value] == (
+        10000 / 0.45 + 10000 / 0.47) / 2
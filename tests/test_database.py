@@ -0,0 +1,64 @@
+import threading
+import psycopg2
+import psycopg2.extensions
+import pytest
+from core.utils import database
+from core.utils.database import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.statements = []
+        self.info = type('Info', (), {
+            'transaction_status': psycopg2.extensions.TRANSACTION_STATUS_IDLE})()
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(psycopg2, 'connect', lambda *args, **kwargs: FakeConnection())
+    monkeypatch.setattr(database, 'POOL_MAX_CONNECTIONS', 4)
+    return ConnectionPool('postgres://localhost/test')
+
+
+def test_returned_connections_are_reused_and_discarded(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.statements == ['DISCARD ALL']
+    assert (pool.opened, pool.reused) == (1, 1)
+
+
+def test_counts_add_up_under_contention(pool):
+    def use_connections():
+        for _ in range(200):
+            pool.putconn(pool.getconn())
+
+    threads = [threading.Thread(target=use_connections) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.opened <= 4
+    assert pool.opened + pool.reused == 8 * 200
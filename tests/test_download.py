@@ -0,0 +1,40 @@
+import os
+import logging
+import pytest
+from core.utils.download import DatasetCache, DownloadCancelled
+
+UNREACHABLE_SOURCE = 'http://127.0.0.1:9/datasets'
+
+
+def test_existing_file_is_complete_when_source_is_unreachable(tmp_path, caplog):
+    (tmp_path / 'sift_base10k.csv').write_text('1,2,3\n')
+    with caplog.at_level(logging.WARNING), DatasetCache(str(tmp_path), UNREACHABLE_SOURCE) as cache:
+        assert cache.is_complete('sift_base10k.csv')
+        assert cache.manifest['sift_base10k.csv']['size'] == 6
+    assert 'assuming it is complete' in caplog.text
+
+
+def test_download_resumes_from_local_mirror(tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    (mirror / 'sift_base10k.csv').write_bytes(b'0123456789')
+    datapath = tmp_path / 'data'
+    datapath.mkdir()
+    (datapath / 'sift_base10k.csv.part').write_bytes(b'0123')
+
+    with DatasetCache(str(datapath), str(mirror)) as cache:
+        path = cache.get('sift_base10k.csv')
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    assert not os.path.exists(path + '.part')
+
+
+def test_closed_cache_stops_downloading(tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    (mirror / 'sift_base10k.csv').write_bytes(b'0123456789')
+    cache = DatasetCache(str(tmp_path / 'data'), str(mirror))
+    cache.close()
+    with pytest.raises(DownloadCancelled):
+        cache.download('sift_base10k.csv')
+    assert not os.path.exists(cache.get_path('sift_base10k.csv'))
@@ -0,0 +1,52 @@
+import random
+import pytest
+from core.utils.load import split_file, get_id_offsets, FileRange
+
+
+def write_csv(path, line_count, trailing_newline=True):
+    rng = random.Random(line_count)
+    lines = ['{' + ','.join(str(rng.random()) for _ in range(rng.randint(1, 20))) + '}'
+             for _ in range(line_count)]
+    content = '\n'.join(lines) + ('\n' if trailing_newline else '')
+    path.write_text(content)
+    return content.encode(), lines
+
+
+@pytest.mark.parametrize('line_count, count', [(1000, 1), (1000, 7), (1000, 64), (3, 8), (1, 4)])
+@pytest.mark.parametrize('trailing_newline', [True, False])
+def test_split_file_covers_file_on_line_boundaries(tmp_path, line_count, count, trailing_newline):
+    path = tmp_path / 'sift_base10k.csv'
+    content, lines = write_csv(path, line_count, trailing_newline)
+    ranges = split_file(str(path), count)
+
+    assert 1 <= len(ranges) <= count
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert start < end
+        assert start == 0 or content[start - 1:start] == b'\n'
+
+    # Rows numbered per range and offset as by parallel_copy_csv get the ids of their lines
+    range_lines = []
+    for start, end in ranges:
+        with FileRange(str(path), start, end) as f:
+            range_lines.append(f.read().decode().splitlines())
+    offsets = get_id_offsets([len(rows) for rows in range_lines])
+    ids = {offset + index + 1: row
+           for offset, rows in zip(offsets, range_lines) for index, row in enumerate(rows)}
+    assert ids == {index + 1: line for index, line in enumerate(lines)}
+
+
+def test_file_range_reads_in_chunks(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(bytes(range(100)))
+    with FileRange(str(path), 10, 50) as f:
+        chunks = [f.read(15) for _ in range(4)]
+    assert chunks == [bytes(range(10, 25)), bytes(range(25, 40)), bytes(range(40, 50)), b'']
+
+
+def test_id_offsets():
+    assert get_id_offsets([3, 0, 5, 2]) == [0, 3, 3, 8]
+    assert get_id_offsets([4]) == [0]
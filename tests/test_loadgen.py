@@ -0,0 +1,55 @@
+import math
+import random
+import pytest
+from fractions import Fraction
+from core.utils.loadgen import LatencyHistogram, HISTOGRAM_EXACT_BITS
+
+
+def get_bucket_width(value):
+    """Width of the histogram bucket that value is recorded in."""
+    if value < (1 << HISTOGRAM_EXACT_BITS):
+        return 1
+    return 1 << (value.bit_length() - HISTOGRAM_EXACT_BITS)
+
+
+def test_bucket_midpoints_map_back_to_their_bucket():
+    for value in [0, 1, 255, 256, 257, 511, 512, 1000, 12345, 10 ** 6, 10 ** 9]:
+        index = LatencyHistogram.get_index(value)
+        midpoint = LatencyHistogram.get_value(index)
+        assert LatencyHistogram.get_index(int(midpoint)) == index
+        assert abs(midpoint - value) <= get_bucket_width(value) / 2
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_percentile_error_stays_within_bucket(seed):
+    rng = random.Random(seed)
+    # Log-normal latencies from ~100 us to ~1 s, like a loaded server
+    latencies = [int(rng.lognormvariate(8, 1.5)) for _ in range(5000)]
+    histogram = LatencyHistogram()
+    for latency in latencies:
+        histogram.record(latency)
+
+    latencies.sort()
+    for percentile in [1, 50, 90, 95, 99, 99.9]:
+        # Nearest rank, computed exactly
+        rank = max(math.ceil(Fraction(str(percentile)) * len(latencies) / 100), 1)
+        exact = latencies[rank - 1]
+        assert abs(histogram.percentile(percentile) - exact) <= get_bucket_width(exact) / 2
+    assert histogram.percentile(100) == latencies[-1]
+    assert histogram.mean() == pytest.approx(sum(latencies) / len(latencies))
+
+
+def test_merged_histograms_match_one_histogram():
+    rng = random.Random(1)
+    latencies = [rng.randint(0, 10 ** 6) for _ in range(1000)]
+    merged, single = LatencyHistogram(), LatencyHistogram()
+    parts = [LatencyHistogram() for _ in range(4)]
+    for index, latency in enumerate(latencies):
+        parts[index % 4].record(latency)
+        single.record(latency)
+    for part in parts:
+        merged.merge(part)
+    assert merged.counts == single.counts
+    assert merged.percentile(99) == single.percentile(99)
+    assert merged.stddev() == pytest.approx(single.stddev())
+
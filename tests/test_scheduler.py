@@ -0,0 +1,159 @@
+import pytest
+from core import scheduler
+from core.scheduler import expand_plan, is_cell_saved, get_cell_id
+from core.utils.constants import Extension, Dataset, Metric
+from core.utils.process import dump_index_params
+
+HNSW_PARAMS = [
+    {'m': 16, 'ef_construction': 64, 'ef': 40},
+    {'m': 32, 'ef_construction': 128, 'ef': 40},
+    {'m': 16, 'ef_construction': 64, 'ef': 80},
+]
+
+
+def make_plan(**kwargs):
+    plan = {
+        'extensions': [Extension.PGVECTOR_HNSW, Extension.NONE],
+        'datasets': [Dataset.SIFT],
+        'N': ['10k', '100k'],
+        'K': [5, 10],
+        'phases': scheduler.PHASES,
+        'index_params': {Extension.PGVECTOR_HNSW: HNSW_PARAMS, Extension.NONE: [{}]},
+        'bulk': False,
+        'create_count': 10,
+        'warmup': 1,
+        'datapath': '/tmp',
+    }
+    plan.update(kwargs)
+    return plan
+
+
+def test_expand_plan_order():
+    cells = expand_plan(make_plan())
+    ids = [cell['id'] for cell in cells]
+
+    hnsw = []
+    for N in ['10k', '100k']:
+        hnsw += [f"create/pgvector_hnsw/sift/{N}/{dump_index_params(params)}" for params in HNSW_PARAMS]
+        # Selects of the same build follow each other
+        hnsw += [f"select/pgvector_hnsw/sift/{N}/{dump_index_params(HNSW_PARAMS[i])}" for i in [0, 2, 1]]
+        hnsw += [f"insert/pgvector_hnsw/sift/{N}/{dump_index_params(params)}" for params in HNSW_PARAMS]
+    none = []
+    for N in ['10k', '100k']:
+        none += [f"select/none/sift/{N}/{{}}", f"insert/none/sift/{N}/{{}}"]
+    assert ids == ['setup/pgvector_hnsw/sift'] + hnsw + ['setup/none/sift'] + none
+    assert len(set(ids)) == len(ids)
+    assert cells[0]['N_values'] == ['10k', '100k']
+
+
+def test_expand_plan_links():
+    cells = expand_plan(make_plan())
+    by_id = {cell['id']: cell for cell in cells}
+    for cell in cells:
+        if cell['phase'] == 'setup':
+            assert cell['depends'] is None
+        else:
+            assert cell['depends'] == get_cell_id('setup', cell['extension'], cell['dataset'])
+            assert cell['depends'] in by_id
+
+    selects = [cell for cell in cells if cell['phase'] == 'select']
+    hnsw_10k = [cell for cell in selects
+                if cell['extension'] == Extension.PGVECTOR_HNSW and cell['N'] == '10k']
+    build_16 = get_cell_id('build', Extension.PGVECTOR_HNSW, Dataset.SIFT, '10k',
+                           {'m': 16, 'ef_construction': 64})
+    build_32 = get_cell_id('build', Extension.PGVECTOR_HNSW, Dataset.SIFT, '10k',
+                           {'m': 32, 'ef_construction': 128})
+    assert [cell['build'] for cell in hnsw_10k] == [build_16, build_16, build_32]
+    assert [cell['build_params'] for cell in hnsw_10k] == [
+        {'m': 16, 'ef_construction': 64}, {'m': 16, 'ef_construction': 64},
+        {'m': 32, 'ef_construction': 128}]
+    # Builds are per N
+    assert all(cell['build'].split('/')[3] == cell['N'] for cell in selects
+               if cell['extension'] == Extension.PGVECTOR_HNSW)
+    assert all(cell['build'] is None for cell in selects if cell['extension'] == Extension.NONE)
+    assert all(cell['build'] is None for cell in cells if cell['phase'] != 'select')
+
+
+def test_expand_plan_without_setup():
+    cells = expand_plan(make_plan(phases=['select']))
+    assert {cell['phase'] for cell in cells} == {'select'}
+    assert all(cell['depends'] is None for cell in cells)
+
+
+class FakeConnection:
+    def __init__(self, count):
+        self.count = count
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def select_one(self, sql, data=None):
+        self.queries.append((sql, data))
+        return (self.count,)
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    def connect(count):
+        conn = FakeConnection(count)
+        monkeypatch.setattr(scheduler, 'DatabaseConnection', lambda *args: conn)
+        return conn
+    return connect
+
+
+def get_cell(phase):
+    plan = make_plan()
+    return next(cell for cell in expand_plan(plan)
+                if cell['phase'] == phase and cell['extension'] == Extension.PGVECTOR_HNSW), plan
+
+
+def test_select_cell_saved(connect):
+    cell, plan = get_cell('select')
+    conn = connect(2)
+    assert is_cell_saved(cell, plan, 'abc123')
+
+    (sql, data), = conn.queries
+    for column in ['clients', 'qps', 'write_pct', 'workers']:
+        assert f"r.{column} = 0" in sql
+    assert data == ('abc123', Metric.SELECT_LATENCY.value, 'pgvector_hnsw',
+                    dump_index_params(cell['index_params']), 'sift', 10000, [5, 10])
+
+    # Results for one of the two K do not count
+    connect(1)
+    assert not is_cell_saved(cell, plan, 'abc123')
+
+
+def test_bulk_cell_saved(connect):
+    cell, plan = get_cell('select')
+    conn = connect(2)
+    assert is_cell_saved(cell, {**plan, 'bulk': True}, 'abc123')
+    assert conn.queries[0][1][1] == Metric.SELECT_BULK_LATENCY.value
+
+
+@pytest.mark.parametrize('phase, metric', [
+    ('create', Metric.CREATE_LATENCY),
+    ('insert', Metric.INSERT_LATENCY),
+])
+def test_cell_saved_without_k(connect, phase, metric):
+    cell, plan = get_cell(phase)
+    conn = connect(1)
+    assert is_cell_saved(cell, plan, 'abc123')
+    data = conn.queries[0][1]
+    assert data[1] == metric.value
+    assert data[-1] == [0]
+
+    connect(0)
+    assert not is_cell_saved(cell, plan, 'abc123')
+
+
+def test_cell_never_saved(connect):
+    conn = connect(2)
+    setup, plan = get_cell('setup')
+    assert not is_cell_saved(setup, plan, 'abc123')
+    select, plan = get_cell('select')
+    assert not is_cell_saved(select, plan, None)
+    assert conn.queries == []
@@ -0,0 +1,52 @@
+import pytest
+from core.utils.loadgen import get_progress_line
+from core.utils.timeseries import parse_progress
+
+# stderr of pgbench 16 -P 5 -r --log, as captured by run_pgbench
+PGBENCH_STDERR = """pgbench (16.2 (Debian 16.2-1.pgdg120+2))
+starting vacuum...end.
+progress: 5.0 s, 2385.9 tps, lat 13.399 ms stddev 3.587, 0 failed
+progress: 10.0 s, 2401.2 tps, lat 13.313 ms stddev 3.418, 0 failed
+progress: 15.0 s, 0.0 tps, lat 0.000 ms stddev -nan, 0 failed
+"""
+
+
+def test_pgbench_progress():
+    assert parse_progress(PGBENCH_STDERR) == [
+        (5.0, 2385.9, 13.399, 3.587, None),
+        (10.0, 2401.2, 13.313, 3.418, None),
+        (15.0, 0.0, 0.0, None, None),
+    ]
+
+
+@pytest.mark.parametrize('line, sample', [
+    # pgbench 13 and older, without failures
+    ('progress: 5.0 s, 1181.8 tps, lat 6.762 ms stddev 2.100',
+     (5.0, 1181.8, 6.762, 2.1, None)),
+    # --rate
+    ('progress: 5.0 s, 99.8 tps, lat 1.441 ms stddev 0.456, 0 failed, lag 0.077 ms',
+     (5.0, 99.8, 1.441, 0.456, 0.077)),
+    # --rate with --latency-limit
+    ('progress: 20.0 s, 100.2 tps, lat 1.390 ms stddev 0.401, 0 failed, lag 0.069 ms, 0 skipped',
+     (20.0, 100.2, 1.39, 0.401, 0.069)),
+    # --rate with --max-tries
+    ('progress: 5.0 s, 98.6 tps, lat 1.502 ms stddev 0.610, 1 failed, 2 retried, 3 retries, lag 0.081 ms',
+     (5.0, 98.6, 1.502, 0.61, 0.081)),
+])
+def test_pgbench_progress_variants(line, sample):
+    assert parse_progress(f"{line}\n") == [sample]
+
+
+def test_native_progress_lines():
+    # 500 transactions of 2 ms in 5 s, each started 10 us after its schedule
+    line = get_progress_line(10, 5, (100, 100 * 2000, 100 * 2000 ** 2), (600, 600 * 2000, 600 * 2000 ** 2),
+                             (100, 1000, 0), (600, 6000, 0), rate=100)
+    assert parse_progress(line) == [(10.0, 100.0, 2.0, 0.0, 0.01)]
+
+    line = get_progress_line(5, 5, (0, 0, 0), (1, 3000, 3000 ** 2), None, None, rate=None)
+    assert parse_progress(line) == [(5.0, 0.2, 3.0, None, None)]
+
+
+def test_no_progress():
+    assert parse_progress(None) == []
+    assert parse_progress('pgbench: error: connection to server failed') == []
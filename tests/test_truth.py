@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from core.truth import search_blocks, normalize
+from core.utils.load import get_binary_encoder
+from core.utils.vector_files import read_vector_file, write_vecs, decode_array_rows, COPY_BINARY_HEADER, COPY_BINARY_TRAILER
+
+
+def get_blocks(vectors, block_size):
+    """Splits base vectors into (ids, vectors) blocks with ids starting at 1, like fetch_vectors."""
+    for start in range(0, len(vectors), block_size):
+        end = min(start + block_size, len(vectors))
+        yield np.arange(start + 1, end + 1), vectors[start:end]
+
+
+def brute_force_neighbors(base, queries, K):
+    similarities = normalize(queries) @ normalize(base).T
+    return np.argsort(-similarities, axis=1, kind='stable')[:, :K] + 1
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(7)
+    return rng.standard_normal((503, 16)).astype(np.float32), rng.standard_normal((37, 16)).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_size, workers', [
+    (503, 1),   # one block
+    (64, 1),    # partial last block
+    (64, 3),    # process pool with more blocks than workers
+    (7, 2),     # blocks smaller than K
+])
+def test_search_blocks_matches_brute_force(vectors, block_size, workers):
+    base, queries = vectors
+    expected = brute_force_neighbors(base, queries, 10)
+    neighbors = search_blocks(get_blocks(base, block_size), queries, K=10, workers=workers)
+    np.testing.assert_array_equal(neighbors, expected)
+
+
+def test_search_blocks_pads_missing_neighbors(vectors):
+    base, queries = vectors
+    neighbors = search_blocks(get_blocks(base[:4], 3), queries, K=6, workers=2)
+    np.testing.assert_array_equal(
+        neighbors[:, :4], brute_force_neighbors(base[:4], queries, 4))
+    assert (neighbors[:, 4:] == -1).all()
+
+
+def test_truth_file_loads_as_base_ids(tmp_path, vectors):
+    # generate_truth_file writes 0-based row numbers like the standard .ivecs files
+    base, queries = vectors
+    neighbors = brute_force_neighbors(base, queries, 10)
+    path = str(tmp_path / 'sift_10k_truth.ivecs')
+    write_vecs(path, (neighbors - 1).astype(np.int32))
+
+    rows = read_vector_file(path)
+    encode = get_binary_encoder(None, 'sift_10k_truth')
+    data = COPY_BINARY_HEADER + \
+        encode(np.arange(1, len(rows) + 1), np.asarray(rows)) + COPY_BINARY_TRAILER
+    ids, loaded = decode_array_rows(data, 10, '>i4')
+    np.testing.assert_array_equal(ids, np.arange(1, len(queries) + 1))
+    np.testing.assert_array_equal(loaded, neighbors)
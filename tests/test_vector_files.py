@@ -0,0 +1,115 @@
+import struct
+import numpy as np
+import pytest
+from core.utils.vector_files import (encode_vector_rows, encode_array_rows, decode_array_rows, read_vector_file,
+                                     write_vecs, BinaryCopyStream, COPY_BINARY_HEADER, COPY_BINARY_TRAILER,
+                                     FLOAT4_OID, INT4_OID)
+
+
+def parse_copy_binary(data):
+    """
+    Parses a binary COPY stream as PostgreSQL does: the signature, flags and
+    header extension, then rows of length-prefixed fields up to the -1 trailer.
+    """
+    assert data[:11] == b'PGCOPY\n\xff\r\n\x00'
+    flags, extension_length = struct.unpack_from('>ii', data, 11)
+    assert flags == 0
+    position = 19 + extension_length
+    rows = []
+    while True:
+        (field_count,) = struct.unpack_from('>h', data, position)
+        position += 2
+        if field_count == -1:
+            assert position == len(data)
+            return rows
+        fields = []
+        for _ in range(field_count):
+            (length,) = struct.unpack_from('>i', data, position)
+            position += 4
+            fields.append(data[position:position + length])
+            position += length
+        rows.append(fields)
+
+
+def parse_vector(field):
+    """pgvector's vector_recv: int16 dim, int16 unused, dim float4 values."""
+    dim, unused = struct.unpack_from('>hh', field)
+    assert unused == 0
+    assert len(field) == 4 + 4 * dim
+    return list(struct.unpack_from(f">{dim}f", field, 4))
+
+
+def parse_array(field):
+    """array_recv of a one-dimensional array without nulls."""
+    ndim, has_null, element_oid, dim, lower_bound = struct.unpack_from('>iiiii', field)
+    assert (ndim, has_null, lower_bound) == (1, 0, 1)
+    values = []
+    position = 20
+    for _ in range(dim):
+        (length,) = struct.unpack_from('>i', field, position)
+        assert length == 4
+        values.append(field[position + 4:position + 8])
+        position += 8
+    assert position == len(field)
+    code = 'i' if element_oid == INT4_OID else 'f'
+    assert element_oid in (INT4_OID, FLOAT4_OID)
+    return [struct.unpack('>' + code, value)[0] for value in values]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(3).standard_normal((5, 7)).astype(np.float32)
+
+
+def test_vector_rows_match_pgvector_format(vectors):
+    ids = np.arange(11, 16)
+    data = COPY_BINARY_HEADER + encode_vector_rows(ids, vectors) + COPY_BINARY_TRAILER
+    rows = parse_copy_binary(data)
+    assert [struct.unpack('>i', id)[0] for id, _ in rows] == ids.tolist()
+    np.testing.assert_array_equal([parse_vector(v) for _, v in rows], vectors)
+
+
+def test_float_array_rows_match_array_format(vectors):
+    ids = np.arange(1, 6)
+    data = COPY_BINARY_HEADER + encode_array_rows(ids, vectors, '>f4') + COPY_BINARY_TRAILER
+    rows = parse_copy_binary(data)
+    assert [struct.unpack('>i', id)[0] for id, _ in rows] == ids.tolist()
+    np.testing.assert_array_equal([parse_array(v) for _, v in rows], vectors)
+
+    decoded_ids, decoded = decode_array_rows(data, 7)
+    np.testing.assert_array_equal(decoded_ids, ids)
+    np.testing.assert_array_equal(decoded, vectors)
+
+
+def test_int_array_rows_match_array_format():
+    ids = np.arange(1, 4)
+    values = np.array([[0, 5, -1], [2 ** 31 - 1, 7, 8], [3, 2, 1]], dtype=np.int32)
+    data = COPY_BINARY_HEADER + encode_array_rows(ids, values, '>i4') + COPY_BINARY_TRAILER
+    assert [parse_array(v) for _, v in parse_copy_binary(data)] == values.tolist()
+    np.testing.assert_array_equal(decode_array_rows(data, 3, '>i4')[1], values)
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 4096, -1])
+def test_binary_copy_stream_encodes_every_row_once(vectors, read_size):
+    stream = BinaryCopyStream(vectors, 1, 5, encode_vector_rows, id_offset=1, block_size=2)
+    chunks = []
+    while chunk := stream.read(read_size):
+        chunks.append(chunk)
+    rows = parse_copy_binary(b''.join(chunks))
+    assert [struct.unpack('>i', id)[0] for id, _ in rows] == [2, 3, 4, 5]
+    np.testing.assert_array_equal([parse_vector(v) for _, v in rows], vectors[1:5])
+
+
+@pytest.mark.parametrize('file_extension, dtype', [('fvecs', np.float32), ('ivecs', np.int32)])
+def test_vecs_files_round_trip(tmp_path, file_extension, dtype):
+    values = (np.random.default_rng(4).standard_normal((6, 3)) * 100).astype(dtype)
+    path = str(tmp_path / f"sift_base10k.{file_extension}")
+    write_vecs(path, values)
+    np.testing.assert_array_equal(read_vector_file(path), values)
+
+
+def test_bvecs_file(tmp_path):
+    path = tmp_path / 'sift_base10k.bvecs'
+    rows = [struct.pack('<i', 3) + bytes([1, 2, 255]), struct.pack('<i', 3) + bytes([0, 9, 8])]
+    path.write_bytes(b''.join(rows))
+    np.testing.assert_array_equal(read_vector_file(str(path)), [[1, 2, 255], [0, 9, 8]])